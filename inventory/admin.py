@@ -1,70 +1,29 @@
 from django.contrib import admin
-from django.db import transaction
 from django.utils import timezone
-from datetime import date
 from django.contrib import messages
 
 # Register your models here.
 from django.contrib import admin
-from .models import Category, Supplier, Product, Customer, Staff, Discount, ProductDiscount, Sale, SaleDetail, InventoryLog
+from .models import Category, Supplier, Product, Customer, Staff, Discount, ProductDiscount, CategoryDiscount, Sale, SaleDetail, InventoryLog
+from .services import get_system_staff, expired_products, write_off_expired
 
 def writeoff_expired_products(modeladmin, request, queryset):
     """Admin action to write off expired products"""
-    today = date.today()
+    today = timezone.localdate()
     
     # Filter to only expired products with stock
-    expired_products = queryset.filter(
-        expiry_date__lt=today,
-        stock_quantity__gt=0
-    )
+    expired = expired_products(queryset, today)
     
-    if not expired_products.exists():
+    if not expired.exists():
         messages.info(request, 'No expired products found in the selected items.')
         return
     
-    # Get or create system staff member
-    try:
-        staff = Staff.objects.get(username='system')
-    except Staff.DoesNotExist:
-        staff = Staff.objects.create(
-            first_name='System',
-            last_name='User',
-            role='Admin',
-            username='system',
-            password_hash='system_user'
-        )
-    
-    # Process write-offs in a transaction
-    with transaction.atomic():
-        total_loss = 0
-        processed_count = 0
-        
-        for product in expired_products:
-            qty_before = product.stock_quantity
-            # Create inventory log entry
-            InventoryLog.objects.create(
-                staff=staff,
-                product=product,
-                log_type='Adjustment',
-                quantity=-qty_before,
-                remarks='expiry_writeoff',
-                log_date=timezone.now()
-            )
-            
-            # Calculate loss
-            loss_amount = qty_before * product.unit_cost
-            total_loss += loss_amount
-            
-            # Set stock quantity to 0
-            product.stock_quantity = 0
-            product.save()
-            
-            processed_count += 1
+    result = write_off_expired(get_system_staff(), queryset=queryset, today=today)
     
     messages.success(
         request,
-        f'Successfully wrote off {processed_count} expired products. '
-        f'Total loss: ${total_loss:.2f}'
+        f"Successfully wrote off {result['count']} expired products. "
+        f"Total loss: ${result['total_loss']:.2f}"
     )
 
 writeoff_expired_products.short_description = "Write off expired products"
@@ -76,7 +35,7 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ('product_name', 'brand')
     actions = [writeoff_expired_products]
 
-admin.site.register([Category, Supplier, Customer, Staff, Discount, ProductDiscount])
+admin.site.register([Category, Supplier, Customer, Staff, Discount, ProductDiscount, CategoryDiscount])
 @admin.register(Sale)
 class SaleAdmin(admin.ModelAdmin):
     list_display = ('receipt_no','sale_datetime','total_amount','staff','payment_method')
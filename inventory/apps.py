@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventory'
+
+    def ready(self):
+        # Connect the signal handlers that invalidate cached KPIs, record
+        # product deletions for catalog delta sync, publish live events,
+        # drop cached receipts of edited sales, refresh the discount index,
+        # keep stock lots in step with edited stock, ledger stock edits and
+        # take edited sales out of the rollup coverage
+        from . import kpi_cache, catalog, events, receipts, discounts, lots, ledger, rollups  # noqa: F401
@@ -0,0 +1,58 @@
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Product, ProductDeletion, CatalogVersion
+
+DEFAULT_CHANGES_LIMIT = 500
+MAX_CHANGES_LIMIT = 5000
+
+
+def changes_since(since, paths, limit=DEFAULT_CHANGES_LIMIT, after=None):
+    """
+    Products changed and deleted after catalog version `since`.
+
+    `paths` are the Product .values() paths to return. Changed rows come back
+    in (change_version, id) order, at most `limit` of them. Returns
+    {'version', 'after', 'products', 'deleted', 'has_more'}: send 'version'
+    as `since` (and 'after', when set) on the next call. 'after' is only set
+    mid-batch, because one sale or write-off stamps many products with the
+    same version. Changes committed but not yet stamped are stamped first.
+    """
+    CatalogVersion.stamp_pending()
+    changed = Product.objects.filter(change_version__gt=since)
+    if after is not None:
+        changed = Product.objects.filter(
+            Q(change_version__gt=since) | Q(change_version=since, pk__gt=after)
+        )
+    rows = list(
+        changed.order_by('change_version', 'pk')
+        .values(*{*paths, 'pk', 'change_version'})[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    deletions = ProductDeletion.objects.filter(change_version__gt=since)
+    if has_more:
+        # Stop at the last change returned so the next call resumes from it
+        deletions = deletions.filter(change_version__lte=rows[-1]['change_version'])
+    deletions = list(deletions.values_list('product_id', 'change_version'))
+
+    if has_more:
+        version, after = rows[-1]['change_version'], rows[-1]['pk']
+    else:
+        version = max([since] + [row['change_version'] for row in rows] + [v for _, v in deletions])
+        after = None
+    return {
+        'version': version,
+        'after': after,
+        'products': rows,
+        'deleted': [product_id for product_id, _ in deletions],
+        'has_more': has_more,
+    }
+
+
+@receiver(post_delete, sender=Product)
+def record_deletion(sender, instance, **kwargs):
+    ProductDeletion.objects.create(product_id=instance.pk, change_version=None)
+    CatalogVersion.stamp_on_commit()
@@ -0,0 +1,257 @@
+import heapq
+import threading
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Discount, ProductDiscount, CategoryDiscount
+
+VERSION_KEY = 'discounts:version'
+CENT = Decimal('0.01')
+ZERO = Decimal('0')
+# Dates whose rulebooks are kept built; in practice only today
+MAX_DATES = 32
+
+# Rules running on one date, each list in the order they are applied.
+# `lines` are BOGO discounts without product or category links: they
+# apply to every line, and are merged into each `categories` list up
+# front. `basket` are the other unlinked discounts, taken off the basket
+# total after the line discounts.
+Rulebook = namedtuple('Rulebook', 'products categories lines basket')
+
+
+def rule_order(discount):
+    return (-discount.priority, -discount.value, discount.id)
+
+
+def merge_rules(first, second):
+    """Two rule lists, each in rule_order, merged into one without duplicates."""
+    return [next(rules) for _, rules in groupby(heapq.merge(first, second, key=rule_order), key=rule_order)]
+
+
+class DiscountIndex:
+    """
+    Active discounts held in memory, so pricing a basket costs no query.
+
+    Loads every active discount that has not ended by `floor` (the day it
+    was built) with its ProductDiscount and CategoryDiscount links. The
+    rulebook for a date (product -> rules, category -> rules, line and
+    basket rules, all in application order) is built once per date.
+    """
+
+    def __init__(self, version, floor):
+        self.version = version
+        self.floor = floor
+        self.built_at = time.monotonic()
+        self.discounts = sorted(Discount.objects.filter(is_active=True, end_date__gte=floor), key=rule_order)
+        by_id = {discount.id: discount for discount in self.discounts}
+        self.product_links = list(
+            ProductDiscount.objects.filter(discount_id__in=by_id).values_list('product_id', 'discount_id')
+        )
+        self.category_links = list(
+            CategoryDiscount.objects.filter(discount_id__in=by_id).values_list('category_id', 'discount_id')
+        )
+        self._dates = {}
+
+    def rulebook(self, on_date):
+        rulebook = self._dates.get(on_date)
+        if rulebook is None:
+            rulebook = self._build(on_date)
+            if len(self._dates) >= MAX_DATES:
+                self._dates.clear()
+            self._dates[on_date] = rulebook
+        return rulebook
+
+    def _build(self, on_date):
+        running = {d.id: d for d in self.discounts if d.start_date <= on_date <= d.end_date}
+        linked = set()
+
+        def group(links):
+            rules = defaultdict(list)
+            for key, discount_id in links:
+                if discount_id in running:
+                    linked.add(discount_id)
+                    rules[key].append(running[discount_id])
+            return {key: sorted(set(discounts), key=rule_order) for key, discounts in rules.items()}
+
+        products = group(self.product_links)
+        categories = group(self.category_links)
+        unlinked = [d for d in self.discounts if d.id in running and d.id not in linked]
+        lines = [d for d in unlinked if d.discount_type == 'BOGO']
+        if lines:
+            categories = {key: merge_rules(rules, lines) for key, rules in categories.items()}
+        return Rulebook(products, categories, lines, [d for d in unlinked if d.discount_type != 'BOGO'])
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _version():
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def _stale(index, version, on_date):
+    max_age = getattr(settings, 'DISCOUNT_INDEX_MAX_AGE', 60)
+    return (index is None or index.version != version or on_date < index.floor
+            or time.monotonic() - index.built_at >= max_age)
+
+
+def get_index(on_date=None):
+    """
+    The current DiscountIndex, rebuilt when discounts have changed or
+    `on_date` is before its floor. The version key only reaches processes
+    sharing the cache, so an index is also rebuilt once it is
+    DISCOUNT_INDEX_MAX_AGE seconds old: other workers pick up a change
+    within that time.
+    """
+    global _index
+    on_date = on_date or timezone.localdate()
+    version = _version()
+    index = _index
+    if _stale(index, version, on_date):
+        with _lock:
+            index = _index
+            if _stale(index, version, on_date):
+                index = DiscountIndex(version, min(on_date, timezone.localdate()))
+                _index = index
+    return index
+
+
+def invalidate():
+    """
+    Rebuild the index on next use. Saves and deletes of discounts and their
+    links call this; call it too after queryset.update() on them.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        cache.incr(VERSION_KEY)
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+@receiver(post_save, sender=ProductDiscount)
+@receiver(post_delete, sender=ProductDiscount)
+@receiver(post_save, sender=CategoryDiscount)
+@receiver(post_delete, sender=CategoryDiscount)
+def invalidate_on_change(sender, **kwargs):
+    # After commit, so no process reloads before the change is visible
+    transaction.on_commit(invalidate)
+
+
+# ---------------------------------------------------------
+# PRICING
+# ---------------------------------------------------------
+def free_units(discount, quantity):
+    """Units of `quantity` that a BOGO discount gives away."""
+    buy = discount.buy_quantity or 1
+    get = discount.get_quantity or int(discount.value)
+    if get <= 0:
+        return 0
+    return quantity // (buy + get) * get
+
+
+def line_amount(discount, detail, base):
+    """What `discount` takes off a line worth `base` after manual discounts."""
+    if discount.discount_type == 'Percentage':
+        return base * discount.value / 100
+    elif discount.discount_type == 'Fixed':
+        # Off each unit, never below zero
+        return min(discount.value, detail.unit_price) * detail.quantity_sold
+    elif discount.discount_type == 'BOGO':
+        return detail.unit_price * free_units(discount, detail.quantity_sold)
+    return ZERO
+
+
+def basket_amount(discount, total):
+    """What a basket-level `discount` takes off a basket worth `total`."""
+    if discount.discount_type == 'Percentage':
+        return total * discount.value / 100
+    elif discount.discount_type == 'Fixed':
+        return discount.value
+    return ZERO
+
+
+def take(rules, base, amount_of):
+    """
+    Walk `rules` in order, taking amount_of(rule) off `base` each time,
+    never more than is left. An exclusive rule applies only if it comes
+    first, and then ends the walk. Returns (taken, [(rule, amount)]).
+    """
+    taken = ZERO
+    applied = []
+    for rule in rules:
+        if rule.exclusive and applied:
+            continue
+        amount = min(amount_of(rule).quantize(CENT, rounding=ROUND_HALF_UP), base - taken)
+        if amount <= 0:
+            continue
+        taken += amount
+        applied.append((rule, amount))
+        if rule.exclusive or taken >= base:
+            break
+    return taken, applied
+
+
+def line_rules(rulebook, detail):
+    """Rules for one line: its product's, its category's and the every-line ones, in order."""
+    shared = rulebook.categories.get(detail.product.category_id, rulebook.lines)
+    product_rules = rulebook.products.get(detail.product_id)
+    if not product_rules:
+        return shared
+    return merge_rules(product_rules, shared) if shared else product_rules
+
+
+def price_basket(details, on_date=None):
+    """
+    Apply the promotions running on `on_date` to unsaved SaleDetail lines.
+
+    Each line gets its product-, category- and every-line rules: its
+    `discount` is set to the first one applied and the promotion amount is
+    added to `discount_value` (any manual discount stays). Line sub_totals
+    are then filled in and the basket-level rules taken off their sum.
+    One pass over the basket, no queries. Returns {'gross', 'lines',
+    'basket', 'total', 'basket_discount', 'applied'}: the amounts taken off
+    by line and basket rules, the first basket rule applied, and every
+    application as {'discount', 'amount'}.
+    """
+    on_date = on_date or timezone.localdate()
+    rulebook = get_index(on_date).rulebook(on_date)
+    gross = lines_taken = ZERO
+    applied = []
+    for detail in details:
+        line_gross = detail.unit_price * detail.quantity_sold
+        manual = detail.discount_value or ZERO
+        gross += line_gross
+        taken, line_applied = take(
+            line_rules(rulebook, detail), line_gross - manual,
+            lambda rule: line_amount(rule, detail, line_gross - manual),
+        )
+        if line_applied:
+            detail.discount = line_applied[0][0]
+            detail.discount_value = manual + taken
+            lines_taken += taken
+            applied += line_applied
+        detail.sub_total = line_gross - (detail.discount_value or ZERO)
+
+    net = sum((detail.sub_total for detail in details), ZERO)
+    basket_taken, basket_applied = take(rulebook.basket, net, lambda rule: basket_amount(rule, net))
+    applied += basket_applied
+    return {
+        'gross': gross,
+        'lines': lines_taken,
+        'basket': basket_taken,
+        'basket_discount': basket_applied[0][0] if basket_applied else None,
+        'total': net - basket_taken,
+        'applied': [{'discount': rule, 'amount': amount} for rule, amount in applied],
+    }
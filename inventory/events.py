@@ -0,0 +1,166 @@
+import asyncio
+import itertools
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import InventoryLog, Product, Sale, Staff
+from .utils import day_range
+
+TOPICS = ('inventory_log', 'stock', 'sales')
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class InProcessBroker:
+    """
+    Fan-out of live events to the SSE connections of this process.
+
+    publish() may be called from any thread (sync views run in a worker
+    thread under ASGI); each subscriber gets its own bounded asyncio queue
+    on the event loop that opened it. A subscriber too slow to drain its
+    queue loses events rather than holding up the publisher.
+
+    Another backend (e.g. Redis pub/sub, to share events between worker
+    processes) only needs the same publish/subscribe/unsubscribe methods;
+    select it with the LIVE_EVENTS_BACKEND setting.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self):
+        """Register the calling coroutine's loop; returns a queue of (id, topic, data)."""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def publish(self, topic, data):
+        event = (next(self._ids), topic, data)
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # Loop already closed; the stream's cleanup will unsubscribe
+                pass
+
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = getattr(settings, 'LIVE_EVENTS_BACKEND', 'inventory.events.InProcessBroker')
+                _broker = import_string(backend)()
+    return _broker
+
+
+def publish_on_commit(topic, data):
+    """Publish once the surrounding transaction commits (immediately in autocommit)."""
+    transaction.on_commit(lambda: get_broker().publish(topic, data))
+
+
+# ---------------------------------------------------------
+# EVENT PAYLOADS
+# ---------------------------------------------------------
+def publish_logs(logs):
+    """
+    Announce new InventoryLog rows, e.g. after a bulk_create. Product and
+    staff names are looked up once at commit so browsers need no follow-up
+    request.
+    """
+    logs = list(logs)
+    if not logs:
+        return
+
+    def publish():
+        products = dict(Product.objects.filter(id__in={log.product_id for log in logs})
+                        .values_list('id', 'product_name'))
+        staff = {
+            pk: f"{first} {last}"
+            for pk, first, last in Staff.objects.filter(id__in={log.staff_id for log in logs})
+            .values_list('id', 'first_name', 'last_name')
+        }
+        broker = get_broker()
+        for log in logs:
+            broker.publish('inventory_log', {
+                'id': log.id,
+                'log_date': log.log_date.isoformat(),
+                'product_id': log.product_id,
+                'product_name': products.get(log.product_id, ''),
+                'log_type': log.log_type,
+                'reason': log.reason,
+                'quantity': log.quantity,
+                'staff_name': staff.get(log.staff_id, ''),
+                'remarks': log.remarks,
+            })
+
+    transaction.on_commit(publish)
+
+
+def publish_stock(levels, change_version=None):
+    """Announce new stock levels given as {product_id: stock_quantity}."""
+    if levels:
+        publish_on_commit('stock', {
+            'change_version': change_version,
+            'levels': [{'product_id': pk, 'stock_quantity': qty} for pk, qty in levels.items()],
+        })
+
+
+def todays_sales_totals():
+    today = timezone.localdate()
+    start, end = day_range(today, today)
+    totals = Sale.objects.filter(sale_datetime__gte=start, sale_datetime__lt=end).aggregate(
+        revenue=Sum('total_amount'), orders=Count('id'),
+    )
+    return {
+        'date': today.isoformat(),
+        'revenue': float(totals['revenue'] or 0),
+        'orders': totals['orders'],
+    }
+
+
+@receiver(post_save, sender=InventoryLog)
+def publish_saved_log(sender, instance, created, **kwargs):
+    if created:
+        publish_logs([instance])
+
+
+@receiver(post_save, sender=Product)
+def publish_saved_stock(sender, instance, **kwargs):
+    # Product.save() stamps change_version after post_save, so read it at commit
+    transaction.on_commit(lambda: get_broker().publish('stock', {
+        'change_version': instance.change_version,
+        'levels': [{'product_id': instance.pk, 'stock_quantity': instance.stock_quantity}],
+    }))
+
+
+@receiver(post_save, sender=Sale)
+def publish_sales_totals(sender, instance, **kwargs):
+    # One aggregate per sale, shared by every connected dashboard
+    transaction.on_commit(lambda: get_broker().publish('sales', todays_sales_totals()))
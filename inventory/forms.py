@@ -51,6 +51,10 @@ class DiscountForm(forms.ModelForm):
             'start_date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
             'end_date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+            'priority': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
+            'exclusive': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+            'buy_quantity': forms.NumberInput(attrs={'class': 'form-control', 'min': '1', 'placeholder': '1'}),
+            'get_quantity': forms.NumberInput(attrs={'class': 'form-control', 'min': '1', 'placeholder': '1'}),
         }
     
     def __init__(self, *args, **kwargs):
@@ -94,6 +98,12 @@ class PurchaseOrderDetailForm(forms.ModelForm):
         fields = '__all__'
         
 class InventoryLogForm(forms.ModelForm):
+    # Purchases: the delivered lot, for first-expiry-first-out picking
+    batch_number = forms.CharField(max_length=50, required=False,
+                                   widget=forms.TextInput(attrs={'class': 'form-control'}))
+    expiry_date = forms.DateField(required=False,
+                                  widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+
     class Meta:
         model = InventoryLog
         fields = '__all__'
@@ -101,6 +111,7 @@ class InventoryLogForm(forms.ModelForm):
             'staff': forms.Select(attrs={'class': 'form-select'}),
             'product': forms.Select(attrs={'class': 'form-select'}),
             'log_type': forms.Select(attrs={'class': 'form-select'}),
+            'reason': forms.Select(attrs={'class': 'form-select'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control', 'min': '1'}),
             'log_date': forms.DateTimeInput(attrs={'type': 'datetime-local', 'class': 'form-control'}),
             'remarks': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Additional remarks...'}),
@@ -0,0 +1,86 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Sale
+
+GENERATION_KEY = 'kpi:generation'
+HITS_KEY = 'kpi:hits'
+MISSES_KEY = 'kpi:misses'
+
+
+def _generation():
+    return cache.get_or_set(GENERATION_KEY, 1, timeout=None)
+
+
+def _key(parts):
+    return ':'.join(['kpi', str(_generation()), *map(str, parts)])
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+async def get_kpis(start_date, end_date, compute):
+    """
+    Return the KPI payload for the inclusive day range, awaiting `compute()`
+    only on a cache miss. Returns (payload, hit).
+    """
+    return await get_cached((start_date or 'all', end_date or 'now'), compute)
+
+
+async def get_cached(parts, compute):
+    """
+    get_kpis() for any payload derived from sales: cached under the key
+    `parts`, until the next sale is recorded. Returns (payload, hit).
+    """
+    key = await sync_to_async(_key)(parts)
+    payload = await cache.aget(key)
+    if payload is not None:
+        await sync_to_async(_count)(HITS_KEY)
+        return payload, True
+
+    await sync_to_async(_count)(MISSES_KEY)
+    payload = await compute()
+    await cache.aset(key, payload, timeout=getattr(settings, 'KPI_CACHE_TIMEOUT', 60))
+    return payload, False
+
+
+def invalidate():
+    """
+    Drop every cached payload by moving to a new key generation.
+    Old entries are never read again and age out of the cache.
+    """
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        cache.incr(GENERATION_KEY)
+
+
+def stats():
+    """Hit/miss counters since the cache was last cleared."""
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / lookups, 4) if lookups else None,
+        'generation': _generation(),
+    }
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def invalidate_on_sale_change(sender, **kwargs):
+    # Wait for the commit so a concurrent poll cannot re-cache the
+    # pre-sale numbers under the new generation.
+    transaction.on_commit(invalidate)
@@ -0,0 +1,155 @@
+from django.db import transaction
+from django.db.models import BigIntegerField, Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, StockLedgerEntry, StockSnapshot
+
+
+def record(changes, reason, reference='', when=None):
+    """
+    Append one signed entry per product in {product_id: delta}, in a
+    single INSERT. Zero deltas are skipped. Call in the transaction that
+    changes stock_quantity, with the products locked.
+    """
+    when = when or timezone.now()
+    return StockLedgerEntry.objects.bulk_create([
+        StockLedgerEntry(product_id=product_id, quantity=delta, reason=reason, reference=reference[:100], created_at=when)
+        for product_id, delta in changes.items() if delta
+    ])
+
+
+@receiver(post_save, sender=Product)
+def record_saved_stock(sender, instance, created, raw=False, **kwargs):
+    # Stock edited through save() (product form, adjustments, deliveries,
+    # admin): ledger the difference from the stock as loaded
+    if raw:
+        return
+    previous = 0 if created else getattr(instance, '_saved_stock', None)
+    if previous is not None and instance.stock_quantity != previous:
+        reason = getattr(instance, 'stock_reason', None) or ('opening' if created else 'count_correction')
+        record({instance.pk: instance.stock_quantity - previous}, reason)
+    instance._saved_stock = instance.stock_quantity
+    instance.stock_reason = None
+
+
+# ---------------------------------------------------------
+# BALANCES
+# ---------------------------------------------------------
+def _snapshots(when=None):
+    snapshots = StockSnapshot.objects.filter(product=OuterRef('pk'))
+    if when is not None:
+        snapshots = snapshots.filter(as_of__lte=when)
+    return snapshots.order_by('-entry_id')
+
+
+def _tail(when=None):
+    entries = StockLedgerEntry.objects.filter(product=OuterRef('pk'), id__gt=OuterRef('snapshot_entry'))
+    if when is not None:
+        entries = entries.filter(created_at__lte=when)
+    return entries.order_by().values('product')
+
+
+def with_balances(queryset, when=None):
+    """
+    Annotate products with `ledger_quantity`, their stock according to the
+    ledger at `when` (default now): the nearest snapshot at or before it
+    plus the entries written since, never the whole history. Also
+    annotates the `snapshot_entry` and `snapshot_quantity` used.
+    """
+    snapshots = _snapshots(when)
+    return queryset.annotate(
+        snapshot_entry=Coalesce(Subquery(snapshots.values('entry_id')[:1]), 0, output_field=BigIntegerField()),
+        snapshot_quantity=Coalesce(Subquery(snapshots.values('quantity')[:1]), 0, output_field=IntegerField()),
+    ).annotate(
+        ledger_quantity=F('snapshot_quantity') + Coalesce(
+            Subquery(_tail(when).annotate(total=Sum('quantity')).values('total')), 0, output_field=IntegerField(),
+        ),
+    )
+
+
+def stock_on(when, product_ids=None):
+    """{product_id: stock} at `when`, from the ledger, in one query."""
+    products = Product.objects.all() if product_ids is None else Product.objects.filter(id__in=product_ids)
+    return dict(with_balances(products, when).values_list('id', 'ledger_quantity'))
+
+
+# ---------------------------------------------------------
+# SNAPSHOTS
+# ---------------------------------------------------------
+def take_snapshots(chunk_size=500, min_entries=1):
+    """
+    Checkpoint every product with at least `min_entries` ledger entries
+    since its last snapshot. Products are handled in id order, `chunk_size`
+    per transaction, locked with SKIP LOCKED: every ledger write happens
+    under the product lock, so no uncommitted entry can fall behind the
+    checkpoint, and products a till is selling wait for the next run.
+    Returns the number of snapshots taken.
+    """
+    taken = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            product_ids = list(
+                Product.objects.select_for_update(skip_locked=True)
+                .filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not product_ids:
+                break
+            last_id = product_ids[-1]
+
+            latest = _tail().order_by('-id')
+            rows = with_balances(Product.objects.filter(id__in=product_ids)).annotate(
+                tail_entries=Subquery(_tail().annotate(n=Count('id')).values('n')),
+                last_entry=Subquery(latest.values('id')[:1]),
+                last_at=Subquery(latest.values('created_at')[:1]),
+            ).filter(tail_entries__gte=min_entries).values_list('id', 'last_entry', 'ledger_quantity', 'last_at')
+            taken += len(StockSnapshot.objects.bulk_create([
+                StockSnapshot(product_id=product_id, entry_id=entry_id, quantity=quantity, as_of=as_of)
+                for product_id, entry_id, quantity, as_of in rows
+            ]))
+
+        if len(product_ids) < chunk_size:
+            break
+    return taken
+
+
+# ---------------------------------------------------------
+# RECONCILIATION
+# ---------------------------------------------------------
+def reconcile(chunk_size=500, fix=False):
+    """
+    Compare every product's ledger balance with its stock_quantity, in id
+    order, `chunk_size` products per query. Yields (checked, mismatches)
+    per chunk, mismatches being [(product_id, product_name, stock_quantity,
+    ledger_quantity)]. With `fix`, a count_correction entry makes up each
+    difference, re-checked under the product lock first.
+    """
+    last_id = 0
+    while True:
+        rows = list(
+            with_balances(Product.objects.filter(id__gt=last_id).order_by('id'))
+            .values_list('id', 'product_name', 'stock_quantity', 'ledger_quantity')[:chunk_size]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        mismatches = [row for row in rows if row[2] != row[3]]
+
+        if fix and mismatches:
+            with transaction.atomic():
+                locked = list(
+                    Product.objects.select_for_update().filter(id__in=[row[0] for row in mismatches])
+                    .order_by('id').values_list('id', flat=True)
+                )
+                record({
+                    product_id: stock - balance
+                    for product_id, stock, balance in with_balances(Product.objects.filter(id__in=locked))
+                    .values_list('id', 'stock_quantity', 'ledger_quantity')
+                }, 'count_correction', 'Ledger reconciliation')
+
+        yield len(rows), mismatches
+        if len(rows) < chunk_size:
+            return
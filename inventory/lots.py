@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, StockLot, LotAllocation
+
+# First expired, first out; lots without an expiry date go last
+FEFO_ORDER = (F('expiry_date').asc(nulls_last=True), 'id')
+
+
+def take_from_lots(changes):
+    """Subtract {lot_id: qty} from the lots in one UPDATE."""
+    if changes:
+        StockLot.objects.filter(id__in=changes.keys()).update(quantity=Case(
+            *[When(id=lot_id, then=F('quantity') - Value(qty)) for lot_id, qty in changes.items()],
+            default=F('quantity'), output_field=IntegerField(),
+        ))
+
+
+def pick(lots, quantity, taken):
+    """
+    Take up to `quantity` units from `lots` (in FEFO order, quantities
+    updated in place), skipping emptied lots. Adds to `taken`
+    {lot_id: qty}; returns [(lot, qty)] for this pick.
+    """
+    picked = []
+    for lot in lots:
+        if not quantity:
+            break
+        if lot.quantity <= 0:
+            continue
+        qty = min(quantity, lot.quantity)
+        lot.quantity -= qty
+        quantity -= qty
+        taken[lot.id] = taken.get(lot.id, 0) + qty
+        picked.append((lot, qty))
+    return picked
+
+
+def allocate_sale(details, today=None):
+    """
+    Pick the lots for a basket of unsaved SaleDetail lines and take the
+    units from them. A line's own batch_number (the batch the cashier
+    scanned) is used first while it has stock; the rest comes earliest
+    expiry first. Lots that expired before `today` are never sold. Lines
+    get the batches they came from unless their scanned batch covered them.
+    Returns unsaved LotAllocation rows (sale not set). Lot reads and the
+    lot UPDATE are one query each; call with the products locked. Stock
+    no lot accounts for is sold without one.
+    """
+    today = today or timezone.localdate()
+    lots = defaultdict(list)
+    for lot in StockLot.objects.filter(
+        product_id__in={detail.product_id for detail in details}, quantity__gt=0
+    ).exclude(expiry_date__lt=today).order_by('product_id', *FEFO_ORDER):
+        lots[lot.product_id].append(lot)
+
+    taken = {}
+    allocations = []
+    for detail in details:
+        candidates = lots[detail.product_id]
+        if detail.batch_number:
+            # Stable sort: the scanned batch first, FEFO otherwise
+            candidates = sorted(candidates, key=lambda lot: lot.batch_number != detail.batch_number)
+        picked = pick(candidates, detail.quantity_sold, taken)
+        allocations += [LotAllocation(lot=lot, quantity=qty) for lot, qty in picked]
+        batches = list(dict.fromkeys(lot.batch_number for lot, _ in picked if lot.batch_number))
+        if batches and batches != [detail.batch_number]:
+            detail.batch_number = ', '.join(batches)[:45]
+    take_from_lots(taken)
+    return allocations
+
+
+def expired_stock(product_ids, today=None):
+    """{product_id: units in lots that expired before `today`}, which cannot be sold."""
+    today = today or timezone.localdate()
+    return dict(
+        StockLot.objects.filter(product_id__in=product_ids, quantity__gt=0, expiry_date__lt=today)
+        .values_list('product_id').annotate(units=Sum('quantity')).order_by()
+    )
+
+
+def receive_lot(product, quantity, batch_number=None, expiry_date=None, unit_cost=None):
+    """
+    Record a delivery of `quantity` units as a new lot. Raise the product's
+    stock_quantity by the same amount (and save it) afterwards, or the next
+    save treats the lot as surplus.
+    """
+    return StockLot.objects.create(
+        product=product,
+        batch_number=batch_number or product.batch_number,
+        expiry_date=expiry_date or product.expiry_date,
+        quantity=quantity,
+        unit_cost=product.unit_cost if unit_cost is None else unit_cost,
+    )
+
+
+def sync_lots(product):
+    """
+    Make `product`'s lots add up to its stock_quantity after a direct edit
+    (product form, stock adjustment, admin): extra stock becomes a lot with
+    the product's batch and expiry, missing stock is taken FEFO.
+    """
+    lots = list(product.lots.filter(quantity__gt=0).order_by(*FEFO_ORDER))
+    difference = product.stock_quantity - sum(lot.quantity for lot in lots)
+    if difference > 0:
+        receive_lot(product, difference)
+    elif difference < 0:
+        taken = {}
+        pick(lots, -difference, taken)
+        take_from_lots(taken)
+
+
+@receiver(post_save, sender=Product)
+def sync_saved_product_lots(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_lots(instance)
@@ -1,8 +1,6 @@
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from django.utils import timezone
-from datetime import date
-from inventory.models import Product, InventoryLog, Staff
+from inventory.models import Staff
+from inventory.services import get_system_staff, expired_stock_summary, write_off_expired
 
 
 class Command(BaseCommand):
@@ -15,85 +13,53 @@ class Command(BaseCommand):
             help='Username of staff member performing the write-off (defaults to "system")',
             default='system'
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Number of products locked and written off per transaction',
+            default=500
+        )
 
     def handle(self, *args, **options):
         username = options['username']
-        today = date.today()
         
         # Get or create system staff member
-        try:
-            staff = Staff.objects.get(username=username)
-        except Staff.DoesNotExist:
-            if username == 'system':
-                # Create system staff if it doesn't exist
-                staff = Staff.objects.create(
-                    first_name='System',
-                    last_name='User',
-                    role='Admin',
-                    username='system',
-                    password_hash='system_user'
-                )
+        if username == 'system':
+            if not Staff.objects.filter(username='system').exists():
                 self.stdout.write(
-                    self.style.WARNING(f'Created system user: {staff.username}')
+                    self.style.WARNING('Created system user: system')
                 )
-            else:
+            staff = get_system_staff()
+        else:
+            staff = Staff.objects.filter(username=username).first()
+            if staff is None:
                 self.stdout.write(
                     self.style.ERROR(f'Staff member with username "{username}" not found')
                 )
                 return
 
-        # Query expired products with stock
-        expired_products = Product.objects.filter(
-            expiry_date__lt=today,
-            stock_quantity__gt=0
-        )
-
-        if not expired_products.exists():
+        summary = expired_stock_summary()
+        if not summary['product_count']:
             self.stdout.write(
                 self.style.SUCCESS('No expired products found to write off')
             )
             return
 
         self.stdout.write(
-            f'Found {expired_products.count()} expired products to write off'
+            f"Found {summary['product_count']} expired products to write off"
         )
 
-        # Process write-offs in a transaction
-        with transaction.atomic():
-            total_loss = 0
-            processed_count = 0
-            
-            for product in expired_products:
-                qty_before = product.stock_quantity
+        result = write_off_expired(staff, chunk_size=options['chunk_size'])
 
-                # Create inventory log entry
-                InventoryLog.objects.create(
-                    staff=staff,
-                    product=product,
-                    log_type='Adjustment',
-                    quantity=-qty_before,
-                    remarks='expiry_writeoff',
-                    log_date=timezone.now()
-                )
-                
-                # Calculate loss
-                loss_amount = qty_before * product.unit_cost
-                total_loss += loss_amount
-                
-                # Set stock quantity to 0
-                product.stock_quantity = 0
-                product.save()
-                
-                processed_count += 1
-                
-                self.stdout.write(
-                    f'Write-off: {product.product_name} - '
-                    f'{qty_before} units (${loss_amount:.2f})'
-                )
+        for product_name, qty, loss_amount in result['items']:
+            self.stdout.write(
+                f'Write-off: {product_name} - '
+                f'{qty} units (${loss_amount:.2f})'
+            )
 
         self.stdout.write(
             self.style.SUCCESS(
-                f'Successfully wrote off {processed_count} expired products. '
-                f'Total loss: ${total_loss:.2f}'
+                f"Successfully wrote off {result['count']} expired products. "
+                f"Total loss: ${result['total_loss']:.2f}"
             )
         )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from inventory import rollups
+
+
+class Command(BaseCommand):
+    help = 'Backfill or rebuild the daily sales rollup used by the reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='start',
+            type=str,
+            help='First day to rebuild (YYYY-MM-DD). Defaults to the first sale.'
+        )
+        parser.add_argument(
+            '--to',
+            dest='end',
+            type=str,
+            help='Last day to rebuild (YYYY-MM-DD). Defaults to today.'
+        )
+
+    def handle(self, *args, **options):
+        start = self._parse(options['start'], '--from')
+        end = self._parse(options['end'], '--to')
+        if start and end and start > end:
+            raise CommandError('--from must not be after --to')
+
+        self.stdout.write(
+            f'Rebuilding sales rollup from {start or "the first sale"} to {end or "today"}'
+        )
+        written = rollups.rebuild(start, end)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Wrote {written} rollup rows')
+        )
+
+    def _parse(self, value, option):
+        if not value:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f'{option} must be a date in YYYY-MM-DD format')
+        return parsed
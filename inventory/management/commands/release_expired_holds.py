@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from inventory.services import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Give back stock held for baskets whose holds have expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Products released per transaction',
+            default=500
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep sweeping instead of exiting after one pass'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            help='Seconds to wait between sweeps (with --loop)',
+            default=30
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds(chunk_size=options['chunk_size'])
+            if released or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Released {released} held units"))
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
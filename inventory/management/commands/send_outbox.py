@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from inventory import outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails (purchase orders to suppliers), retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Emails claimed per batch',
+            default=50
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Emails sent concurrently',
+            default=4
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling for due emails instead of exiting after one pass'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            help='Seconds to wait between polls when the outbox is empty (with --loop)',
+            default=30
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            results = outbox.send_due(limit=options['limit'], workers=options['workers'])
+            if any(results.values()):
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Sent {results['sent']}, retrying {results['retrying']}, "
+                        f"failed {results['failed']}"
+                    )
+                )
+            if not options['loop']:
+                if not any(results.values()):
+                    self.stdout.write('No emails due')
+                return
+            if results['sent'] + results['retrying'] + results['failed'] < options['limit']:
+                close_old_connections()
+                time.sleep(options['interval'])
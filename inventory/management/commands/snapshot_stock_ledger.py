@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from inventory.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Checkpoint stock ledger balances so stock-on-date reads stay short'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Products checkpointed per transaction',
+            default=500
+        )
+        parser.add_argument(
+            '--min-entries',
+            type=int,
+            help='Only checkpoint products with at least this many entries since their last snapshot',
+            default=1
+        )
+
+    def handle(self, *args, **options):
+        taken = take_snapshots(chunk_size=options['chunk_size'], min_entries=options['min_entries'])
+        self.stdout.write(self.style.SUCCESS(f"Took {taken} stock snapshots"))
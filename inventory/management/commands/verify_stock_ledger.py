@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from inventory.ledger import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Reconcile the stock ledger against product stock quantities'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Products compared per query',
+            default=500
+        )
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Write count corrections so the ledger matches stock_quantity'
+        )
+
+    def handle(self, *args, **options):
+        checked = mismatched = 0
+        for count, mismatches in reconcile(chunk_size=options['chunk_size'], fix=options['fix']):
+            checked += count
+            mismatched += len(mismatches)
+            for product_id, product_name, stock, balance in mismatches:
+                self.stdout.write(self.style.WARNING(
+                    f"{product_name} (#{product_id}): stock {stock}, ledger {balance}"
+                ))
+        summary = f"Checked {checked} products, {mismatched} out of step with the ledger"
+        if mismatched and options['fix']:
+            summary += " (corrected)"
+        self.stdout.write(self.style.SUCCESS(summary) if not mismatched else self.style.WARNING(summary))
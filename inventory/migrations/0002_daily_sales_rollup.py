@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('covered_from', models.DateField(blank=True, null=True)),
+                ('rebuilt_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'sales_rollup_state',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method', models.CharField(max_length=20)),
+                ('gross_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cogs', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('quantity', models.IntegerField(default=0)),
+                ('order_count', models.IntegerField(default=0)),
+                ('discount_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.category')),
+                ('staff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.staff')),
+            ],
+            options={
+                'db_table': 'daily_sales_rollup',
+                'unique_together': {('date', 'category', 'payment_method', 'staff')},
+            },
+        ),
+    ]
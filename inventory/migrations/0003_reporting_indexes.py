@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_daily_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['end_date', 'is_active', 'start_date'], name='discount_active_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorylog',
+            index=models.Index(fields=['log_date'], name='inventory_log_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorylog',
+            index=models.Index(fields=['log_type', 'log_date'], name='inventory_log_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payroll',
+            index=models.Index(fields=['payment_date'], name='payroll_payment_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['expiry_date', 'stock_quantity'], name='product_expiry_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseorder',
+            index=models.Index(fields=['order_date'], name='po_order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['sale_datetime', 'total_amount'], name='sale_datetime_total_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['payment_method', 'sale_datetime'], name='sale_payment_datetime_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_reporting_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventorylog',
+            name='reason',
+            field=models.CharField(blank=True, choices=[('sale', 'Sale'), ('receipt', 'Receipt'), ('expiry', 'Expiry'), ('damage', 'Damage'), ('theft', 'Theft'), ('count_correction', 'Count correction')], max_length=20, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='inventorylog',
+            index=models.Index(fields=['reason', 'log_date'], name='inventory_log_reason_date_idx'),
+        ),
+    ]
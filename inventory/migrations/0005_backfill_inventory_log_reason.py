@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Q
+
+
+def backfill_reason(apps, schema_editor):
+    InventoryLog = apps.get_model('inventory', 'InventoryLog')
+    pending = InventoryLog.objects.filter(reason__isnull=True)
+
+    # Write-offs were only identifiable by their remarks until now
+    pending.filter(
+        Q(remarks__icontains='expiry_writeoff') | Q(remarks__icontains='expiry write-off')
+    ).update(reason='expiry')
+    pending.filter(log_type='Sale').update(reason='sale')
+    pending.filter(log_type='Purchase').update(reason='receipt')
+    pending.filter(log_type='Adjustment', remarks__icontains='damage').update(reason='damage')
+    pending.filter(
+        Q(remarks__icontains='theft') | Q(remarks__icontains='stolen'), log_type='Adjustment'
+    ).update(reason='theft')
+    pending.filter(log_type='Adjustment').update(reason='count_correction')
+
+
+def clear_reason(apps, schema_editor):
+    InventoryLog = apps.get_model('inventory', 'InventoryLog')
+    InventoryLog.objects.update(reason=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_inventory_log_reason'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_reason, clear_reason),
+    ]
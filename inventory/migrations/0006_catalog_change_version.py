@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:21
+
+from django.db import migrations, models
+
+
+def create_counter(apps, schema_editor):
+    # Existing products start at version 1 so a since=0 sync returns them all
+    CatalogVersion = apps.get_model('inventory', 'CatalogVersion')
+    Product = apps.get_model('inventory', 'Product')
+    CatalogVersion.objects.update_or_create(pk=1, defaults={'value': 1})
+    Product.objects.update(change_version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_backfill_inventory_log_reason'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'catalog_version',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('change_version', models.BigIntegerField(db_index=True)),
+            ],
+            options={
+                'db_table': 'product_deletion',
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='change_version',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(create_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_outbox_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discount',
+            name='buy_quantity',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='exclusive',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='get_quantity',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CategoryDiscount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.category')),
+                ('discount', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.discount')),
+            ],
+            options={
+                'db_table': 'category_discount',
+            },
+        ),
+    ]
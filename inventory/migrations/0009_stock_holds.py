@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_discount_promotion_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved_quantity',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('terminal', models.CharField(max_length=64)),
+                ('quantity', models.IntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='inventory.product')),
+            ],
+            options={
+                'db_table': 'stock_hold',
+                'indexes': [models.Index(fields=['expires_at'], name='stock_hold_expires_idx')],
+                'unique_together': {('terminal', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_stock_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(blank=True, max_length=50, null=True)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity', models.IntegerField()),
+                ('unit_cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots', to='inventory.product')),
+            ],
+            options={
+                'db_table': 'stock_lot',
+            },
+        ),
+        migrations.CreateModel(
+            name='LotAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('sale', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lot_allocations', to='inventory.sale')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='allocations', to='inventory.stocklot')),
+            ],
+            options={
+                'db_table': 'lot_allocation',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stocklot',
+            index=models.Index(fields=['product', 'expiry_date'], name='stock_lot_product_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklot',
+            index=models.Index(fields=['expiry_date', 'quantity'], name='stock_lot_expiry_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_expiry_stock_idx',
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def backfill_lots(apps, schema_editor):
+    """One lot per product holding its current stock, batch and expiry."""
+    Product = apps.get_model('inventory', 'Product')
+    StockLot = apps.get_model('inventory', 'StockLot')
+    stocked = Product.objects.filter(stock_quantity__gt=0).order_by('id').values_list(
+        'id', 'batch_number', 'expiry_date', 'stock_quantity', 'unit_cost'
+    )
+    StockLot.objects.bulk_create([
+        StockLot(product_id=product_id, batch_number=batch_number, expiry_date=expiry_date,
+                 quantity=quantity, unit_cost=unit_cost)
+        for product_id, batch_number, expiry_date, quantity, unit_cost in stocked
+    ], batch_size=1000)
+
+
+def clear_lots(apps, schema_editor):
+    apps.get_model('inventory', 'StockLot').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_stock_lots'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_lots, clear_lots),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_backfill_stock_lots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('reason', models.CharField(choices=[('opening', 'Opening balance'), ('sale', 'Sale'), ('receipt', 'Receipt'), ('expiry', 'Expiry'), ('damage', 'Damage'), ('theft', 'Theft'), ('count_correction', 'Count correction')], max_length=20)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='inventory.product')),
+            ],
+            options={
+                'db_table': 'stock_ledger_entry',
+                'indexes': [models.Index(fields=['product', 'id'], name='stock_ledger_product_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_id', models.BigIntegerField()),
+                ('quantity', models.IntegerField()),
+                ('as_of', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.product')),
+            ],
+            options={
+                'db_table': 'stock_snapshot',
+                'indexes': [models.Index(fields=['product', 'as_of'], name='stock_snapshot_product_idx')],
+            },
+        ),
+    ]
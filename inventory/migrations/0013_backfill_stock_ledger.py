@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def open_ledger(apps, schema_editor):
+    """An opening entry per product for the stock it holds today."""
+    Product = apps.get_model('inventory', 'Product')
+    StockLedgerEntry = apps.get_model('inventory', 'StockLedgerEntry')
+    stocked = Product.objects.exclude(stock_quantity=0).order_by('id').values_list('id', 'stock_quantity')
+    StockLedgerEntry.objects.bulk_create([
+        StockLedgerEntry(product_id=product_id, quantity=quantity, reason='opening', reference='Opening balance')
+        for product_id, quantity in stocked
+    ], batch_size=1000)
+
+
+def clear_ledger(apps, schema_editor):
+    apps.get_model('inventory', 'StockSnapshot').objects.all().delete()
+    apps.get_model('inventory', 'StockLedgerEntry').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_ledger, clear_ledger),
+    ]
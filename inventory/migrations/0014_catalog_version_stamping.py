@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0013_backfill_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='change_version',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='productdeletion',
+            name='change_version',
+            field=models.BigIntegerField(db_index=True, null=True),
+        ),
+    ]
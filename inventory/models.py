@@ -1,4 +1,7 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
 
 class Category(models.Model):
@@ -18,6 +21,54 @@ class Supplier(models.Model):
     class Meta: db_table = 'supplier'
     def __str__(self): return self.supplier_name
 
+class CatalogVersion(models.Model):
+    """
+    Single-row counter behind Product.change_version.
+
+    Stock and product changes do not take the counter themselves: they clear
+    change_version on the rows they already lock, and stamp_pending() gives
+    the cleared rows a version in a short transaction after they commit. The
+    counter row is locked only for that stamp, so versions still become
+    visible in commit order and a delta sync never skips a change.
+    """
+    value = models.BigIntegerField(default=0)
+
+    class Meta: db_table = 'catalog_version'
+
+    @classmethod
+    def next_version(cls):
+        # Holds the counter row until the surrounding transaction commits
+        with transaction.atomic():
+            cls.objects.filter(pk=1).update(value=F('value') + 1)
+            return cls.objects.values_list('value', flat=True).get(pk=1)
+
+    @classmethod
+    def stamp_pending(cls):
+        """
+        Give products and tombstones without a change_version the next
+        version. Rows another transaction still has locked are skipped: it
+        stamps them when it commits. Returns the version, or None.
+        """
+        with transaction.atomic():
+            product_ids = list(
+                Product.objects.select_for_update(skip_locked=True)
+                .filter(change_version__isnull=True).order_by('id').values_list('id', flat=True)
+            )
+            deletion_ids = list(
+                ProductDeletion.objects.select_for_update(skip_locked=True)
+                .filter(change_version__isnull=True).values_list('id', flat=True)
+            )
+            if not product_ids and not deletion_ids:
+                return None
+            version = cls.next_version()
+            Product.objects.filter(id__in=product_ids).update(change_version=version)
+            ProductDeletion.objects.filter(id__in=deletion_ids).update(change_version=version)
+        return version
+
+    @classmethod
+    def stamp_on_commit(cls):
+        transaction.on_commit(cls.stamp_pending)
+
 class Product(models.Model):
     product_name = models.CharField(max_length=150)
     brand = models.CharField(max_length=100, null=True, blank=True)
@@ -25,15 +76,161 @@ class Product(models.Model):
     unit_cost = models.DecimalField(max_digits=10, decimal_places=2)
     retail_price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.IntegerField(default=0)
+    # Units held for baskets still being scanned (sum of StockHold rows)
+    reserved_quantity = models.IntegerField(default=0, editable=False)
     expiry_date = models.DateField(null=True, blank=True)
     reorder_level = models.IntegerField(default=10)
     batch_number = models.CharField(max_length=50, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
     supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT)
+    # CatalogVersion value of the last change to price, stock or details;
+    # NULL until the change has committed and been stamped
+    change_version = models.BigIntegerField(null=True, default=0, db_index=True, editable=False)
     
-    class Meta: db_table = 'product'
+    class Meta:
+        db_table = 'product'
+
     def __str__(self): return self.product_name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # Stock as last read or saved, so save() can ledger what it changed
+        # (see inventory.ledger); set stock_reason to label the change
+        if 'stock_quantity' in field_names:
+            product._saved_stock = product.stock_quantity
+        return product
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        if fields is None or 'stock_quantity' in fields:
+            self._saved_stock = self.stock_quantity
+
+    def save(self, *args, **kwargs):
+        # Bulk .update() callers must clear change_version and call
+        # CatalogVersion.stamp_on_commit() themselves. The stamp is queued
+        # before post_save, so receivers publishing at commit see the version.
+        if not self._state.adding and not kwargs.get('force_insert'):
+            # reserved_quantity only moves through F() updates (see
+            # services.adjust_reserved); writing back the loaded value would
+            # undo holds placed since this instance was read
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            kwargs['update_fields'] = {*update_fields, 'change_version'} - {'reserved_quantity'}
+        with transaction.atomic():
+            transaction.on_commit(self._stamp)
+            self.change_version = None
+            super().save(*args, **kwargs)
+
+    def _stamp(self):
+        version = CatalogVersion.stamp_pending()
+        if version is not None:
+            self.change_version = version
+
+class ProductDeletion(models.Model):
+    """Tombstone telling delta-sync clients to drop a deleted product."""
+    product_id = models.BigIntegerField()
+    change_version = models.BigIntegerField(null=True, db_index=True)
+
+    class Meta: db_table = 'product_deletion'
+
+class StockLot(models.Model):
+    """
+    One delivery (batch) of a product. A product's lots with stock add up to
+    its stock_quantity; sales take from them earliest expiry first and
+    expiry write-offs remove only the lots that have expired.
+    """
+    product = models.ForeignKey(Product, related_name='lots', on_delete=models.CASCADE)
+    batch_number = models.CharField(max_length=50, null=True, blank=True)
+    expiry_date = models.DateField(null=True, blank=True)
+    quantity = models.IntegerField()
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'stock_lot'
+        indexes = [
+            # FEFO picking: a product's lots by expiry
+            models.Index(fields=['product', 'expiry_date'], name='stock_lot_product_expiry_idx'),
+            # Expiry preview / write-off: expiry_date < today AND quantity > 0
+            models.Index(fields=['expiry_date', 'quantity'], name='stock_lot_expiry_idx'),
+        ]
+
+    def __str__(self): return f"{self.product} lot {self.batch_number or self.pk}"
+
+class StockLedgerEntry(models.Model):
+    """
+    One signed change to a product's stock: negative for sales and
+    write-offs, positive for deliveries. Append-only; a product's entries
+    add up to its stock_quantity.
+    """
+    REASON_CHOICES = [
+        ('opening', 'Opening balance'), ('sale', 'Sale'), ('receipt', 'Receipt'), ('expiry', 'Expiry'),
+        ('damage', 'Damage'), ('theft', 'Theft'), ('count_correction', 'Count correction'),
+    ]
+    product = models.ForeignKey(Product, related_name='ledger_entries', on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reference = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'stock_ledger_entry'
+        indexes = [
+            # Snapshot tails: a product's entries after a given entry id
+            models.Index(fields=['product', 'id'], name='stock_ledger_product_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock ledger entries are append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Stock ledger entries are append-only")
+
+class StockSnapshot(models.Model):
+    """
+    Checkpoint of a product's stock: the sum of its ledger entries up to
+    and including entry_id, whose created_at is as_of.
+    """
+    product = models.ForeignKey(Product, related_name='stock_snapshots', on_delete=models.CASCADE)
+    entry_id = models.BigIntegerField()
+    quantity = models.IntegerField()
+    as_of = models.DateTimeField()
+
+    class Meta:
+        db_table = 'stock_snapshot'
+        indexes = [
+            # Nearest checkpoint at or before a date
+            models.Index(fields=['product', 'as_of'], name='stock_snapshot_product_idx'),
+        ]
+
+class StockHold(models.Model):
+    """
+    Units of a product set aside for a basket a terminal (till session) is
+    still scanning, until expires_at. Kept in step with
+    Product.reserved_quantity by inventory.services, always under the
+    product's row lock.
+    """
+    terminal = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, related_name='holds', on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'stock_hold'
+        unique_together = ('terminal', 'product')
+        indexes = [
+            # The sweeper's "what has expired" query
+            models.Index(fields=['expires_at'], name='stock_hold_expires_idx'),
+        ]
+
 class Customer(models.Model):
     first_name = models.CharField(max_length=100, null=True, blank=True)
     last_name = models.CharField(max_length=100, null=True, blank=True)
@@ -63,8 +260,23 @@ class Discount(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
     is_active = models.BooleanField(default=True)
+    # Promotion rules: higher priority is applied first; an exclusive
+    # discount is never combined with others on the same line or basket
+    priority = models.IntegerField(default=0)
+    exclusive = models.BooleanField(default=False)
+    # BOGO: every buy_quantity units bought get get_quantity more free.
+    # Unset, they mean buy 1 and get `value` free.
+    buy_quantity = models.PositiveIntegerField(null=True, blank=True)
+    get_quantity = models.PositiveIntegerField(null=True, blank=True)
     
-    class Meta: db_table = 'discount'
+    class Meta:
+        db_table = 'discount'
+        indexes = [
+            # Active discounts valid on a given day. end_date leads because
+            # end_date >= today is what rules out the long tail of past schemes.
+            models.Index(fields=['end_date', 'is_active', 'start_date'], name='discount_active_dates_idx'),
+        ]
+
     def __str__(self): return self.discount_name
 
 class ProductDiscount(models.Model):
@@ -73,6 +285,12 @@ class ProductDiscount(models.Model):
     
     class Meta: db_table = 'product_discount'
 
+class CategoryDiscount(models.Model):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    discount = models.ForeignKey(Discount, on_delete=models.CASCADE)
+
+    class Meta: db_table = 'category_discount'
+
 class Sale(models.Model):
     PAYMENT_CHOICES = [('Cash','Cash'), ('Card','Card'), ('MobileMoney','MobileMoney')]
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
@@ -84,7 +302,14 @@ class Sale(models.Model):
     discount_applied = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     receipt_no = models.CharField(max_length=50, unique=True)
     
-    class Meta: db_table = 'sale'
+    class Meta:
+        db_table = 'sale'
+        indexes = [
+            # Date-range revenue/count reports read only these two columns
+            models.Index(fields=['sale_datetime', 'total_amount'], name='sale_datetime_total_idx'),
+            models.Index(fields=['payment_method', 'sale_datetime'], name='sale_payment_datetime_idx'),
+        ]
+
     def __str__(self): return f"Sale {self.receipt_no} - {self.total_amount}"
 
 class SaleDetail(models.Model):
@@ -114,10 +339,14 @@ class PurchaseOrder(models.Model):
 
     @property
     def computed_total_cost(self):
-        return sum(item.subtotal for item in self.items.all())
+        """Sum of the stored line totals, added up by the database."""
+        return self.items.aggregate(total=models.Sum('sub_total'))['total'] or Decimal('0')
 
     class Meta:
         db_table = 'purchase_order'
+        indexes = [
+            models.Index(fields=['order_date'], name='po_order_date_idx'),
+        ]
 
 class PurchaseOrderDetail(models.Model):
     order = models.ForeignKey(PurchaseOrder, related_name='items', on_delete=models.CASCADE)
@@ -133,17 +362,74 @@ class PurchaseOrderDetail(models.Model):
     class Meta:
         db_table = 'purchase_order_detail'
 
+class LotAllocation(models.Model):
+    """Units of a stock lot a sale used up."""
+    sale = models.ForeignKey(Sale, related_name='lot_allocations', on_delete=models.CASCADE)
+    lot = models.ForeignKey(StockLot, related_name='allocations', on_delete=models.PROTECT)
+    quantity = models.IntegerField()
+
+    class Meta: db_table = 'lot_allocation'
+
+class OutboxEmail(models.Model):
+    """
+    Email queued for the outbox worker (inventory.outbox) instead of being
+    sent inside a request. Purchase order emails get the order PDF
+    attached when they are sent.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    purchase_order = models.ForeignKey(PurchaseOrder, related_name='emails', on_delete=models.CASCADE,
+                                       null=True, blank=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.TextField(help_text='Comma-separated recipient addresses')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def recipients(self):
+        return [address.strip() for address in self.to.split(',') if address.strip()]
+
+    class Meta:
+        db_table = 'outbox_email'
+        indexes = [
+            # The worker's "what is due" query
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_email_due_idx'),
+        ]
+
 class InventoryLog(models.Model):
     LOG_CHOICES = [('Purchase','Purchase'), ('Sale','Sale'), ('Adjustment','Adjustment')]
+    REASON_CHOICES = [
+        ('sale','Sale'), ('receipt','Receipt'), ('expiry','Expiry'),
+        ('damage','Damage'), ('theft','Theft'), ('count_correction','Count correction'),
+    ]
+    # Reason recorded when a movement does not state one explicitly
+    DEFAULT_REASONS = {'Purchase': 'receipt', 'Sale': 'sale', 'Adjustment': 'count_correction'}
     staff = models.ForeignKey(Staff, on_delete=models.PROTECT)
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     log_type = models.CharField(max_length=20, choices=LOG_CHOICES)
     quantity = models.IntegerField()
     log_date = models.DateTimeField(default=timezone.now)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, null=True, blank=True)
     remarks = models.CharField(max_length=255, null=True, blank=True)
 
     class Meta:
         db_table = 'inventory_log'
+        indexes = [
+            # Recent transactions feed and log list, newest first
+            models.Index(fields=['log_date'], name='inventory_log_date_idx'),
+            models.Index(fields=['log_type', 'log_date'], name='inventory_log_type_date_idx'),
+            # Expiry/damage loss reports by period
+            models.Index(fields=['reason', 'log_date'], name='inventory_log_reason_date_idx'),
+        ]
 
 class Payroll(models.Model):
     staff = models.ForeignKey(Staff, on_delete=models.PROTECT)
@@ -156,3 +442,42 @@ class Payroll(models.Model):
 
     class Meta:
         db_table = 'payroll'
+        indexes = [
+            models.Index(fields=['payment_date'], name='payroll_payment_date_idx'),
+        ]
+
+class DailySalesRollup(models.Model):
+    """
+    Sales pre-aggregated per day x category x payment method x staff.
+
+    gross_revenue, cogs and quantity are exact per category. The sale-level
+    figures (total_amount -> revenue, discount_applied -> discount_total) are
+    shared out across a sale's categories in proportion to their sub totals,
+    and each sale is counted once in order_count, against its largest
+    category, so summing any column over a day gives the true day total.
+    """
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    payment_method = models.CharField(max_length=20)
+    staff = models.ForeignKey(Staff, on_delete=models.CASCADE)
+    gross_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cogs = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    quantity = models.IntegerField(default=0)
+    order_count = models.IntegerField(default=0)
+    discount_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'daily_sales_rollup'
+        unique_together = ('date', 'category', 'payment_method', 'staff')
+
+class SalesRollupState(models.Model):
+    """
+    Single row recording which days DailySalesRollup is complete for.
+    covered_from=None means the whole sales history has been rolled up.
+    """
+    covered_from = models.DateField(null=True, blank=True)
+    rebuilt_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'sales_rollup_state'
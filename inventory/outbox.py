@@ -0,0 +1,144 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+from .utils import generate_purchase_order_pdf
+
+logger = logging.getLogger(__name__)
+
+# A claimed email is retried after this long if its worker died mid-send
+CLAIM_LEASE = timedelta(minutes=10)
+
+
+def queue_purchase_order_email(order, user):
+    """
+    Queue the supplier's copy of `order`, sent by `user`. Nothing is
+    rendered or sent here; the worker attaches the PDF when it sends.
+    """
+    username = getattr(user, 'username', '')
+    email = OutboxEmail.objects.create(
+        purchase_order=order,
+        subject=f"Purchase Order #{order.id} from {username}",
+        body=(
+            f"Dear {order.supplier.supplier_name},\n\n"
+            f"Please find attached our new purchase order.\n\n"
+            f"Thank you,\n{username}\n{getattr(user, 'email', '')}"
+        ),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=order.supplier.email,
+    )
+    transaction.on_commit(kick)
+    return email
+
+
+def retry_delay(attempts):
+    """Exponential backoff after the given number of failed attempts, capped."""
+    base = getattr(settings, 'OUTBOX_RETRY_DELAY', 60)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), getattr(settings, 'OUTBOX_MAX_RETRY_DELAY', 3600)))
+
+
+def claim_due(limit, now=None):
+    """
+    Lease up to `limit` due emails to this worker. Each claim counts as an
+    attempt and pushes next_attempt_at back by CLAIM_LEASE, so concurrent
+    workers skip them and a crashed worker's emails come round again.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        claimed = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('pk', flat=True)[:limit]
+        )
+        OutboxEmail.objects.filter(pk__in=claimed).update(
+            attempts=F('attempts') + 1, next_attempt_at=now + CLAIM_LEASE,
+        )
+    # Joined outside the lock so purchase orders and suppliers stay unlocked
+    return list(
+        OutboxEmail.objects.filter(pk__in=claimed)
+        .select_related('purchase_order__supplier')
+        .order_by('next_attempt_at', 'pk')
+    )
+
+
+def build_message(email):
+    message = EmailMessage(email.subject, email.body, email.from_email, email.recipients())
+    if email.purchase_order_id:
+        message.attach(f"PurchaseOrder_{email.purchase_order_id}.pdf",
+                       generate_purchase_order_pdf(email.purchase_order), 'application/pdf')
+    return message
+
+
+def _record_failure(email, error, results):
+    max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+    if email.attempts >= max_attempts:
+        update = {'status': 'failed'}
+        results['failed'] += 1
+    else:
+        update = {'next_attempt_at': timezone.now() + retry_delay(email.attempts)}
+        results['retrying'] += 1
+    OutboxEmail.objects.filter(pk=email.pk).update(last_error=f"{type(error).__name__}: {error}", **update)
+
+
+def send_due(limit=50, workers=4, now=None):
+    """
+    Send up to `limit` due emails. PDFs are rendered here; the SMTP
+    conversations run `workers` at a time on a thread pool, which never
+    touches the database. Failures are retried with exponential backoff
+    until OUTBOX_MAX_ATTEMPTS. Returns {'sent', 'retrying', 'failed'}.
+    """
+    results = {'sent': 0, 'retrying': 0, 'failed': 0}
+    ready = []
+    for email in claim_due(limit, now):
+        try:
+            ready.append((email, build_message(email)))
+        except Exception as error:
+            _record_failure(email, error, results)
+    if not ready:
+        return results
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sends = [(email, pool.submit(message.send)) for email, message in ready]
+
+    for email, future in sends:
+        error = future.exception()
+        if error is None:
+            OutboxEmail.objects.filter(pk=email.pk).update(status='sent', sent_at=timezone.now(), last_error='')
+            results['sent'] += 1
+        else:
+            _record_failure(email, error, results)
+    return results
+
+
+# ---------------------------------------------------------
+# IN-PROCESS SENDING
+# ---------------------------------------------------------
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+
+
+def kick():
+    """
+    With OUTBOX_SEND_IN_PROCESS, drain the outbox on a background thread of
+    this process so a new email goes out right after the request. Retries
+    still need the send_outbox command.
+    """
+    if getattr(settings, 'OUTBOX_SEND_IN_PROCESS', False):
+        _background.submit(_drain)
+
+
+def _drain():
+    try:
+        send_due()
+    except Exception:
+        logger.exception('Sending queued emails failed')
+    finally:
+        # This thread outlives the request; do not leave its connection open
+        connections.close_all()
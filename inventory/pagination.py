@@ -0,0 +1,117 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+CURSOR_SALT = 'inventory.keyset'
+
+
+class InvalidCursor(Exception):
+    """Raised for a cursor that was tampered with or belongs to another sort order."""
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def make_cursor(sort, direction, values):
+    return signing.dumps({'s': sort, 'd': direction, 'v': [_encode(v) for v in values]},
+                         salt=CURSOR_SALT, compress=True)
+
+
+def read_cursor(cursor, sort):
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor('Invalid cursor')
+    if data.get('s') != sort or data.get('d') not in ('next', 'prev'):
+        raise InvalidCursor('Cursor does not match the requested sort')
+    return data['d'], data['v']
+
+
+def _seek(fields, values, descending):
+    """
+    Rows strictly after `values` in (fields) order, e.g. for two descending
+    fields: a < x OR (a = x AND b < y). The DB walks the matching index
+    from that point instead of counting past an OFFSET.
+    """
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        condition |= Q(**dict(zip(fields[:i], values[:i])), **{f'{field}__{lookup}': values[i]})
+    return condition
+
+
+def get_page_size(request, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(request.GET.get('page_size', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_paginate(queryset, request, sort_options, default_sort):
+    """
+    Cursor-paginate `queryset`.
+
+    `sort_options` maps the public sort names accepted in ?sort= to
+    non-null model fields or annotations; prefix the name with '-' for
+    descending. The primary key is always appended as a tie-breaker so
+    every row has a unique position.
+    ?cursor= is an opaque signed token from a previous page.
+
+    Returns {'items', 'sort', 'page_size', 'next_cursor', 'prev_cursor'}.
+    Raises InvalidCursor for a cursor that does not belong to this sort.
+    """
+    sort = request.GET.get('sort') or default_sort
+    if sort.lstrip('-') not in sort_options:
+        sort = default_sort
+    descending = sort.startswith('-')
+    fields = [sort_options[sort.lstrip('-')], 'pk']
+    page_size = get_page_size(request)
+
+    direction, values = 'next', None
+    if request.GET.get('cursor'):
+        direction, values = read_cursor(request.GET['cursor'], sort)
+
+    # Walking backwards is the same seek with the ordering flipped
+    backwards = direction == 'prev'
+    walk_descending = descending != backwards
+    prefix = '-' if walk_descending else ''
+    qs = queryset.order_by(*[prefix + f for f in fields])
+    if values is not None:
+        qs = qs.filter(_seek(fields, values, walk_descending))
+
+    items = list(qs[:page_size + 1])
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if backwards:
+        items.reverse()
+
+    def key(obj):
+        # Rows may be model instances or .values() dicts
+        if isinstance(obj, dict):
+            return [obj[f] for f in fields]
+        return [getattr(obj, f) for f in fields]
+
+    has_next = has_more if not backwards else True
+    has_prev = values is not None if not backwards else has_more
+    return {
+        'items': items,
+        'sort': sort,
+        'page_size': page_size,
+        'next_cursor': make_cursor(sort, 'next', key(items[-1])) if items and has_next else None,
+        'prev_cursor': make_cursor(sort, 'prev', key(items[0])) if items and has_prev else None,
+    }
+
+
+def page_metadata(page):
+    """JSON-friendly cursor block for API responses."""
+    return {key: page[key] for key in ('sort', 'page_size', 'next_cursor', 'prev_cursor')}
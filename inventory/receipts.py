@@ -0,0 +1,318 @@
+import textwrap
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from decimal import Decimal
+from functools import lru_cache
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch, mm
+from reportlab.pdfgen import canvas
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+from .models import Sale, SaleDetail
+
+FORMATS = ('a4', 'thermal', 'text', 'escpos')
+CONTENT_TYPES = {
+    'a4': 'application/pdf',
+    'thermal': 'application/pdf',
+    'text': 'text/plain; charset=utf-8',
+    'escpos': 'application/octet-stream',
+}
+EXTENSIONS = {'a4': 'pdf', 'thermal': 'pdf', 'text': 'txt', 'escpos': 'bin'}
+
+# Characters per line of the common thermal printer fonts (12x24 dots)
+PAPER_COLUMNS = {58: 32, 80: 48}
+
+ESCPOS_INIT = b'\x1b@'
+ESCPOS_CENTER = b'\x1ba\x01'
+ESCPOS_LEFT = b'\x1ba\x00'
+ESCPOS_BOLD_ON = b'\x1bE\x01'
+ESCPOS_BOLD_OFF = b'\x1bE\x00'
+ESCPOS_FEED_AND_CUT = b'\x1dVA\x03'
+
+
+def money(value):
+    return f"UGx. {value:,.0f}"
+
+
+# ---------------------------------------------------------
+# RECEIPT DATA
+# ---------------------------------------------------------
+def receipt_data(receipt_no):
+    """
+    Everything printed on a receipt, read in two queries. The subtotal and
+    line discounts are summed while the lines are built. Raises
+    Sale.DoesNotExist.
+    """
+    sale = Sale.objects.select_related('staff', 'customer').get(receipt_no=receipt_no)
+    lines = []
+    subtotal = line_discounts = Decimal('0')
+    for detail in SaleDetail.objects.filter(sale=sale).select_related('product').order_by('id'):
+        line_total = detail.unit_price * detail.quantity_sold
+        subtotal += line_total
+        line_discounts += detail.discount_value or 0
+        lines.append((detail.product.product_name, detail.quantity_sold, detail.unit_price, line_total))
+    return {
+        'receipt_no': sale.receipt_no,
+        'date': timezone.localtime(sale.sale_datetime).strftime('%Y-%m-%d %H:%M:%S'),
+        'staff': f"{sale.staff.first_name} {sale.staff.last_name}",
+        'customer': f"{sale.customer.first_name} {sale.customer.last_name}" if sale.customer else None,
+        'lines': lines,
+        'subtotal': subtotal,
+        # Line promotions and the sale-level discount together
+        'discount': line_discounts + (sale.discount_applied or 0),
+        'total': sale.total_amount,
+    }
+
+
+# ---------------------------------------------------------
+# THERMAL LAYOUT (58/80mm)
+# ---------------------------------------------------------
+ThermalLayout = namedtuple('ThermalLayout', 'columns rule page_width margin font_size leading')
+
+
+@lru_cache(maxsize=None)
+def thermal_layout(width_mm):
+    """Column count and PDF metrics for one paper width, computed once."""
+    columns = PAPER_COLUMNS[width_mm]
+    page_width = width_mm * mm
+    margin = 3 * mm
+    # Courier glyphs are 0.6em wide; size the font so `columns` fill the roll
+    font_size = round((page_width - 2 * margin) / (columns * 0.6), 2)
+    return ThermalLayout(columns, '-' * columns, page_width, margin, font_size, font_size * 1.25)
+
+
+def _pair(left, right, columns):
+    """`left` and `right` on one line, `left` shortened if they do not fit."""
+    room = columns - len(right) - 1
+    return f"{left[:room]:<{room}} {right}"
+
+
+def thermal_lines(data, width_mm):
+    """
+    The receipt as fixed-width text lines for a `width_mm` roll. Returns
+    [(text, style)], style being None, 'center' or 'bold'.
+    """
+    layout = thermal_layout(width_mm)
+    columns = layout.columns
+    out = [
+        ('SUPERMARKET RECEIPT'.center(columns).rstrip(), 'bold'),
+        (f"Receipt: {data['receipt_no']}", None),
+        (f"Date: {data['date']}", None),
+        (f"Staff: {data['staff']}", None),
+    ]
+    if data['customer']:
+        out.append((f"Customer: {data['customer']}", None))
+    out.append((layout.rule, None))
+    for name, quantity, unit_price, line_total in data['lines']:
+        for part in textwrap.wrap(name, columns) or ['']:
+            out.append((part, None))
+        out.append((_pair(f"  {quantity} x {unit_price:,.0f}", f"{line_total:,.0f}", columns), None))
+    out += [
+        (layout.rule, None),
+        (_pair('Subtotal', money(data['subtotal']), columns), None),
+        (_pair('Discount', f"-{money(data['discount'])}", columns), None),
+        (_pair('TOTAL', money(data['total']), columns), 'bold'),
+        (layout.rule, None),
+        ('Thank you for your business!'.center(columns).rstrip(), 'center'),
+    ]
+    return out
+
+
+def render_text(data, width_mm):
+    return ''.join(f"{text}\n" for text, _ in thermal_lines(data, width_mm)).encode('utf-8')
+
+
+def render_escpos(data, width_mm):
+    """Bytes for an ESC/POS printer: reset, the text lines, then feed and cut."""
+    out = [ESCPOS_INIT]
+    for text, style in thermal_lines(data, width_mm):
+        line = text.encode('cp437', errors='replace') + b'\n'
+        if style == 'bold':
+            line = ESCPOS_BOLD_ON + line + ESCPOS_BOLD_OFF
+        elif style == 'center':
+            line = ESCPOS_CENTER + text.strip().encode('cp437', errors='replace') + b'\n' + ESCPOS_LEFT
+        out.append(line)
+    out.append(ESCPOS_FEED_AND_CUT)
+    return b''.join(out)
+
+
+def render_thermal_pdf(data, width_mm):
+    """A roll-width PDF, as long as the receipt, drawn straight onto one page."""
+    layout = thermal_layout(width_mm)
+    lines = thermal_lines(data, width_mm)
+    height = 2 * layout.margin + len(lines) * layout.leading
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=(layout.page_width, height), pageCompression=1)
+    pdf.setTitle(f"Receipt {data['receipt_no']}")
+    y = height - layout.margin - layout.font_size
+    for text, style in lines:
+        pdf.setFont('Courier-Bold' if style == 'bold' else 'Courier', layout.font_size)
+        pdf.drawString(layout.margin, y, text)
+        y -= layout.leading
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+# ---------------------------------------------------------
+# A4 LAYOUT
+# ---------------------------------------------------------
+@lru_cache(maxsize=None)
+def _a4_styles():
+    """Paragraph and table styles, built once and shared by every render."""
+    sheet = getSampleStyleSheet()
+    return {
+        'heading1': sheet['Heading1'],
+        'heading2': sheet['Heading2'],
+        'normal': sheet['Normal'],
+        'items': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ]),
+        'totals': TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 12),
+        ]),
+    }
+
+
+def render_a4(data, width_mm=None):
+    styles = _a4_styles()
+    elements = [
+        Paragraph("SUPERMARKET RECEIPT", styles['heading1']),
+        Paragraph(f"Receipt No: {escape(data['receipt_no'])}", styles['normal']),
+        Paragraph(f"Date: {data['date']}", styles['normal']),
+        Paragraph(f"Staff: {escape(data['staff'])}", styles['normal']),
+    ]
+    if data['customer']:
+        elements.append(Paragraph(f"Customer: {escape(data['customer'])}", styles['normal']))
+    elements += [Spacer(1, 20), Paragraph("Items Purchased", styles['heading2']), Spacer(1, 12)]
+
+    rows = [['Product', 'Qty', 'Price', 'Total']]
+    rows += [
+        [name, str(quantity), money(unit_price), money(line_total)]
+        for name, quantity, unit_price, line_total in data['lines']
+    ]
+    items = Table(rows, colWidths=[3 * inch, 1 * inch, 1.5 * inch, 1.5 * inch])
+    items.setStyle(styles['items'])
+    totals = Table([
+        ['Subtotal', money(data['subtotal'])],
+        ['Discount', f"-{money(data['discount'])}"],
+        ['Total', money(data['total'])],
+    ], colWidths=[2 * inch, 2 * inch])
+    totals.setStyle(styles['totals'])
+    elements += [
+        items, Spacer(1, 20), totals, Spacer(1, 30),
+        Paragraph("Thank you for your business!", styles['normal']),
+    ]
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=18)
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'a4': render_a4,
+    'thermal': render_thermal_pdf,
+    'text': render_text,
+    'escpos': render_escpos,
+}
+
+
+# ---------------------------------------------------------
+# RENDERED RECEIPT CACHE
+# ---------------------------------------------------------
+class ReceiptCache:
+    """
+    Least-recently-used store of rendered receipts, keyed by
+    (receipt_no, format, width). Per process: a reprint at the same till
+    costs no queries and no rendering.
+
+    Edits to a sale drop its receipts only in the process that made them,
+    so entries also expire `ttl` seconds after rendering: with several
+    workers, the others print the change within that time.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if time.monotonic() >= expires_at:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, receipt_no):
+        with self._lock:
+            for key in [key for key in self._items if key[0] == receipt_no]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+rendered = ReceiptCache(getattr(settings, 'RECEIPT_CACHE_SIZE', 512), getattr(settings, 'RECEIPT_CACHE_TTL', 300))
+
+
+def render_receipt(receipt_no, fmt='a4', width_mm=None):
+    """
+    Receipt `receipt_no` as bytes in format `fmt` (one of FORMATS), on
+    `width_mm` paper for the thermal formats. Served from the LRU cache
+    when it was rendered before. Raises Sale.DoesNotExist.
+    """
+    if fmt == 'a4':
+        width_mm = None
+    elif width_mm is None:
+        width_mm = getattr(settings, 'RECEIPT_PAPER_WIDTH', 80)
+    key = (receipt_no, fmt, width_mm)
+    content = rendered.get(key)
+    if content is None:
+        content = RENDERERS[fmt](receipt_data(receipt_no), width_mm)
+        rendered.set(key, content)
+    return content
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def forget_sale_receipts(sender, instance, **kwargs):
+    rendered.discard(instance.receipt_no)
+
+
+@receiver(post_save, sender=SaleDetail)
+@receiver(post_delete, sender=SaleDetail)
+def forget_detail_receipts(sender, instance, **kwargs):
+    # Only the sale's id is at hand; drop every cached receipt carrying it
+    receipt_no = Sale.objects.filter(pk=instance.sale_id).values_list('receipt_no', flat=True).first()
+    if receipt_no is not None:
+        rendered.discard(receipt_no)
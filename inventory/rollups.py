@@ -0,0 +1,273 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Sale, SaleDetail, DailySalesRollup, SalesRollupState
+from .utils import day_range
+
+CENT = Decimal('0.01')
+ROLLUP_FIELDS = ('gross_revenue', 'revenue', 'cogs', 'quantity', 'order_count', 'discount_total')
+
+
+def local_date(value):
+    """Calendar day of an aware datetime in the store's timezone."""
+    return timezone.localtime(value, timezone.get_default_timezone()).date()
+
+
+def _bucket_sale(day, payment_method, staff_id, total_amount, discount_applied, lines):
+    """
+    Turn one sale into rollup deltas keyed by (date, category, payment, staff).
+    `lines` are (category_id, unit_price, quantity, sub_total, unit_cost, discount_value).
+    """
+    per_category = defaultdict(lambda: {
+        'gross_revenue': Decimal('0'), 'sub_total': Decimal('0'), 'cogs': Decimal('0'),
+        'quantity': 0, 'discount_total': Decimal('0'),
+    })
+    for category_id, unit_price, qty, sub_total, unit_cost, discount_value in lines:
+        bucket = per_category[category_id]
+        bucket['gross_revenue'] += unit_price * qty
+        bucket['sub_total'] += sub_total if sub_total is not None else unit_price * qty
+        bucket['cogs'] += unit_cost * qty
+        bucket['quantity'] += qty
+        bucket['discount_total'] += discount_value or 0
+
+    if not per_category:
+        return {}
+
+    basket_total = sum(b['sub_total'] for b in per_category.values())
+    primary = max(per_category, key=lambda c: per_category[c]['sub_total'])
+    total_amount = total_amount or Decimal('0')
+    discount_applied = discount_applied or Decimal('0')
+
+    deltas = {}
+    revenue_left, discount_left = total_amount, discount_applied
+    for category_id, bucket in per_category.items():
+        if category_id == primary:
+            continue
+        share = bucket['sub_total'] / basket_total if basket_total else Decimal('0')
+        revenue = (total_amount * share).quantize(CENT)
+        discount = (discount_applied * share).quantize(CENT)
+        revenue_left -= revenue
+        discount_left -= discount
+        deltas[(day, category_id, payment_method, staff_id)] = {
+            'gross_revenue': bucket['gross_revenue'], 'revenue': revenue, 'cogs': bucket['cogs'],
+            'quantity': bucket['quantity'], 'order_count': 0,
+            'discount_total': bucket['discount_total'] + discount,
+        }
+
+    # The largest category absorbs rounding and carries the order count
+    bucket = per_category[primary]
+    deltas[(day, primary, payment_method, staff_id)] = {
+        'gross_revenue': bucket['gross_revenue'], 'revenue': revenue_left, 'cogs': bucket['cogs'],
+        'quantity': bucket['quantity'], 'order_count': 1,
+        'discount_total': bucket['discount_total'] + discount_left,
+    }
+    return deltas
+
+
+def record_sale(sale, details):
+    """
+    Fold a newly created sale into the rollup table. Call in the
+    transaction that saves the sale (checkout_sale does).
+    """
+    lines = [
+        (d.product.category_id, d.unit_price, d.quantity_sold, d.sub_total, d.product.unit_cost, d.discount_value)
+        for d in details
+    ]
+    deltas = _bucket_sale(
+        local_date(sale.sale_datetime), sale.payment_method, sale.staff_id,
+        sale.total_amount, sale.discount_applied, lines,
+    )
+    for (day, category_id, payment_method, staff_id), values in deltas.items():
+        key = dict(date=day, category_id=category_id, payment_method=payment_method, staff_id=staff_id)
+        increments = {field: F(field) + values[field] for field in ROLLUP_FIELDS}
+        if DailySalesRollup.objects.filter(**key).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                DailySalesRollup.objects.create(**key, **values)
+        except IntegrityError:
+            # Another till created the row first
+            DailySalesRollup.objects.filter(**key).update(**increments)
+
+
+def _iter_sale_deltas(start=None, end=None, chunk_size=2000):
+    """Stream SaleDetail rows for [start, end] and yield one sale's deltas at a time."""
+    qs = SaleDetail.objects.all()
+    start_dt, end_dt = day_range(start, end)
+    if start_dt:
+        qs = qs.filter(sale__sale_datetime__gte=start_dt)
+    if end_dt:
+        qs = qs.filter(sale__sale_datetime__lt=end_dt)
+    rows = qs.order_by('sale_id').values_list(
+        'sale_id', 'sale__sale_datetime', 'sale__payment_method', 'sale__staff_id',
+        'sale__total_amount', 'sale__discount_applied',
+        'product__category_id', 'unit_price', 'quantity_sold', 'sub_total',
+        'product__unit_cost', 'discount_value',
+    ).iterator(chunk_size=chunk_size)
+
+    current, header, lines = None, None, []
+    for row in rows:
+        if row[0] != current:
+            if lines:
+                yield _bucket_sale(*header, lines)
+            current, lines = row[0], []
+            header = (local_date(row[1]), row[2], row[3], row[4], row[5])
+        lines.append(row[6:])
+    if lines:
+        yield _bucket_sale(*header, lines)
+
+
+def first_sale_day():
+    first = Sale.objects.order_by('sale_datetime').values_list('sale_datetime', flat=True).first()
+    return local_date(first) if first else None
+
+
+def rebuild(start=None, end=None, batch_size=1000):
+    """
+    Recompute rollup rows for the inclusive day range [start, end] from
+    SaleDetail and extend the recorded coverage. None means unbounded.
+
+    Days are rebuilt one per transaction, latest first, each joining the
+    covered window as soon as it is done; a day edited afterwards (see
+    invalidate_days) cuts the window again instead of being re-covered.
+    Returns the number of rollup rows written.
+    """
+    today = local_date(timezone.now())
+    end = end or today
+    first = start or first_sale_day() or end
+    written = 0
+    day = end
+    while day >= first:
+        written += _rebuild_day(day, today, whole_history=start is None and day == first, batch_size=batch_size)
+        day -= timedelta(days=1)
+    return written
+
+
+def _rebuild_day(day, today, whole_history=False, batch_size=1000):
+    with transaction.atomic():
+        # The state lock orders the rebuild with invalidate_days(); locking
+        # the day's rows (and the gaps between them) holds record_sale()
+        # back, so the scan below sees every sale already folded in and
+        # none that is folded in later
+        state = SalesRollupState.objects.select_for_update().first()
+        list(DailySalesRollup.objects.select_for_update().filter(date=day).values_list('id', flat=True))
+
+        totals = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+        for deltas in _iter_sale_deltas(day, day):
+            for key, values in deltas.items():
+                bucket = totals[key]
+                for field in ROLLUP_FIELDS:
+                    bucket[field] += values[field]
+
+        DailySalesRollup.objects.filter(date=day).delete()
+        DailySalesRollup.objects.bulk_create([
+            DailySalesRollup(date=day, category_id=category_id, payment_method=payment_method,
+                             staff_id=staff_id, **values)
+            for (_, category_id, payment_method, staff_id), values in totals.items()
+        ], batch_size=batch_size)
+
+        _extend_coverage(state, day, today, whole_history)
+    return len(totals)
+
+
+def _extend_coverage(state, day, today, whole_history):
+    """Add a freshly rebuilt `day` to the covered window if it borders it."""
+    covered_from = None if whole_history else day
+    if state is None:
+        if day >= today:
+            SalesRollupState.objects.create(covered_from=covered_from)
+        return
+
+    if state.covered_from is None:
+        return
+    if day >= today or day + timedelta(days=1) >= state.covered_from:
+        if covered_from is None or covered_from < state.covered_from:
+            state.covered_from = covered_from
+        state.rebuilt_at = timezone.now()
+        state.save()
+
+
+def invalidate_days(days):
+    """
+    Take `days` out of the covered window after their sales changed outside
+    checkout (admin edits, scripts). The window only runs forward, so it
+    starts again the day after the latest of them; reports for earlier
+    dates read the raw tables until rebuild_sales_rollup is run.
+    """
+    days = [day for day in days if day is not None]
+    if not days:
+        return
+    after = max(days) + timedelta(days=1)
+    with transaction.atomic():
+        state = SalesRollupState.objects.select_for_update().first()
+        if state is not None and (state.covered_from is None or state.covered_from < after):
+            state.covered_from = after
+            state.save()
+
+
+def _covers(state, start):
+    if state is None:
+        return False
+    if state.covered_from is None:
+        return True
+    return start is not None and start >= state.covered_from
+
+
+def is_covered(start=None):
+    """True when every day from `start` (None = all history) onwards is rolled up."""
+    return _covers(SalesRollupState.objects.first(), start)
+
+
+async def ais_covered(start=None):
+    """Async version of is_covered()."""
+    return _covers(await SalesRollupState.objects.afirst(), start)
+
+
+def rollup_rows(start=None, end=None):
+    """Rollup queryset restricted to the inclusive day range [start, end]."""
+    qs = DailySalesRollup.objects.all()
+    if start:
+        qs = qs.filter(date__gte=start)
+    if end:
+        qs = qs.filter(date__lte=end)
+    return qs
+
+
+# ---------------------------------------------------------
+# SALES CHANGED OUTSIDE CHECKOUT
+# ---------------------------------------------------------
+def _sale_day(sale_id):
+    value = Sale.objects.filter(pk=sale_id).values_list('sale_datetime', flat=True).first()
+    return local_date(value) if value else None
+
+
+@receiver(pre_save, sender=Sale)
+def remember_sale_day(sender, instance, **kwargs):
+    # An edit can move a sale to another day; both days go stale
+    instance._rollup_day = None if instance._state.adding else _sale_day(instance.pk)
+
+
+@receiver(post_save, sender=Sale)
+def invalidate_saved_sale(sender, instance, created, **kwargs):
+    # New sales are folded in by record_sale() with their lines
+    if not created:
+        invalidate_days([getattr(instance, '_rollup_day', None), local_date(instance.sale_datetime)])
+
+
+@receiver(post_delete, sender=Sale)
+def invalidate_deleted_sale(sender, instance, **kwargs):
+    invalidate_days([local_date(instance.sale_datetime)])
+
+
+@receiver(post_save, sender=SaleDetail)
+@receiver(post_delete, sender=SaleDetail)
+def invalidate_sale_lines(sender, instance, **kwargs):
+    # Checkout bulk-creates its lines, so only other writers get here
+    invalidate_days([_sale_day(instance.sale_id)])
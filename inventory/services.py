@@ -0,0 +1,454 @@
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Case, Count, DecimalField, ExpressionWrapper, F, IntegerField, Min, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import (
+    Product, SaleDetail, InventoryLog, Staff, CatalogVersion, PurchaseOrderDetail, StockHold, StockLot, LotAllocation,
+)
+from . import events, ledger, lots, rollups
+
+
+class InsufficientStock(Exception):
+    """Raised when a basket asks for more units than are on the shelf."""
+
+
+class InvalidPurchaseOrder(Exception):
+    """Raised when a purchase order has no lines or names products that do not exist."""
+
+
+# ---------------------------------------------------------
+# CHECKOUT
+# ---------------------------------------------------------
+def lock_products(product_ids):
+    """
+    Lock the given products for the rest of the transaction.
+    Rows are locked in id order so two tills selling overlapping baskets
+    always acquire locks in the same sequence and cannot deadlock.
+    """
+    products = (
+        Product.objects.select_for_update()
+        .filter(id__in=set(product_ids))
+        .order_by('id')
+    )
+    return {p.id: p for p in products}
+
+
+def decrement_stock(quantities, released=None):
+    """
+    Subtract {product_id: qty} from stock in a single UPDATE.
+    Each row is only touched if it still holds enough stock, so the number
+    of updated rows tells us whether every decrement went through.
+    `released` ({product_id: qty}) is taken off reserved_quantity in the
+    same statement, for holds the sale consumes.
+    Call with the rows already locked (see lock_products).
+    """
+    if not quantities:
+        return 0
+
+    enough_stock = Q()
+    whens = []
+    for product_id, qty in quantities.items():
+        enough_stock |= Q(id=product_id, stock_quantity__gte=qty)
+        whens.append(When(id=product_id, then=F('stock_quantity') - Value(qty)))
+
+    update = {}
+    if released:
+        update['reserved_quantity'] = adjust_reserved({product_id: -qty for product_id, qty in released.items()})
+    updated = Product.objects.filter(enough_stock).update(
+        stock_quantity=Case(*whens, default=F('stock_quantity'), output_field=IntegerField()),
+        change_version=None,
+        **update
+    )
+    CatalogVersion.stamp_on_commit()
+    return updated
+
+
+def basket_total(details):
+    """Fill in the sub_total of lines that have none and return the lines' sum."""
+    for detail in details:
+        if detail.sub_total is None:
+            detail.sub_total = detail.unit_price * detail.quantity_sold - (detail.discount_value or Decimal('0'))
+    return sum((d.sub_total for d in details), Decimal('0'))
+
+
+def checkout_sale(sale, details, terminal=None):
+    """
+    Persist a sale with its line items and deduct stock atomically.
+
+    `details` is a list of unsaved SaleDetail instances. All basket products
+    are locked up-front, stock is checked before anything is written, and
+    the stock decrements and inventory logs are each issued as one statement.
+    Stock held by other terminals and stock in expired lots is not
+    available; `terminal`'s own holds are, and are used up by the sale.
+    Raises InsufficientStock (and writes nothing) if any line cannot be filled.
+    """
+    quantities = OrderedDict()
+    for detail in details:
+        quantities[detail.product_id] = quantities.get(detail.product_id, 0) + detail.quantity_sold
+
+    with transaction.atomic():
+        products = lock_products(quantities.keys())
+        held = {}
+        if terminal:
+            held = dict(
+                StockHold.objects.filter(terminal=terminal, product_id__in=quantities.keys())
+                .values_list('product_id', 'quantity')
+            )
+        today = timezone.localdate()
+        expired = lots.expired_stock(quantities.keys(), today)
+
+        for product_id, qty in quantities.items():
+            product = products[product_id]
+            available = (
+                product.stock_quantity - product.reserved_quantity + held.get(product_id, 0)
+                - expired.get(product_id, 0)
+            )
+            if available < qty:
+                raise InsufficientStock(
+                    f"Insufficient stock for {product.product_name}. Available: {max(available, 0)}"
+                )
+
+        total = basket_total(details)
+        if sale.total_amount is None:
+            sale.total_amount = total
+        allocations = lots.allocate_sale(details, today)
+
+        sale.save()
+        for detail in details:
+            detail.sale = sale
+        SaleDetail.objects.bulk_create(details)
+        for allocation in allocations:
+            allocation.sale = sale
+        LotAllocation.objects.bulk_create(allocations)
+
+        if decrement_stock(quantities, released=held) != len(quantities):
+            # Cannot happen while we hold the row locks, but never oversell.
+            raise InsufficientStock("Stock changed during checkout, please retry.")
+        if held:
+            StockHold.objects.filter(terminal=terminal, product_id__in=held.keys()).delete()
+
+        logs = InventoryLog.objects.bulk_create([
+            InventoryLog(
+                product_id=detail.product_id,
+                staff_id=sale.staff_id,
+                log_type='Sale',
+                reason='sale',
+                quantity=detail.quantity_sold,
+                remarks=f"Sale #{sale.receipt_no} - {detail.batch_number or 'No batch'}",
+            )
+            for detail in details
+        ])
+
+        ledger.record({product_id: -qty for product_id, qty in quantities.items()}, 'sale', f"Sale #{sale.receipt_no}")
+
+        for product_id, qty in quantities.items():
+            products[product_id].stock_quantity -= qty
+
+        rollups.record_sale(sale, details)
+
+        events.publish_logs(logs)
+        events.publish_stock({product_id: products[product_id].stock_quantity for product_id in quantities})
+
+    return sale
+
+
+# ---------------------------------------------------------
+# STOCK HOLDS
+# ---------------------------------------------------------
+def adjust_reserved(changes):
+    """Expression moving reserved_quantity by {product_id: delta}, for an UPDATE."""
+    whens = [When(id=product_id, then=F('reserved_quantity') + Value(delta)) for product_id, delta in changes.items()]
+    return Case(*whens, default=F('reserved_quantity'), output_field=IntegerField())
+
+
+def _release_expired_holds(product_ids, now):
+    """
+    Delete the expired holds on `product_ids` and give their units back.
+    Call with the products locked. Returns {product_id: units released}.
+    """
+    expired = StockHold.objects.filter(product_id__in=product_ids, expires_at__lte=now)
+    released = dict(expired.values_list('product_id').annotate(units=Sum('quantity')).order_by())
+    if released:
+        expired.delete()
+        Product.objects.filter(id__in=released.keys()).update(
+            reserved_quantity=adjust_reserved({pk: -units for pk, units in released.items()})
+        )
+    return released
+
+
+def hold_stock(terminal, quantities, ttl=None):
+    """
+    Set `terminal`'s holds to {product_id: qty} (its whole basket) for the
+    next `ttl` seconds (STOCK_HOLD_TTL). Products it held but no longer
+    lists are released. Each product gets as much as is available, at
+    most what was asked for. Returns {'held': {product_id: qty},
+    'short': [product_id, ...], 'expires_at'}.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl or getattr(settings, 'STOCK_HOLD_TTL', 300))
+    quantities = {product_id: qty for product_id, qty in quantities.items() if qty > 0}
+
+    with transaction.atomic():
+        holding = StockHold.objects.filter(terminal=terminal)
+        products = lock_products({*quantities, *holding.values_list('product_id', flat=True)})
+        # Read under the locks: holds only change while their product is locked
+        current = {hold.product_id: hold for hold in holding}
+        released = _release_expired_holds(products.keys(), now)
+        expired = lots.expired_stock(products.keys(), timezone.localdate(now))
+
+        held, changes = {}, {}
+        short = [product_id for product_id in quantities if product_id not in products]
+        created, updated, dropped = [], [], []
+        for product_id, product in products.items():
+            hold = current.get(product_id)
+            if hold and hold.expires_at <= now:
+                hold = None  # deleted with the other expired holds
+            previous = hold.quantity if hold else 0
+            available = (
+                product.stock_quantity - (product.reserved_quantity - released.get(product_id, 0)) + previous
+                - expired.get(product_id, 0)
+            )
+            wanted = quantities.get(product_id, 0)
+            granted = max(0, min(wanted, available))
+            if granted < wanted:
+                short.append(product_id)
+            if granted != previous:
+                changes[product_id] = granted - previous
+
+            if not granted:
+                if hold:
+                    dropped.append(hold.pk)
+                continue
+            held[product_id] = granted
+            if hold:
+                hold.quantity, hold.expires_at = granted, expires_at
+                updated.append(hold)
+            else:
+                created.append(StockHold(terminal=terminal, product_id=product_id,
+                                         quantity=granted, expires_at=expires_at))
+
+        StockHold.objects.filter(pk__in=dropped).delete()
+        StockHold.objects.bulk_update(updated, ['quantity', 'expires_at'])
+        StockHold.objects.bulk_create(created)
+        if changes:
+            Product.objects.filter(id__in=changes.keys()).update(reserved_quantity=adjust_reserved(changes))
+
+    return {'held': held, 'short': short, 'expires_at': expires_at}
+
+
+def release_holds(terminal):
+    """Give back everything `terminal` holds, e.g. when its basket is cleared."""
+    return hold_stock(terminal, {})
+
+
+def release_expired_holds(now=None, chunk_size=500):
+    """
+    Sweep expired holds, `chunk_size` products per short transaction.
+    Returns the number of units given back.
+    """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            product_ids = list(
+                StockHold.objects.filter(expires_at__lte=now)
+                .order_by('product_id').values_list('product_id', flat=True).distinct()[:chunk_size]
+            )
+            if not product_ids:
+                break
+            lock_products(product_ids)
+            total += sum(_release_expired_holds(product_ids, now).values())
+        if len(product_ids) < chunk_size:
+            break
+    return total
+
+
+def available_stock(product_ids):
+    """{product_id: units free to sell}, i.e. unexpired stock not held by any basket."""
+    expired = lots.expired_stock(product_ids)
+    return {
+        product_id: max(stock - reserved - expired.get(product_id, 0), 0)
+        for product_id, stock, reserved in Product.objects.filter(id__in=product_ids)
+        .values_list('id', 'stock_quantity', 'reserved_quantity')
+    }
+
+
+# ---------------------------------------------------------
+# PURCHASE ORDERS
+# ---------------------------------------------------------
+CENT = Decimal('0.01')
+
+
+def place_purchase_order(order, details):
+    """
+    Save an unsaved PurchaseOrder with its unsaved PurchaseOrderDetail lines.
+
+    Line and order totals are computed once, in Decimal, before anything
+    is written; the lines then go in with a single bulk INSERT in the same
+    transaction as the order. Raises InvalidPurchaseOrder (and writes
+    nothing) for an order without lines or with unknown products.
+    """
+    if not details:
+        raise InvalidPurchaseOrder("Add at least one product line.")
+
+    product_ids = {detail.product_id for detail in details}
+    missing = product_ids - set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    if missing:
+        raise InvalidPurchaseOrder(f"Unknown product id(s): {', '.join(map(str, sorted(missing)))}")
+
+    for detail in details:
+        detail.sub_total = (detail.unit_cost * detail.quantity_ordered).quantize(CENT)
+    order.total_cost = sum((detail.sub_total for detail in details), Decimal('0'))
+
+    with transaction.atomic():
+        order.save()
+        for detail in details:
+            detail.order = order
+        PurchaseOrderDetail.objects.bulk_create(details)
+    return order
+
+
+# ---------------------------------------------------------
+# EXPIRY WRITE-OFF
+# ---------------------------------------------------------
+def get_system_staff():
+    """Staff member used for automated stock movements, created on first use."""
+    staff, _ = Staff.objects.get_or_create(
+        username='system',
+        defaults=dict(first_name='System', last_name='User', role='Admin', password_hash='system_user'),
+    )
+    return staff
+
+
+LOSS = ExpressionWrapper(F('quantity') * F('unit_cost'), output_field=DecimalField(max_digits=18, decimal_places=2))
+
+
+def expired_lots(queryset=None, today=None):
+    """Stock lots past their expiry date that still hold stock, of products in `queryset`."""
+    if today is None:
+        today = timezone.localdate()
+    due = StockLot.objects.filter(expiry_date__lt=today, quantity__gt=0)
+    if queryset is not None:
+        due = due.filter(product__in=queryset.values('pk'))
+    return due
+
+
+def expired_products(queryset=None, today=None):
+    """
+    Products with expired stock lots, annotated with the expired units
+    (expired_quantity), their cost (expired_loss) and the earliest expiry
+    among them (expired_since).
+    """
+    if today is None:
+        today = timezone.localdate()
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.filter(lots__expiry_date__lt=today, lots__quantity__gt=0).annotate(
+        expired_quantity=Sum('lots__quantity'),
+        expired_since=Min('lots__expiry_date'),
+        expired_loss=Sum(F('lots__quantity') * F('lots__unit_cost'),
+                         output_field=DecimalField(max_digits=18, decimal_places=2)),
+    )
+
+
+def expired_stock_summary(queryset=None, today=None):
+    """Count of products and total cost of expired stock, computed in one aggregate query."""
+    summary = expired_lots(queryset, today).aggregate(
+        product_count=Count('product_id', distinct=True),
+        total_loss=Sum(LOSS),
+    )
+    summary['total_loss'] = summary['total_loss'] or Decimal('0')
+    return summary
+
+
+def write_off_expired(staff, queryset=None, today=None, chunk_size=500):
+    """
+    Remove expired stock lots and log the losses. Unexpired lots of the
+    same products stay on the shelf.
+
+    Products are handled in chunks of `chunk_size`, each in its own short
+    transaction: the chunk is locked with SKIP LOCKED (rows a till is
+    currently selling are left for the next run), logged with one
+    bulk_create, and its lots emptied and stock reduced with one UPDATE
+    each. The products' expiry_date moves on to their next lot's.
+    Returns {'count', 'total_loss', 'items': [(product_name, quantity, loss)]}.
+    """
+    lots_due = expired_lots(queryset, today)
+    result = {'count': 0, 'total_loss': Decimal('0'), 'items': []}
+
+    while True:
+        with transaction.atomic():
+            before = OrderedDict(
+                Product.objects.select_for_update(skip_locked=True)
+                .filter(id__in=lots_due.values('product_id')).order_by('id')
+                .values_list('id', 'stock_quantity')[:chunk_size]
+            )
+            if not before:
+                break
+            product_ids = list(before)
+
+            expired = lots_due.filter(product_id__in=product_ids)
+            chunk = OrderedDict((product_id, [None, 0, Decimal('0')]) for product_id in product_ids)
+            for product_id, product_name, qty, loss in expired.values_list(
+                'product_id', 'product__product_name', 'quantity', LOSS
+            ):
+                row = chunk[product_id]
+                row[0] = product_name
+                row[1] += qty
+                row[2] += loss
+            expired.update(quantity=0)
+
+            now = timezone.now()
+            logs = InventoryLog.objects.bulk_create([
+                InventoryLog(
+                    staff=staff,
+                    product_id=product_id,
+                    log_type='Adjustment',
+                    reason='expiry',
+                    quantity=-qty,
+                    remarks='Expiry write-off',
+                    log_date=now,
+                )
+                for product_id, (_, qty, _) in chunk.items()
+            ])
+            Product.objects.filter(id__in=product_ids).update(
+                stock_quantity=Greatest(
+                    Case(
+                        *[When(id=product_id, then=F('stock_quantity') - Value(qty))
+                          for product_id, (_, qty, _) in chunk.items()],
+                        default=F('stock_quantity'), output_field=IntegerField(),
+                    ),
+                    Value(0),
+                ),
+                expiry_date=Subquery(
+                    StockLot.objects.filter(product_id=OuterRef('pk'), quantity__gt=0)
+                    .order_by(*lots.FEFO_ORDER).values('expiry_date')[:1]
+                ),
+                change_version=None,
+            )
+            CatalogVersion.stamp_on_commit()
+            stock = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'stock_quantity'))
+            ledger.record(
+                {product_id: stock[product_id] - before[product_id] for product_id in product_ids},
+                'expiry', 'Expiry write-off', when=now,
+            )
+            events.publish_logs(logs)
+            events.publish_stock(stock)
+
+        for product_name, qty, loss in chunk.values():
+            result['count'] += 1
+            result['total_loss'] += loss
+            result['items'].append((product_name, qty, loss))
+
+        if len(product_ids) < chunk_size:
+            break
+
+    return result
@@ -1,3 +1,1077 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import re
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+from smtplib import SMTPException
+from unittest.mock import patch
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Category, Supplier, Product, Staff, Discount, Sale, SaleDetail, InventoryLog, CatalogVersion,
+    OutboxEmail, PurchaseOrder, PurchaseOrderDetail, ProductDiscount, CategoryDiscount, StockHold,
+    StockLot, LotAllocation, StockLedgerEntry, StockSnapshot, DailySalesRollup, SalesRollupState,
+)
+from . import events, outbox, receipts, discounts, lots, ledger, rollups
+from .services import (
+    InsufficientStock, expired_products, checkout_sale, place_purchase_order, hold_stock, release_expired_holds,
+    write_off_expired, get_system_staff,
+)
+from .utils import generate_purchase_order_pdf
+
+
+class ReportIndexTests(TestCase):
+    """The hot report and lookup queries should be answered from the composite indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name='Dairy')
+        supplier = Supplier.objects.create(supplier_name='Brookside')
+        staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                     username='ann', password_hash='x')
+        now = timezone.now()
+        for i in range(20):
+            product = Product.objects.create(
+                product_name=f'Milk {i}', unit='pcs', unit_cost=1000, retail_price=1500,
+                stock_quantity=i, expiry_date=timezone.localdate() + timedelta(days=i - 10),
+                category=category, supplier=supplier,
+            )
+            Sale.objects.create(staff=staff, total_amount=1500 * i, payment_method='Cash',
+                                receipt_no=f'R{i}', sale_datetime=now - timedelta(days=i * 20))
+            InventoryLog.objects.create(staff=staff, product=product, log_type='Sale', quantity=1,
+                                        log_date=now - timedelta(days=i * 20))
+            Discount.objects.create(discount_name=f'D{i}', discount_type='Percentage', value=5,
+                                    start_date=timezone.localdate() - timedelta(days=i * 30),
+                                    end_date=timezone.localdate() + timedelta(days=i), is_active=i % 2 == 0)
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f'{index_name} not used:\n{plan}')
+
+    def test_sales_date_range(self):
+        since = timezone.now() - timedelta(days=30)
+        self.assertUsesIndex(
+            Sale.objects.filter(sale_datetime__gte=since).values('total_amount'),
+            'sale_datetime_total_idx',
+        )
+
+    def test_recent_inventory_transactions(self):
+        self.assertUsesIndex(
+            InventoryLog.objects.order_by('-log_date')[:50],
+            'inventory_log_date_idx',
+        )
+
+    def test_inventory_log_type_and_date(self):
+        since = timezone.now() - timedelta(days=30)
+        self.assertUsesIndex(
+            InventoryLog.objects.filter(log_type='Adjustment', log_date__gte=since),
+            'inventory_log_type_date_idx',
+        )
+
+    def test_expired_products(self):
+        self.assertUsesIndex(expired_products(), 'stock_lot_expiry_idx')
+
+    def test_active_discounts(self):
+        today = timezone.localdate()
+        self.assertUsesIndex(
+            Discount.objects.filter(is_active=True, start_date__lte=today, end_date__gte=today),
+            'discount_active_dates_idx',
+        )
+
+    def test_expiry_losses_by_reason(self):
+        since = timezone.now() - timedelta(days=365)
+        self.assertUsesIndex(
+            InventoryLog.objects.filter(reason='expiry', log_date__gte=since),
+            'inventory_log_reason_date_idx',
+        )
+
+
+class KpiCacheTests(TestCase):
+    """Dashboard KPIs are served from the cache until a sale is recorded."""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                          username='ann', password_hash='x')
+
+    def get_kpis(self):
+        response = self.client.get(reverse('kpi_data_api'))
+        return response['X-Cache'], response.json()
+
+    def test_hit_until_sale_saved(self):
+        self.assertEqual(self.get_kpis()[0], 'MISS')
+        status, data = self.get_kpis()
+        self.assertEqual((status, data['total_orders']), ('HIT', 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Sale.objects.create(staff=self.staff, total_amount=5000, payment_method='Cash', receipt_no='R1')
+
+        status, data = self.get_kpis()
+        self.assertEqual((status, data['total_orders']), ('MISS', 1))
+        stats = self.client.get(reverse('kpi_cache_stats_api')).json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+
+class DashboardApiTests(TestCase):
+    """/api/dashboard/ returns the same sections as the individual chart APIs."""
+
+    @classmethod
+    def setUpTestData(cls):
+        staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                     username='ann', password_hash='x')
+        supplier = Supplier.objects.create(supplier_name='Brookside')
+        for name, price, qty in (('Dairy', 1500, 3), ('Bakery', 80000, 2)):
+            product = Product.objects.create(
+                product_name=name, unit='pcs', unit_cost=1000, retail_price=price, stock_quantity=20,
+                category=Category.objects.create(category_name=name), supplier=supplier,
+            )
+            checkout_sale(Sale(staff=staff, payment_method='Cash', receipt_no=name),
+                          [SaleDetail(product=product, quantity_sold=qty, unit_price=price)])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sections_match_individual_apis(self):
+        year = timezone.localdate().year
+        dashboard = self.client.get(reverse('dashboard_api')).json()
+        sections = {
+            'kpis': reverse('kpi_data_api'),
+            'sales_by_category': reverse('sales_by_category_api'),
+            'histogram': reverse('sales_histogram_api'),
+            'sales_table': reverse('sales_table_data_api'),
+            'yearly_sales': f"{reverse('yearly_sales_api')}?start_year={year - 4}&end_year={year}",
+            'quarterly_sales': f"{reverse('quarterly_sales_api')}?start_year={year - 4}&end_year={year}",
+            'monthly_sales': f"{reverse('monthly_sales_api')}?year={year}",
+        }
+        for section, url in sections.items():
+            with self.subTest(section=section):
+                self.assertEqual(dashboard[section], self.client.get(url).json())
+
+    def test_period_filters_are_validated(self):
+        year = timezone.localdate().year
+        dairy = Category.objects.get(category_name='Dairy')
+        url = reverse('yearly_sales_api')
+        data = self.client.get(url, {'start_year': year, 'end_year': year, 'category': dairy.id,
+                                     'payment_method': 'Cash'}).json()
+        self.assertEqual(data['sales_totals'], [4500.0])
+        for params in ({'category': 'dairy'}, {'payment_method': 'Bitcoin'}, {'start_year': 0},
+                       {'start_year': year, 'end_year': year - 1}):
+            for api in ('yearly_sales_api', 'quarterly_sales_api'):
+                with self.subTest(api=api, params=params):
+                    response = self.client.get(reverse(api), params)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertNotIn('sales_totals', response.json())
+
+    def test_year_out_of_range_is_rejected(self):
+        for year in ('0', '20000', 'soon'):
+            for api in ('dashboard_api', 'monthly_sales_api'):
+                with self.subTest(api=api, year=year):
+                    self.assertEqual(self.client.get(reverse(api), {'year': year}).status_code, 400)
+
+    def test_cached_with_etag(self):
+        first = self.client.get(reverse('dashboard_api'))
+        second = self.client.get(reverse('dashboard_api'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual((first['X-Cache'], second['X-Cache'], second.status_code), ('MISS', 'HIT', 304))
+
+
+class ReportExportTests(TestCase):
+    """CSV exports are streamed row by row rather than built in memory."""
+
+    @classmethod
+    def setUpTestData(cls):
+        staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                     username='ann', password_hash='x')
+        milk = Product.objects.create(
+            product_name='Milk', unit='pcs', unit_cost=1000, retail_price=1500, stock_quantity=20,
+            category=Category.objects.create(category_name='Dairy'),
+            supplier=Supplier.objects.create(supplier_name='Brookside'),
+        )
+        tz = timezone.get_default_timezone()
+        for receipt_no, when, quantity in (('R1', datetime(2024, 3, 10, 9, 0), 2),
+                                           ('R2', datetime(2024, 3, 10, 23, 59), 1),
+                                           ('R3', datetime(2024, 3, 11, 0, 0), 3)):
+            sale = Sale.objects.create(staff=staff, total_amount=1500 * quantity, payment_method='Cash',
+                                       receipt_no=receipt_no, sale_datetime=timezone.make_aware(when, tz))
+            SaleDetail.objects.create(sale=sale, product=milk, quantity_sold=quantity, unit_price=1500,
+                                      sub_total=1500 * quantity)
+
+    def csv_rows(self, name, params=None):
+        response = self.client.get(reverse(name), params or {})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_sales_export_streams_every_sale(self):
+        rows = self.csv_rows('export_sales')
+        self.assertEqual(rows[0][:2], ['Receipt No', 'Date'])
+        self.assertEqual([(row[0], row[-1]) for row in rows[1:]], [('R3', '1'), ('R2', '1'), ('R1', '1')])
+
+    def test_table_export_streams_detail_rows(self):
+        rows = self.csv_rows('export_table_csv')
+        self.assertEqual(rows[0], ['Date', 'Product', 'Category', 'Qty', 'Price', 'Total', 'Customer'])
+        self.assertEqual([row[3] for row in rows[1:]], ['3', '1', '2'])
+        self.assertEqual(rows[1][1:3], ['Milk', 'Dairy'])
+
+    def test_day_filters_split_at_local_midnight(self):
+        for day, expected in (('2024-03-10', [('2024-03-10', '1'), ('2024-03-10', '2')]),
+                              ('2024-03-11', [('2024-03-11', '3')])):
+            with self.subTest(day=day):
+                rows = self.csv_rows('export_table_csv', {'from': day, 'to': day})
+                self.assertEqual([(row[0], row[3]) for row in rows[1:]], expected)
+                kpis = self.client.get(reverse('kpi_data_api'), {'from': day, 'to': day}).json()
+                self.assertEqual(kpis['total_orders'], len(expected))
+
+
+class SalesHistogramTests(TestCase):
+    """/api/sales/histogram/ counts every bucket in one aggregate query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                     username='ann', password_hash='x')
+        for i, total in enumerate((30000, 60000, 150000, 250000, 500000, 500000)):
+            Sale.objects.create(staff=staff, total_amount=total, payment_method='Cash', receipt_no=f'R{i}')
+
+    def histogram(self, params=None):
+        return self.client.get(reverse('sales_histogram_api'), params or {})
+
+    def test_default_ranges_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.histogram().json()
+        self.assertEqual(data['labels'], ['Under 50K', '50K–100K', '100K–200K', '200K–300K', '300K+'])
+        self.assertEqual(data['data'], [1, 1, 1, 1, 2])
+
+    def test_custom_edges_and_quantiles(self):
+        data = self.histogram({'edges': '100000,400000'}).json()
+        self.assertEqual((data['labels'], data['data']), (['Under 100K', '100K–400K', '400K+'], [2, 2, 2]))
+
+        data = self.histogram({'quantiles': 3}).json()
+        self.assertEqual((data['edges'], data['data']), ([150000.0, 500000.0], [2, 2, 2]))
+
+    def test_bad_parameters_are_rejected(self):
+        for params in ({'edges': '300000,100000'}, {'edges': '1,1'}, {'edges': 'abc'}, {'edges': 'nan'}, {'edges': '1,inf'},
+                       {'quantiles': 1}, {'quantiles': 50}, {'quantiles': 'x'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.histogram(params).status_code, 400)
+
+
+class KeysetPaginationTests(TestCase):
+    """List views page by cursor and visit every row exactly once in both directions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name='Bakery')
+        supplier = Supplier.objects.create(supplier_name='Mill')
+        staff = Staff.objects.create(first_name='Ann', last_name='Clerk', role='Cashier',
+                                     username='ann', password_hash='x')
+        product = Product.objects.create(product_name='Bread', unit='pcs', unit_cost=1000,
+                                         retail_price=1500, category=category, supplier=supplier)
+        same_time = timezone.now()
+        for i in range(7):
+            # Duplicate timestamps exercise the id tie-breaker
+            InventoryLog.objects.create(staff=staff, product=product, log_type='Purchase', quantity=i,
+                                        log_date=same_time - timedelta(hours=i // 2))
+
+    def walk(self, **params):
+        params = {'format': 'json', 'page_size': 3, **params}
+        pages = []
+        while True:
+            data = self.client.get(reverse('inventory_log_list'), params).json()
+            pages.append([row['id'] for row in data['results']])
+            if not data['next_cursor']:
+                return pages, data
+            params['cursor'] = data['next_cursor']
+
+    def test_forward_and_back(self):
+        pages, last = self.walk()
+        expected = list(InventoryLog.objects.order_by('-log_date', '-pk').values_list('pk', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+
+        data = self.client.get(reverse('inventory_log_list'), {
+            'format': 'json', 'page_size': 3, 'cursor': last['prev_cursor'],
+        }).json()
+        self.assertEqual([row['id'] for row in data['results']], pages[-2])
+
+    def test_cursor_is_tied_to_sort(self):
+        pages, last = self.walk()
+        response = self.client.get(reverse('inventory_log_list'), {
+            'format': 'json', 'sort': 'date', 'cursor': last['prev_cursor'],
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class InventoryProductsApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name='Dairy')
+        supplier = Supplier.objects.create(supplier_name='Brookside')
+        for name in ('Milk', 'Yoghurt', 'Butter'):
+            Product.objects.create(product_name=name, unit='pcs', unit_cost=1000, retail_price=1500,
+                                   stock_quantity=20, category=category, supplier=supplier)
+
+    def test_fields_projection(self):
+        data = self.client.get(reverse('inventory_products_api'), {'fields': 'id,product_name'}).json()
+        self.assertEqual([set(p) for p in data['products']], [{'id', 'product_name'}] * 3)
+        self.assertEqual([p['product_name'] for p in data['products']], ['Butter', 'Milk', 'Yoghurt'])
+
+    def test_unchanged_page_is_not_modified(self):
+        url = reverse('inventory_products_api')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Product.objects.filter(product_name='Milk').update(stock_quantity=5)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CatalogDeltaSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category_name='Dairy')
+        cls.supplier = Supplier.objects.create(supplier_name='Brookside')
+        cls.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                         username='ann', password_hash='x')
+        for name in ('Milk', 'Yoghurt', 'Butter'):
+            Product.objects.create(product_name=name, unit='pcs', unit_cost=1000, retail_price=1500,
+                                   stock_quantity=20, category=cls.category, supplier=cls.supplier)
+
+    def changes(self, **params):
+        return self.client.get(reverse('inventory_product_changes_api'), params).json()
+
+    def test_only_changed_products_are_returned(self):
+        version = self.changes(since=0)['version']
+        self.assertEqual(self.changes(since=version)['products'], [])
+
+        milk = Product.objects.get(product_name='Milk')
+        sale = Sale(staff=self.staff, payment_method='Cash', receipt_no='R1')
+        checkout_sale(sale, [SaleDetail(product=milk, quantity_sold=2, unit_price=1500)])
+
+        data = self.changes(since=version, fields='stock_quantity')
+        self.assertEqual(data['products'], [{'id': milk.id, 'stock_quantity': 18}])
+        self.assertGreater(data['version'], version)
+
+    def test_batches_resume_inside_one_version(self):
+        Product.objects.update(change_version=CatalogVersion.next_version())
+        seen, params = [], {'since': 0, 'limit': 2}
+        while True:
+            data = self.changes(**params)
+            seen += [p['id'] for p in data['products']]
+            if not data['has_more']:
+                break
+            params = {'since': data['version'], 'after': data['after'], 'limit': 2}
+        self.assertEqual(sorted(seen), sorted(Product.objects.values_list('id', flat=True)))
+
+    def test_checkout_stamps_version_after_commit(self):
+        milk = Product.objects.get(product_name='Milk')
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no='R1'),
+                          [SaleDetail(product=milk, quantity_sold=2, unit_price=1500)])
+        # No till waits on the shared counter row while its sale is open
+        self.assertFalse([q for q in queries if 'catalog_version' in q['sql']])
+        milk.refresh_from_db()
+        self.assertIsNone(milk.change_version)
+
+        for callback in callbacks:
+            callback()
+        milk.refresh_from_db()
+        self.assertEqual(milk.change_version, CatalogVersion.objects.get(pk=1).value)
+
+    def test_deletions_are_reported(self):
+        version = self.changes(since=0)['version']
+        butter = Product.objects.get(product_name='Butter')
+        butter_id = butter.id
+        butter.delete()
+        self.assertEqual(self.changes(since=version)['deleted'], [butter_id])
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                         username='ann', password_hash='x')
+        category = Category.objects.create(category_name='Dairy')
+        supplier = Supplier.objects.create(supplier_name='Brookside')
+        cls.milk, cls.butter = [
+            Product.objects.create(product_name=name, unit='pcs', unit_cost=1000, retail_price=1500,
+                                   stock_quantity=stock, category=category, supplier=supplier)
+            for name, stock in (('Milk', 10), ('Butter', 2))
+        ]
+
+    def test_short_line_rejects_whole_basket(self):
+        basket = [SaleDetail(product=self.milk, quantity_sold=4, unit_price=1500),
+                  SaleDetail(product=self.butter, quantity_sold=2, unit_price=1500),
+                  SaleDetail(product=self.butter, quantity_sold=1, unit_price=1500)]
+        entries = StockLedgerEntry.objects.count()
+        with self.assertRaisesMessage(InsufficientStock, 'Insufficient stock for Butter. Available: 2'):
+            checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no='R1'), basket)
+
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(SaleDetail.objects.exists())
+        self.assertFalse(InventoryLog.objects.exists())
+        self.assertFalse(LotAllocation.objects.exists())
+        self.assertEqual(StockLedgerEntry.objects.count(), entries)
+        self.assertEqual(dict(Product.objects.values_list('product_name', 'stock_quantity')),
+                         {'Milk': 10, 'Butter': 2})
+        self.assertEqual(sum(StockLot.objects.values_list('quantity', flat=True)), 12)
+
+    def test_basket_is_written_in_batches(self):
+        basket = [SaleDetail(product=product, quantity_sold=1, unit_price=1500)
+                  for product in (self.milk, self.butter, self.milk)]
+        with CaptureQueriesContext(connection) as queries:
+            checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no='R1'), basket)
+        statements = [' '.join(q['sql'].split()[:3]) for q in queries.captured_queries]
+        self.assertEqual(statements.count('UPDATE "product" SET'), 1)
+        self.assertEqual(statements.count('INSERT INTO "inventory_log"'), 1)
+        self.assertEqual(InventoryLog.objects.count(), 3)
+        self.assertEqual(dict(Product.objects.values_list('product_name', 'stock_quantity')),
+                         {'Milk': 8, 'Butter': 1})
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def setUp(self):
+        CatalogVersion.objects.update_or_create(pk=1, defaults={'value': 1})
+        category = Category.objects.create(category_name='Dairy')
+        supplier = Supplier.objects.create(supplier_name='Brookside')
+        self.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                          username='ann', password_hash='x')
+        self.milk, self.bread = [
+            Product.objects.create(product_name=name, unit='pcs', unit_cost=1000, retail_price=1500,
+                                   stock_quantity=20, category=category, supplier=supplier)
+            for name in ('Milk', 'Bread')
+        ]
+
+    def test_checkouts_of_different_products_do_not_block(self):
+        first_open, second_done = threading.Event(), threading.Event()
+        errors = []
+
+        def sell(product, receipt_no, hold_open):
+            try:
+                with transaction.atomic():
+                    checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no=receipt_no),
+                                  [SaleDetail(product=product, quantity_sold=1, unit_price=1500)])
+                    if hold_open:
+                        first_open.set()
+                        second_done.wait(10)
+                if not hold_open:
+                    second_done.set()
+            except Exception as e:
+                errors.append(e)
+                first_open.set()
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=sell, args=(self.milk, 'R1', True))
+        first.start()
+        first_open.wait(10)
+        second = threading.Thread(target=sell, args=(self.bread, 'R2', False))
+        second.start()
+        # The second till commits while the first sale is still open
+        self.assertTrue(second_done.wait(5))
+        first.join()
+        second.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(dict(Product.objects.values_list('product_name', 'stock_quantity')),
+                         {'Milk': 19, 'Bread': 19})
+
+    def test_two_tills_cannot_oversell(self):
+        Product.objects.filter(pk=self.milk.pk).update(stock_quantity=3)
+        self.milk.lots.update(quantity=3)
+        start = threading.Barrier(2)
+        results = []
+
+        def sell(receipt_no):
+            try:
+                start.wait(5)
+                checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no=receipt_no),
+                              [SaleDetail(product=self.milk, quantity_sold=2, unit_price=1500)])
+                results.append('sold')
+            except InsufficientStock:
+                results.append('short')
+            finally:
+                connection.close()
+
+        tills = [threading.Thread(target=sell, args=(receipt_no,)) for receipt_no in ('R1', 'R2')]
+        for till in tills:
+            till.start()
+        for till in tills:
+            till.join()
+        self.assertEqual(sorted(results), ['short', 'sold'])
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.stock_quantity, 1)
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                         username='ann', password_hash='x')
+        supplier = Supplier.objects.create(supplier_name='Brookside')
+        cls.milk, cls.bread = [
+            Product.objects.create(product_name=name, unit='pcs', unit_cost=cost, retail_price=price,
+                                   stock_quantity=50, category=Category.objects.create(category_name=category),
+                                   supplier=supplier)
+            for name, category, cost, price in (('Milk', 'Dairy', 1000, 1500), ('Bread', 'Bakery', 2000, 3000))
+        ]
+
+    def sell(self, receipt_no, *lines):
+        return checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no=receipt_no), [
+            SaleDetail(product=product, quantity_sold=qty, unit_price=product.retail_price) for product, qty in lines
+        ])
+
+    def totals(self):
+        return {
+            category: (revenue, cogs, quantity, orders)
+            for category, revenue, cogs, quantity, orders in DailySalesRollup.objects.order_by('category_id')
+            .values_list('category__category_name', 'revenue', 'cogs', 'quantity', 'order_count')
+        }
+
+    def gross_sales_today(self):
+        today = timezone.localdate().isoformat()
+        response = self.client.get(reverse('financial_report_api'), {'start': today, 'end': today})
+        return [Decimal(str(row['value'])) for row in response.json()['gross_sales']]
+
+    def test_checkout_and_rebuild_agree(self):
+        rollups.rebuild()
+        self.assertTrue(rollups.is_covered())
+        self.sell('R1', (self.milk, 1), (self.bread, 1))
+        self.sell('R2', (self.bread, 2))
+        expected = {
+            'Dairy': (Decimal('1500.00'), Decimal('1000.00'), 1, 0),
+            'Bakery': (Decimal('9000.00'), Decimal('6000.00'), 3, 2),
+        }
+        self.assertEqual(self.totals(), expected)
+
+        DailySalesRollup.objects.all().delete()
+        self.assertEqual(rollups.rebuild(), 2)
+        self.assertEqual(self.totals(), expected)
+        self.assertEqual(SalesRollupState.objects.get().covered_from, None)
+
+    def test_edits_outside_checkout_fall_back_to_raw_tables(self):
+        sale = self.sell('R1', (self.milk, 2))
+        rollups.rebuild()
+        DailySalesRollup.objects.update(revenue=1)
+        self.assertEqual(self.gross_sales_today(), [Decimal('1')])
+
+        detail = sale.details.get()
+        detail.quantity_sold = 3
+        detail.save()
+        self.assertFalse(rollups.is_covered(timezone.localdate()))
+        self.assertEqual(self.gross_sales_today(), [Decimal('3000')])
+
+        rollups.rebuild(timezone.localdate())
+        self.assertTrue(rollups.is_covered(timezone.localdate()))
+        self.assertFalse(rollups.is_covered())
+
+
+class LiveEventsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                         username='ann', password_hash='x')
+        cls.milk = Product.objects.create(
+            product_name='Milk', unit='pcs', unit_cost=1000, retail_price=1500, stock_quantity=20,
+            category=Category.objects.create(category_name='Dairy'),
+            supplier=Supplier.objects.create(supplier_name='Brookside'),
+        )
+
+    def test_checkout_publishes_after_commit(self):
+        broker = events.InProcessBroker()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def subscribe():
+            return broker.subscribe()
+        queue = loop.run_until_complete(subscribe())
+
+        with patch.object(events, '_broker', broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no='R1'),
+                              [SaleDetail(product=self.milk, quantity_sold=3, unit_price=1500)])
+                loop.run_until_complete(asyncio.sleep(0))
+                self.assertTrue(queue.empty())
+        loop.run_until_complete(asyncio.sleep(0))
+
+        received = {}
+        while not queue.empty():
+            _, topic, data = queue.get_nowait()
+            received[topic] = data
+        self.assertEqual(received['sales']['orders'], 1)
+        self.assertEqual(received['inventory_log']['staff_name'], 'Ann Cashier')
+        self.assertEqual(received['stock']['levels'],
+                         [{'product_id': self.milk.id, 'stock_quantity': 17}])
+
+
+class StockHoldTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                         username='ann', password_hash='x')
+        cls.milk = Product.objects.create(
+            product_name='Milk', unit='pcs', unit_cost=1000, retail_price=1500, stock_quantity=20,
+            category=Category.objects.create(category_name='Dairy'),
+            supplier=Supplier.objects.create(supplier_name='Brookside'),
+        )
+
+    def sell(self, terminal, quantity, receipt_no):
+        return checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no=receipt_no),
+                             [SaleDetail(product=self.milk, quantity_sold=quantity, unit_price=1500)],
+                             terminal=terminal)
+
+    def test_held_stock_is_kept_for_its_terminal(self):
+        self.assertEqual(hold_stock('till-1', {self.milk.id: 15})['held'], {self.milk.id: 15})
+        result = hold_stock('till-2', {self.milk.id: 10})
+        self.assertEqual((result['held'], result['short']), ({self.milk.id: 5}, [self.milk.id]))
+
+        with self.assertRaises(InsufficientStock):
+            self.sell('till-3', 1, 'R1')
+        self.sell('till-1', 15, 'R2')
+        self.milk.refresh_from_db()
+        self.assertEqual((self.milk.stock_quantity, self.milk.reserved_quantity), (5, 5))
+        self.assertFalse(StockHold.objects.filter(terminal='till-1').exists())
+
+        hold_stock('till-2', {})
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.reserved_quantity, 0)
+
+    def test_product_edit_keeps_open_holds(self):
+        product = Product.objects.get(pk=self.milk.pk)
+        hold_stock('till-1', {self.milk.id: 6})
+        product.retail_price = 1600
+        product.stock_quantity += 5
+        product.save()
+        self.milk.refresh_from_db()
+        self.assertEqual((self.milk.retail_price, self.milk.stock_quantity, self.milk.reserved_quantity),
+                         (1600, 25, 6))
+        release_expired_holds(now=timezone.now() + timedelta(days=1))
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.reserved_quantity, 0)
+
+    def test_sweeper_releases_expired_holds(self):
+        hold_stock('till-1', {self.milk.id: 8}, ttl=60)
+        self.assertEqual(release_expired_holds(), 0)
+        self.assertEqual(release_expired_holds(now=timezone.now() + timedelta(minutes=2)), 8)
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.reserved_quantity, 0)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_api_holds_for_the_session(self):
+        response = self.client.post(reverse('stock_holds_api'), {'items': {self.milk.id: 25}},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['short'], [self.milk.id])
+        self.assertEqual(response.json()['available'], {str(self.milk.id): 0})
+        hold = StockHold.objects.get()
+        self.assertEqual((hold.terminal, hold.quantity), (self.client.session.session_key, 20))
+
+
+class StockLotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                         username='ann', password_hash='x')
+        today = timezone.localdate()
+        # Saved with 10 in stock: becomes the first lot, already expired
+        cls.milk = Product.objects.create(
+            product_name='Milk', unit='pcs', unit_cost=1000, retail_price=1500, stock_quantity=10,
+            batch_number='OLD', expiry_date=today - timedelta(days=1),
+            category=Category.objects.create(category_name='Dairy'),
+            supplier=Supplier.objects.create(supplier_name='Brookside'),
+        )
+        for batch, days, qty in (('LATE', 30, 5), ('SOON', 3, 4)):
+            lots.receive_lot(cls.milk, qty, batch, today + timedelta(days=days), Decimal('900'))
+            cls.milk.stock_quantity += qty
+            cls.milk.save()
+
+    def sell(self, receipt_no, quantity, batch_number=None):
+        detail = SaleDetail(product=self.milk, quantity_sold=quantity, unit_price=1500, batch_number=batch_number)
+        sale = checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no=receipt_no), [detail])
+        return detail, sorted(LotAllocation.objects.filter(sale=sale).values_list('lot__batch_number', 'quantity'))
+
+    def test_sale_picks_earliest_unexpired_lot_first(self):
+        detail, allocated = self.sell('R1', 6)
+        self.assertEqual(detail.batch_number, 'SOON, LATE')
+        self.assertEqual(allocated, [('LATE', 2), ('SOON', 4)])
+        self.assertEqual(dict(self.milk.lots.values_list('batch_number', 'quantity')),
+                         {'OLD': 10, 'SOON': 0, 'LATE': 3})
+
+        # Only the 3 unexpired units are left to sell
+        with self.assertRaises(InsufficientStock):
+            self.sell('R2', 4)
+
+    def test_scanned_batch_is_sold_first(self):
+        detail, allocated = self.sell('R1', 3, batch_number='LATE')
+        self.assertEqual((detail.batch_number, allocated), ('LATE', [('LATE', 3)]))
+        detail, allocated = self.sell('R2', 4, batch_number='LATE')
+        self.assertEqual((detail.batch_number, allocated), ('LATE, SOON', [('LATE', 2), ('SOON', 2)]))
+
+    def test_write_off_removes_only_expired_lots(self):
+        result = write_off_expired(get_system_staff())
+        self.assertEqual(result['items'], [('Milk', 10, Decimal('10000.00'))])
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.stock_quantity, 9)
+        self.assertEqual(self.milk.expiry_date, timezone.localdate() + timedelta(days=3))
+        self.assertFalse(expired_products().exists())
+
+    def test_stock_edits_keep_lots_in_step(self):
+        self.milk.stock_quantity = 6
+        self.milk.save()
+        self.assertEqual(dict(self.milk.lots.values_list('batch_number', 'quantity')),
+                         {'OLD': 0, 'SOON': 1, 'LATE': 5})
+
+
+class ExpiryWriteOffTests(TestCase):
+    """The command, the confirm view and the admin action share write_off_expired()."""
+    STOCK = {'Milk': 4, 'Yoghurt': 6, 'Cheese': 5}
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name='Dairy')
+        supplier = Supplier.objects.create(supplier_name='Brookside')
+        today = timezone.localdate()
+        for name, days in (('Milk', -2), ('Yoghurt', -1), ('Cheese', 10)):
+            Product.objects.create(
+                product_name=name, unit='pcs', unit_cost=1000, retail_price=1500, stock_quantity=cls.STOCK[name],
+                batch_number=name.upper(), expiry_date=today + timedelta(days=days),
+                category=category, supplier=supplier,
+            )
+
+    def assertWrittenOff(self, *names):
+        self.assertEqual(dict(Product.objects.values_list('product_name', 'stock_quantity')),
+                         {name: 0 if name in names else qty for name, qty in self.STOCK.items()})
+        self.assertEqual(
+            dict(InventoryLog.objects.filter(reason='expiry').values_list('product__product_name', 'quantity')),
+            {name: -self.STOCK[name] for name in names},
+        )
+        self.assertFalse(StockLot.objects.filter(product__product_name__in=names, quantity__gt=0).exists())
+
+    def test_command_writes_off_in_chunks(self):
+        out = io.StringIO()
+        call_command('auto_writeoff_expired', chunk_size=1, stdout=out)
+        self.assertIn('Successfully wrote off 2 expired products. Total loss: $10000.00', out.getvalue())
+        self.assertWrittenOff('Milk', 'Yoghurt')
+        self.assertEqual(ledger.stock_on(timezone.now()), dict(Product.objects.values_list('id', 'stock_quantity')))
+
+        out = io.StringIO()
+        call_command('auto_writeoff_expired', stdout=out)
+        self.assertIn('No expired products found', out.getvalue())
+
+    def test_view_writes_off_everything_expired(self):
+        response = self.client.post(reverse('execute_expiry_writeoff'))
+        self.assertRedirects(response, reverse('expiry_preview'), fetch_redirect_response=False)
+        self.assertWrittenOff('Milk', 'Yoghurt')
+
+    def test_selection_limits_the_write_off(self):
+        result = write_off_expired(get_system_staff(), queryset=Product.objects.filter(product_name='Milk'))
+        self.assertEqual(result['items'], [('Milk', 4, Decimal('4000.00'))])
+        self.assertWrittenOff('Milk')
+
+
+class StockLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                         username='ann', password_hash='x')
+        cls.rice = Product.objects.create(
+            product_name='Rice', unit='kg', unit_cost=3000, retail_price=4000, stock_quantity=10,
+            category=Category.objects.create(category_name='Grains'),
+            supplier=Supplier.objects.create(supplier_name='Mukwano'),
+        )
+
+    def test_stock_changes_are_signed_entries(self):
+        checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no='R1'),
+                      [SaleDetail(product=self.rice, quantity_sold=4, unit_price=4000)])
+        self.rice.refresh_from_db()
+        self.rice.stock_quantity += 20
+        self.rice.stock_reason = 'receipt'
+        self.rice.save()
+        self.assertEqual(
+            list(self.rice.ledger_entries.order_by('id').values_list('reason', 'quantity')),
+            [('opening', 10), ('sale', -4), ('receipt', 20)],
+        )
+
+    def test_stock_on_reads_snapshot_and_tail(self):
+        past = timezone.now() - timedelta(days=30)
+        StockLedgerEntry.objects.filter(product=self.rice).update(created_at=past)
+        self.assertEqual(ledger.take_snapshots(), 1)
+        self.rice.stock_quantity = 7
+        self.rice.save()
+        self.assertEqual(ledger.take_snapshots(min_entries=2), 0)
+
+        self.assertEqual(ledger.stock_on(past - timedelta(days=1))[self.rice.id], 0)
+        self.assertEqual(ledger.stock_on(past + timedelta(days=1))[self.rice.id], 10)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(ledger.stock_on(timezone.now(), [self.rice.id]), {self.rice.id: 7})
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(StockSnapshot.objects.get(product=self.rice).quantity, 10)
+
+    def test_stock_adjustment_keeps_ledger_in_step(self):
+        stale = Product.objects.get(pk=self.rice.pk)
+        checkout_sale(Sale(staff=self.staff, payment_method='Cash', receipt_no='R1'),
+                      [SaleDetail(product=stale, quantity_sold=3, unit_price=4000)])
+        response = self.client.post(reverse('adjust_stock'), {
+            'product_id': self.rice.id, 'adjustment_type': 'increase', 'quantity': 5, 'reason': 'receipt',
+        }, content_type='application/json')
+        self.assertEqual(response.json(), {'success': True, 'stock_quantity': 12})
+        self.assertEqual(ledger.stock_on(timezone.now())[self.rice.id], 12)
+
+        response = self.client.post(reverse('adjust_stock'), {'product_id': 'x', 'quantity': 1},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_verify_reports_and_fixes_drift(self):
+        Product.objects.filter(id=self.rice.id).update(stock_quantity=12)
+        out = io.StringIO()
+        call_command('verify_stock_ledger', '--chunk-size', '1', '--fix', stdout=out)
+        self.assertIn('Rice (#%d): stock 12, ledger 10' % self.rice.id, out.getvalue())
+        self.assertEqual(ledger.stock_on(timezone.now())[self.rice.id], 12)
+        out = io.StringIO()
+        call_command('verify_stock_ledger', stdout=out)
+        self.assertIn('0 out of step', out.getvalue())
+
+
+class DiscountIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                         username='ann', password_hash='x')
+        cls.milk = Product.objects.create(
+            product_name='Milk', unit='pcs', unit_cost=1000, retail_price=2500, stock_quantity=20,
+            category=Category.objects.create(category_name='Dairy'),
+            supplier=Supplier.objects.create(supplier_name='Brookside'),
+        )
+        cls.fixed = Discount.objects.create(discount_name='Fixed', discount_type='Fixed', value=500,
+                                            start_date=today, end_date=today)
+        Discount.objects.create(discount_name='Ten percent', discount_type='Percentage', value=10,
+                                start_date=today - timedelta(days=7), end_date=today + timedelta(days=7))
+        Discount.objects.create(discount_name='Next week', discount_type='Percentage', value=50,
+                                start_date=today + timedelta(days=7), end_date=today + timedelta(days=14))
+
+    def setUp(self):
+        discounts.invalidate()
+
+    def basket(self, quantity=4):
+        return [SaleDetail(product=self.milk, quantity_sold=quantity, unit_price=Decimal('2500'))]
+
+    def test_prices_from_memory_until_discounts_change(self):
+        discounts.get_index()
+        with self.assertNumQueries(0):
+            pricing = discounts.price_basket(self.basket())
+        self.assertEqual((pricing['basket'], pricing['total']), (Decimal('1500.00'), Decimal('8500.00')))
+        self.assertEqual([a['discount'].discount_name for a in pricing['applied']], ['Fixed', 'Ten percent'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fixed.is_active = False
+            self.fixed.save()
+        self.assertEqual(discounts.price_basket(self.basket())['basket'], Decimal('1000.00'))
+
+    @override_settings(DISCOUNT_INDEX_MAX_AGE=60)
+    def test_change_in_another_process_is_picked_up_after_max_age(self):
+        index = discounts.get_index()
+        # Another worker deactivates the promotion: no signal or cache bump reaches this one
+        Discount.objects.filter(pk=self.fixed.pk).update(is_active=False)
+        built_at = index.built_at
+        with patch('inventory.discounts.time.monotonic', return_value=built_at + 59):
+            self.assertIs(discounts.get_index(), index)
+            self.assertEqual(discounts.price_basket(self.basket())['basket'], Decimal('1500.00'))
+        with patch('inventory.discounts.time.monotonic', return_value=built_at + 60):
+            self.assertIsNot(discounts.get_index(), index)
+            self.assertEqual(discounts.price_basket(self.basket())['basket'], Decimal('1000.00'))
+
+    def test_line_rules_bogo_and_exclusive(self):
+        today = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True):
+            bogo = Discount.objects.create(discount_name='Buy 2 get 1', discount_type='BOGO', value=1, priority=1,
+                                           buy_quantity=2, get_quantity=1, start_date=today, end_date=today)
+            ProductDiscount.objects.create(product=self.milk, discount=bogo)
+            dairy = Discount.objects.create(discount_name='Dairy 5%', discount_type='Percentage', value=5,
+                                            start_date=today, end_date=today)
+            CategoryDiscount.objects.create(category=self.milk.category, discount=dairy)
+
+        # 7 units: two free from buy-2-get-1, then 5% of the line
+        [line] = basket = self.basket(7)
+        pricing = discounts.price_basket(basket)
+        self.assertEqual(line.discount, bogo)
+        self.assertEqual(line.discount_value, Decimal('5000') + Decimal('875.00'))
+        self.assertEqual(line.sub_total, Decimal('11625.00'))
+        self.assertEqual(pricing['total'], line.sub_total - 500 - Decimal('1162.50'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dairy.priority, dairy.exclusive = 2, True
+            dairy.save()
+        [line] = basket = self.basket(7)
+        discounts.price_basket(basket)
+        self.assertEqual((line.discount, line.discount_value), (dairy, Decimal('875.00')))
+
+    def test_checkout_saves_discounted_total_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('create_sale'), {
+                'staff': self.staff.id, 'sale_datetime': timezone.localtime().strftime('%Y-%m-%d %H:%M:%S'),
+                'payment_method': 'Cash', 'receipt_no': 'R1',
+                'details-TOTAL_FORMS': '1', 'details-INITIAL_FORMS': '0',
+                'details-0-product': self.milk.id, 'details-0-quantity_sold': '4', 'details-0-unit_price': '2500',
+            })
+        self.assertRedirects(response, reverse('sales_list'), fetch_redirect_response=False)
+        sale = Sale.objects.get()
+        self.assertEqual((sale.total_amount, sale.discount_applied), (Decimal('8500.00'), Decimal('1500.00')))
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE "sale"')])
+
+    def test_line_discounts_are_counted_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            promo = Discount.objects.create(discount_name='Milk 20%', discount_type='Percentage', value=20,
+                                            start_date=timezone.localdate(), end_date=timezone.localdate())
+            ProductDiscount.objects.create(product=self.milk, discount=promo)
+        self.client.post(reverse('create_sale'), {
+            'staff': self.staff.id, 'sale_datetime': timezone.localtime().strftime('%Y-%m-%d %H:%M:%S'),
+            'payment_method': 'Cash', 'receipt_no': 'R1',
+            'details-TOTAL_FORMS': '1', 'details-INITIAL_FORMS': '0',
+            'details-0-product': self.milk.id, 'details-0-quantity_sold': '4', 'details-0-unit_price': '2500',
+        })
+        # 2,000 off the line, then 500 + 10% of 8,000 off the basket
+        sale = Sale.objects.get()
+        self.assertEqual((sale.total_amount, sale.discount_applied), (Decimal('6700.00'), Decimal('1300.00')))
+        self.assertEqual(sale.details.get().discount_value, Decimal('2000.00'))
+        self.assertEqual(DailySalesRollup.objects.get().discount_total, Decimal('3300.00'))
+        self.assertEqual(self.client.get(reverse('taxes_report_api')).json()['total_tax'], 0)
+        self.assertEqual(receipts.receipt_data('R1')['discount'], Decimal('3300.00'))
+
+
+class ReceiptTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        staff = Staff.objects.create(first_name='Ann', last_name='Cashier', role='Cashier',
+                                     username='ann', password_hash='x')
+        milk = Product.objects.create(
+            product_name='Long life full cream milk 500ml', unit='pcs', unit_cost=1000, retail_price=1500,
+            stock_quantity=20, category=Category.objects.create(category_name='Dairy'),
+            supplier=Supplier.objects.create(supplier_name='Brookside'),
+        )
+        checkout_sale(Sale(staff=staff, payment_method='Cash', receipt_no='R1', discount_applied=500),
+                      [SaleDetail(product=milk, quantity_sold=3, unit_price=1500)])
+
+    def setUp(self):
+        receipts.rendered.clear()
+
+    def test_thermal_text_fits_the_roll(self):
+        response = self.client.get(reverse('print_receipt', args=['R1']), {'format': 'text', 'width': '58'})
+        lines = response.content.decode().splitlines()
+        self.assertTrue(all(len(line) <= 32 for line in lines))
+        self.assertIn('Subtotal              UGx. 4,500', lines)
+        self.assertIn(f"Date: {timezone.localtime(Sale.objects.get().sale_datetime):%Y-%m-%d %H:%M:%S}", lines)
+        self.assertEqual(self.client.get(reverse('print_receipt', args=['R1']), {'width': '72'}).status_code, 400)
+
+    def test_reprint_is_cached_until_the_sale_changes(self):
+        self.client.get(reverse('print_receipt', args=['R1']), {'format': 'thermal'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('print_receipt', args=['R1']), {'format': 'thermal'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+        sale = Sale.objects.get()
+        sale.total_amount = 4000
+        sale.save()
+        response = self.client.get(reverse('print_receipt', args=['R1']), {'format': 'escpos'})
+        self.assertTrue(response.content.startswith(receipts.ESCPOS_INIT))
+        self.assertIn(b'UGx. 4,000', response.content)
+
+    def test_edit_in_another_process_is_printed_after_ttl(self):
+        url = reverse('print_receipt', args=['R1'])
+        now = 1000.0
+        with patch('inventory.receipts.time.monotonic', return_value=now):
+            self.client.get(url, {'format': 'text'})
+        # Another worker edits the sale: no signal reaches this one
+        Sale.objects.filter(receipt_no='R1').update(total_amount=4000)
+        with patch('inventory.receipts.time.monotonic', return_value=now + receipts.rendered.ttl - 1):
+            self.assertNotIn('UGx. 4,000', self.client.get(url, {'format': 'text'}).content.decode())
+        with patch('inventory.receipts.time.monotonic', return_value=now + receipts.rendered.ttl):
+            self.assertIn('UGx. 4,000', self.client.get(url, {'format': 'text'}).content.decode())
+
+
+@override_settings(OUTBOX_SEND_IN_PROCESS=False, OUTBOX_MAX_ATTEMPTS=2)
+class PurchaseOrderTests(TestCase):
+    """Purchase orders are saved in bulk and their emails sent by the outbox worker."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.supplier = Supplier.objects.create(supplier_name='Brookside', email='orders@brookside.test')
+        cls.product = Product.objects.create(
+            product_name='Milk', unit='pcs', unit_cost=1000, retail_price=1500, stock_quantity=20,
+            category=Category.objects.create(category_name='Dairy'), supplier=cls.supplier,
+        )
+
+    def create_order(self):
+        response = self.client.post(reverse('create_purchase_order'), {
+            'supplier': self.supplier.id, 'invoice_no': 'INV-1',
+            'product[]': [self.product.id], 'quantity[]': ['10'], 'unit_cost[]': ['1000'],
+        })
+        self.assertRedirects(response, reverse('purchase_order_list'), fetch_redirect_response=False)
+
+    def test_lines_inserted_in_one_statement_with_decimal_totals(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('create_purchase_order'), {
+                'supplier': self.supplier.id,
+                'product[]': [self.product.id] * 100, 'quantity[]': ['3'] * 100, 'unit_cost[]': ['0.10'] * 100,
+            })
+        self.assertEqual(response.status_code, 302)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "purchase_order_detail"')]
+        self.assertEqual(len(inserts), 1)
+        order = PurchaseOrder.objects.get()
+        self.assertEqual(order.total_cost, Decimal('30.00'))
+        self.assertEqual(order.computed_total_cost, Decimal('30.00'))
+
+    def test_pdf_flows_onto_more_pages_in_one_query(self):
+        order = place_purchase_order(
+            PurchaseOrder(supplier=self.supplier, staff=Staff.objects.create(
+                first_name='Bo', last_name='Buyer', role='Manager', username='bo', password_hash='x',
+            ), order_date=timezone.localdate()),
+            [PurchaseOrderDetail(product=self.product, quantity_ordered=1, unit_cost=Decimal('5'))
+             for _ in range(120)],
+        )
+        order = PurchaseOrder.objects.select_related('supplier').get(pk=order.pk)
+        with self.assertNumQueries(1):
+            pdf = generate_purchase_order_pdf(order)
+        self.assertGreater(len(re.findall(rb'/Type /Page\n', pdf)), 1)
+
+    def test_invalid_line_saves_nothing(self):
+        response = self.client.post(reverse('create_purchase_order'), {
+            'supplier': self.supplier.id,
+            'product[]': [self.product.id, self.product.id], 'quantity[]': ['2', '0'], 'unit_cost[]': ['5', '5'],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Line 2')
+        self.assertFalse(PurchaseOrder.objects.exists())
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_view_queues_and_worker_sends(self):
+        self.create_order()
+        self.assertEqual(mail.outbox, [])
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.to), ('pending', 'orders@brookside.test'))
+
+        call_command('send_outbox', stdout=io.StringIO())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 1))
+        self.assertEqual(mail.outbox[0].to, ['orders@brookside.test'])
+        self.assertEqual(mail.outbox[0].attachments[0][2], 'application/pdf')
+
+    def test_failures_back_off_then_give_up(self):
+        self.create_order()
+        with patch.object(EmailMessage, 'send', side_effect=SMTPException('connection refused')):
+            self.assertEqual(outbox.send_due()['retrying'], 1)
+            email = OutboxEmail.objects.get()
+            self.assertGreater(email.next_attempt_at, timezone.now())
+            self.assertEqual(outbox.send_due(), {'sent': 0, 'retrying': 0, 'failed': 0})
+
+            self.assertEqual(outbox.send_due(now=email.next_attempt_at)['failed'], 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+        self.assertIn('connection refused', email.last_error)
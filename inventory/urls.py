@@ -14,6 +14,7 @@ urlpatterns = [
     path('sales/<int:pk>/items/', views.sale_items_api, name='sale_items_api'),
     path('sales/export/', views.export_sales, name='export_sales'),
     path('receipt/<str:receipt_no>/', views.print_receipt, name='print_receipt'),
+    path('api/holds/', views.stock_holds_api, name='stock_holds_api'),
 
     # Products
     path('products/new/', views.create_product, name='create_product'),
@@ -62,6 +63,7 @@ urlpatterns = [
     path('inventory/log/new/', views.log_inventory, name='log_inventory'),
     path('inventory/logs/', views.inventory_log_list, name='inventory_log_list'),
     path('inventory/api/products/', views.inventory_products_api, name='inventory_products_api'),
+    path('inventory/api/products/changes/', views.inventory_product_changes_api, name='inventory_product_changes_api'),
     path('inventory/api/transactions/', views.inventory_transactions_api, name='inventory_transactions_api'),
     path('inventory/adjust-stock/', views.adjust_stock, name='adjust_stock'),
     path('inventory/products/<int:pk>/details/', views.product_details_api, name='product_details_api'),
@@ -88,6 +90,9 @@ urlpatterns = [
     path('api/sales/histogram/', views.sales_histogram_api, name='sales_histogram_api'),
     path('api/sales/table-data/', views.sales_table_data_api, name='sales_table_data_api'),
     path('api/kpi-data/', views.kpi_data_api, name='kpi_data_api'),
+    path('api/dashboard/', views.dashboard_api, name='dashboard_api'),
+    path('api/kpi-data/cache-stats/', views.kpi_cache_stats_api, name='kpi_cache_stats_api'),
+    path('api/live/', views.live_events_stream, name='live_events_stream'),
     path('api/reports/financial/', views.financial_report_api, name='financial_report_api'),
     path('api/reports/expiry/', views.expiry_reports_api, name='expiry_reports_api'),
     path('api/reports/taxes/', views.taxes_report_api, name='taxes_report_api'),
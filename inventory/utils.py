@@ -1,51 +1,139 @@
+from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from io import BytesIO
+import csv
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+
+def day_range(start_date=None, end_date=None):
+    """
+    Half-open [start, end) aware datetimes covering the calendar days
+    start_date..end_date (inclusive) in the store's timezone (settings.TIME_ZONE).
+    Comparing the raw datetime column against these bounds lets the database
+    use an index range scan, unlike __date lookups. Either side may be None.
+    """
+    tz = timezone.get_default_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz) if start_date else None
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz) if end_date else None
+    return start, end
+
+
+class Echo:
+    """File-like object whose write() hands the value back, so csv.writer can feed a generator."""
+    def write(self, value):
+        return value
+
+
+def streaming_csv_response(filename, rows):
+    """Stream an iterable of CSV rows to the client without building the file in memory."""
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# ---------------------------------------------------------
+# PURCHASE ORDER PDF
+# ---------------------------------------------------------
+PO_COLUMN_WIDTHS = [265, 50, 95, 105]  # points; fills A4 between the margins
+PO_MARGIN = 40
+
+
+@lru_cache(maxsize=None)
+def _po_styles():
+    """Paragraph and table styles, built once and shared by every render."""
+    sheet = getSampleStyleSheet()
+    return {
+        'title': sheet['Heading1'],
+        'normal': sheet['Normal'],
+        'cell': ParagraphStyle('POCell', parent=sheet['Normal'], fontSize=9, leading=11),
+        'table': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('GRID', (0, 0), (-1, -2), 0.5, colors.black),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#f2f2f2')]),
+            # Total row
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+            ('LINEABOVE', (0, -1), (-1, -1), 1, colors.black),
+        ]),
+    }
+
+
+@lru_cache(maxsize=None)
+def _po_logo(path):
+    """Logo file contents, read from disk once per process."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _po_footer(label):
+    def draw(pdf_canvas, doc):
+        pdf_canvas.saveState()
+        pdf_canvas.setFont('Helvetica', 8)
+        pdf_canvas.drawRightString(A4[0] - PO_MARGIN, PO_MARGIN / 2, f"{label} - Page {doc.page}")
+        pdf_canvas.restoreState()
+    return draw
+
 
 def generate_purchase_order_pdf(purchase_order):
+    """
+    Render a purchase order as A4 PDF bytes. The line table flows onto as
+    many pages as needed, with its header row repeated on each. Lines and
+    their products are read in one query. Set PURCHASE_ORDER_LOGO to an
+    image path to print a logo above the title.
+    """
+    styles = _po_styles()
+    supplier = purchase_order.supplier
+    items = purchase_order.items.select_related('product').order_by('id')
+
+    elements = []
+    logo = getattr(settings, 'PURCHASE_ORDER_LOGO', None)
+    if logo:
+        elements.append(Image(BytesIO(_po_logo(logo)), width=40 * mm, height=20 * mm, kind='proportional'))
+    elements.append(Paragraph(f"Purchase Order - #{purchase_order.id}", styles['title']))
+    for label, value in (
+        ('Supplier', supplier.supplier_name),
+        ('Address', supplier.address or '-'),
+        ('Email', supplier.email or '-'),
+        ('Order date', purchase_order.order_date),
+        ('Expected delivery', purchase_order.expected_delivery_date or '-'),
+    ):
+        elements.append(Paragraph(f"<b>{label}:</b> {escape(str(value))}", styles['normal']))
+    elements.append(Spacer(1, 12))
+
+    rows = [['Product', 'Qty', 'Unit Cost', 'Subtotal']]
+    rows += [
+        [
+            Paragraph(escape(item.product.product_name), styles['cell']),
+            str(item.quantity_ordered),
+            f"{item.unit_cost:,.2f}",
+            f"{item.sub_total:,.2f}",
+        ]
+        for item in items
+    ]
+    rows.append(['', '', 'Total (UGX)', f"{purchase_order.total_cost:,.2f}"])
+    table = Table(rows, colWidths=PO_COLUMN_WIDTHS, repeatRows=1)
+    table.setStyle(styles['table'])
+    elements.append(table)
+
     buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-
-    y = height - 50
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(50, y, f"Purchase Order - #{purchase_order.id}")
-    y -= 30
-
-    p.setFont("Helvetica", 12)
-    p.drawString(50, y, f"Supplier: {purchase_order.supplier.supplier_name}")
-    y -= 20
-    p.drawString(50, y, f"Address: {purchase_order.supplier.address or '-'}")
-    y -= 20
-    p.drawString(50, y, f"Email: {purchase_order.supplier.email or '-'}")
-    y -= 30
-
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(50, y, "Product Details")
-    y -= 20
-    p.setFont("Helvetica", 12)
-    p.drawString(50, y, "Name")
-    p.drawString(350, y, "Qty")
-    p.drawString(400, y, "Unit Cost")
-    p.drawString(500, y, "Subtotal")
-    y -= 20
-
-    total = 0
-    for item in purchase_order.items.all():
-        line_total = item.quantity_ordered * item.unit_cost
-        total += line_total
-        p.drawString(50, y, item.product.product_name)
-        p.drawString(350, y, str(item.quantity_ordered))
-        p.drawString(400, y, str(item.unit_cost))
-        p.drawString(500, y, str(line_total))
-        y -= 20
-
-    y -= 20
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(400, y, f"Total: UGX {total:,.2f}")
-
-    p.showPage()
-    p.save()
-    pdf = buffer.getvalue()
-    buffer.close()
-    return pdf
+    doc = SimpleDocTemplate(
+        buffer, pagesize=A4, title=f"Purchase Order {purchase_order.id}",
+        leftMargin=PO_MARGIN, rightMargin=PO_MARGIN, topMargin=PO_MARGIN, bottomMargin=PO_MARGIN,
+    )
+    footer = _po_footer(f"PO-{purchase_order.id}")
+    doc.build(elements, onFirstPage=footer, onLaterPages=footer)
+    return buffer.getvalue()
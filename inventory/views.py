@@ -1,9 +1,9 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.forms import inlineformset_factory
 from django.contrib import messages
 from django.db import transaction
 from django.db.models.functions import Coalesce , Greatest, Cast
-from django.db.models import Sum, F, Value, DecimalField, Count
+from django.db.models import Sum, F, Value, DecimalField, Count, Q
 from django.http import JsonResponse
 from django.utils.dateparse import parse_date
 
@@ -20,11 +20,19 @@ from .forms import (
     PurchaseOrderDetailForm, InventoryLogForm, PayrollForm
 )
 
-from .utils import generate_purchase_order_pdf
+from .utils import streaming_csv_response, day_range
+from .services import (
+    checkout_sale, hold_stock, available_stock, InsufficientStock, place_purchase_order, InvalidPurchaseOrder, get_system_staff,
+    expired_products, expired_stock_summary, write_off_expired
+)
+from . import rollups, kpi_cache, catalog, events, outbox, receipts, discounts, lots
+from .pagination import keyset_paginate, page_metadata, InvalidCursor
 
 #graphs quarterly and yearly sales
-from django.http import JsonResponse, HttpResponse
-from django.db.models import Sum, F, FloatField, ExpressionWrapper, DecimalField
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse, Http404
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import quote_etag, parse_etags
+from django.db.models import Sum, F, FloatField, ExpressionWrapper, DecimalField, DateField
 from django.db.models.functions import ExtractYear, ExtractQuarter, ExtractMonth, TruncDate, TruncDay, TruncWeek, TruncMonth, TruncQuarter
 
 
@@ -34,7 +42,6 @@ from datetime import timedelta
 
 from datetime import timedelta, date, datetime
 from django.utils.timezone import now
-from django.core.mail import EmailMessage
 from django.conf import settings
 from decimal import Decimal
 
@@ -44,8 +51,12 @@ from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.units import inch
+import asyncio
 import csv
+import hashlib
 import io
+import json
+from collections import defaultdict
 
 try:
     import openpyxl
@@ -54,6 +65,41 @@ try:
 except ImportError:
     EXCEL_AVAILABLE = False
 
+# Rows fetched per database round trip when streaming CSV exports
+CSV_CHUNK_SIZE = 2000
+
+# ---------------------------------------------------------
+# PAGINATED LISTS
+# ---------------------------------------------------------
+def render_keyset_list(request, queryset, sort_options, default_sort, serialize,
+                       template, context_name, extra_context=None):
+    """
+    Render one keyset page of `queryset` as HTML, or as JSON when
+    ?format=json is given. Both use the same ?sort=, ?page_size= and
+    ?cursor= parameters, so a cursor from either can be used in the other.
+    """
+    wants_json = request.GET.get('format') == 'json'
+    try:
+        page = keyset_paginate(queryset, request, sort_options, default_sort)
+    except InvalidCursor as e:
+        if wants_json:
+            return JsonResponse({'error': str(e)}, status=400)
+        messages.error(request, "That page link has expired, showing the first page.")
+        params = request.GET.copy()
+        params.pop('cursor', None)
+        return redirect(f"{request.path}?{params.urlencode()}")
+
+    if wants_json:
+        return JsonResponse({
+            'results': [serialize(obj) for obj in page['items']],
+            **page_metadata(page),
+        })
+
+    context = {context_name: page['items'], 'page': page, 'filters': request.GET}
+    context.update(extra_context or {})
+    return render(request, template, context)
+
+
 # ---------------------------------------------------------
 # DASHBOARD / HOME PAGE
 # ---------------------------------------------------------
@@ -108,39 +154,24 @@ def create_sale(request):
         formset = SaleDetailFormSet(request.POST)
         if sale_form.is_valid() and formset.is_valid():
             sale = sale_form.save(commit=False)
-            sale.save()
-            formset.instance = sale
-            formset.save()
-            
-            # Update stock quantities for each sale detail
-            stock_updates = []
-            for sale_detail in formset:
-                if sale_detail.cleaned_data and not sale_detail.cleaned_data.get('DELETE', False):
-                    product = sale_detail.cleaned_data['product']
-                    quantity_sold = sale_detail.cleaned_data['quantity_sold']
-                    
-                    # Check if sufficient stock is available
-                    if product.stock_quantity < quantity_sold:
-                        messages.error(request, f"Insufficient stock for {product.product_name}. Available: {product.stock_quantity}")
-                        return redirect("create_sale")
-                    
-                    # Update stock quantity
-                    product.stock_quantity -= quantity_sold
-                    product.save()
-                    
-                    # Create inventory log entry
-                    InventoryLog.objects.create(
-                        product=product,
-                        staff=sale.staff,
-                        log_type='Sale',
-                        quantity=quantity_sold,
-                        remarks=f"Sale #{sale.receipt_no} - {sale_detail.cleaned_data.get('batch_number', 'No batch')}"
-                    )
-                    
-                    stock_updates.append(f"{product.product_name}: -{quantity_sold}")
-            
+            details = [
+                form.save(commit=False)
+                for form in formset
+                if form.cleaned_data and not form.cleaned_data.get('DELETE', False)
+            ]
+
             # Apply automatic discounts
-            discount_result = apply_automatic_discounts(sale)
+            discount_result = apply_automatic_discounts(sale, details)
+
+            # Lock, check and deduct stock for the whole basket at once,
+            # using up the stock this till held while scanning
+            try:
+                checkout_sale(sale, details, terminal=request.session.session_key)
+            except InsufficientStock as e:
+                messages.error(request, str(e))
+                return redirect("create_sale")
+            stock_updates = [f"{d.product.product_name}: -{d.quantity_sold}" for d in details]
+
             if discount_result:
                 messages.success(request, f"Sale recorded successfully. Stock updated. Discount applied: UGx. {discount_result['discount_amount']:,.0f}")
             else:
@@ -153,14 +184,97 @@ def create_sale(request):
 
     return render(request, "inventory/billing_form.html", {
         "sale_form": sale_form,
-        "formset": formset
+        "formset": formset,
+        # Renew stock holds at half their lifetime
+        "hold_renew_ms": getattr(settings, 'STOCK_HOLD_TTL', 300) * 500,
+    })
+
+
+def terminal_id(request):
+    """The till a basket belongs to: its browser session, created on first use."""
+    if not request.session.session_key:
+        request.session.save()
+    return request.session.session_key
+
+
+def stock_holds_api(request):
+    """
+    Hold stock for the basket being scanned. POST {"items": {product_id: qty}}
+    with the whole basket on every change (an empty basket releases
+    everything). Holds lapse after STOCK_HOLD_TTL seconds unless renewed.
+    Returns what was held, which products fell short and their availability.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    try:
+        items = json.loads(request.body or '{}').get('items', {})
+        quantities = {int(product_id): int(qty) for product_id, qty in items.items()}
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'items must map product ids to quantities'}, status=400)
+
+    result = hold_stock(terminal_id(request), quantities)
+    return JsonResponse({
+        'held': result['held'],
+        'short': result['short'],
+        'available': available_stock(result['short']),
+        'expires_at': result['expires_at'],
     })
 
 
+SALES_LIST_RANGES = {'today': 0, 'week': 7, 'month': 30}
+
+
 def sales_list(request):
-    """List all recorded sales."""
-    sales = Sale.objects.all().order_by("-sale_datetime")
-    return render(request, "inventory/sales_list.html", {"sales": sales})
+    """
+    List recorded sales, newest first, one keyset page at a time.
+    Filters: q (receipt, customer or staff name), payment_method, staff,
+    range (today/week/month) or from/to. Sorts: date, total.
+    """
+    sales = Sale.objects.all()
+    date_filters = get_date_filters(request)
+    if request.GET.get('range') in SALES_LIST_RANGES:
+        since = timezone.localdate() - timedelta(days=SALES_LIST_RANGES[request.GET['range']])
+        date_filters['start'], _ = day_range(since, None)
+    sales = filter_date_range(sales, 'sale_datetime', date_filters)
+    if request.GET.get('payment_method'):
+        sales = sales.filter(payment_method=request.GET['payment_method'])
+    if request.GET.get('staff', '').isdigit():
+        sales = sales.filter(staff_id=request.GET['staff'])
+    if request.GET.get('q'):
+        q = request.GET['q']
+        sales = sales.filter(
+            Q(receipt_no__icontains=q)
+            | Q(customer__first_name__icontains=q) | Q(customer__last_name__icontains=q)
+            | Q(staff__first_name__icontains=q) | Q(staff__last_name__icontains=q)
+        )
+
+    summary = sales.aggregate(
+        count=Count('id'),
+        revenue=Coalesce(Sum('total_amount'), Value(0), output_field=DecimalField(max_digits=18, decimal_places=2)),
+        today=Count('id', filter=Q(sale_datetime__gte=day_range(timezone.localdate(), None)[0])),
+    )
+    summary['average'] = summary['revenue'] / summary['count'] if summary['count'] else 0
+
+    def serialize(s):
+        return {
+            'id': s.id,
+            'receipt_no': s.receipt_no,
+            'sale_datetime': s.sale_datetime.isoformat(),
+            'customer_name': str(s.customer) if s.customer else 'Walk-in Customer',
+            'staff_name': str(s.staff),
+            'item_count': s.item_count,
+            'total_amount': float(s.total_amount),
+            'discount_applied': float(s.discount_applied or 0),
+            'payment_method': s.payment_method,
+        }
+
+    return render_keyset_list(
+        request,
+        sales.select_related('customer', 'staff').annotate(item_count=Count('details')),
+        {'date': 'sale_datetime', 'total': 'total_amount'}, '-date', serialize,
+        "inventory/sales_list.html", "sales",
+        {'summary': summary, 'staff_members': Staff.objects.order_by('first_name', 'last_name')},
+    )
 
 
 def sale_detail(request, pk):
@@ -170,10 +284,10 @@ def sale_detail(request, pk):
     return render(request, "inventory/sale_detail.html", {"sale": sale, "details": details})
 
 
-def sale_items_api(request, pk):
+async def sale_items_api(request, pk):
     """API endpoint to get sale items"""
-    sale = get_object_or_404(Sale, pk=pk)
-    details = SaleDetail.objects.filter(sale=sale).select_related('product')
+    sale = await aget_object_or_404(Sale.objects.select_related('customer', 'staff'), pk=pk)
+    details = [detail async for detail in SaleDetail.objects.filter(sale=sale).select_related('product')]
     
     data = {
         'sale': {
@@ -214,27 +328,33 @@ def export_sales(request):
 
 
 def export_sales_csv(request):
-    """Export sales as CSV"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="sales_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Receipt No', 'Date', 'Customer', 'Staff', 'Payment Method', 'Total Amount', 'Discount Applied', 'Items Count'])
-    
-    sales = Sale.objects.select_related('customer', 'staff').all().order_by('-sale_datetime')
-    for sale in sales:
-        writer.writerow([
-            sale.receipt_no,
-            sale.sale_datetime.strftime('%Y-%m-%d %H:%M:%S'),
-            f"{sale.customer.first_name} {sale.customer.last_name}" if sale.customer else "Walk-in Customer",
-            f"{sale.staff.first_name} {sale.staff.last_name}",
-            sale.payment_method,
-            sale.total_amount,
-            sale.discount_applied or 0,
-            sale.saledetail_set.count()
-        ])
-    
-    return response
+    """Export sales as CSV, streamed in chunks"""
+    sales = (
+        Sale.objects.order_by('-sale_datetime')
+        .annotate(items_count=Count('details'))
+        .values_list(
+            'receipt_no', 'sale_datetime', 'customer_id', 'customer__first_name', 'customer__last_name',
+            'staff__first_name', 'staff__last_name', 'payment_method', 'total_amount',
+            'discount_applied', 'items_count',
+        )
+    )
+
+    def rows():
+        yield ['Receipt No', 'Date', 'Customer', 'Staff', 'Payment Method', 'Total Amount', 'Discount Applied', 'Items Count']
+        for (receipt_no, sale_datetime, customer_id, customer_first, customer_last,
+             staff_first, staff_last, payment_method, total_amount, discount_applied, items_count) in sales.iterator(chunk_size=CSV_CHUNK_SIZE):
+            yield [
+                receipt_no,
+                timezone.localtime(sale_datetime).strftime('%Y-%m-%d %H:%M:%S'),
+                f"{customer_first} {customer_last}" if customer_id else "Walk-in Customer",
+                f"{staff_first} {staff_last}",
+                payment_method,
+                total_amount,
+                discount_applied or 0,
+                items_count
+            ]
+
+    return streaming_csv_response(f'sales_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv', rows())
 
 
 def export_sales_pdf(request):
@@ -282,7 +402,7 @@ def export_sales_pdf(request):
     for sale in sales[:50]:  # Limit for PDF
         table_data.append([
             sale.receipt_no,
-            sale.sale_datetime.strftime('%Y-%m-%d'),
+            timezone.localtime(sale.sale_datetime).strftime('%Y-%m-%d'),
             f"{sale.customer.first_name} {sale.customer.last_name}" if sale.customer else "Walk-in",
             f"{sale.staff.first_name} {sale.staff.last_name}",
             sale.payment_method,
@@ -308,77 +428,27 @@ def export_sales_pdf(request):
 
 
 def print_receipt(request, receipt_no):
-    """Generate receipt for printing"""
-    sale = get_object_or_404(Sale, receipt_no=receipt_no)
-    details = SaleDetail.objects.filter(sale=sale).select_related('product')
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="receipt_{receipt_no}.pdf"'
-    
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=18)
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    
-    # Receipt header
-    elements.append(Paragraph("SUPERMARKET RECEIPT", styles['Heading1']))
-    elements.append(Paragraph(f"Receipt No: {sale.receipt_no}", styles['Normal']))
-    elements.append(Paragraph(f"Date: {sale.sale_datetime.strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
-    elements.append(Paragraph(f"Staff: {sale.staff.first_name} {sale.staff.last_name}", styles['Normal']))
-    if sale.customer:
-        elements.append(Paragraph(f"Customer: {sale.customer.first_name} {sale.customer.last_name}", styles['Normal']))
-    elements.append(Spacer(1, 20))
-    
-    # Items table
-    elements.append(Paragraph("Items Purchased", styles['Heading2']))
-    elements.append(Spacer(1, 12))
-    
-    table_data = [['Product', 'Qty', 'Price', 'Total']]
-    for detail in details:
-        table_data.append([
-            detail.product.product_name,
-            str(detail.quantity_sold),
-            f'UGx. {detail.unit_price:,.0f}',
-            f'UGx. {(detail.unit_price * detail.quantity_sold):,.0f}'
-        ])
-    
-    receipt_table = Table(table_data, colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch])
-    receipt_table.setStyle(TableStyle([
-        ('BACKGROUND',(0,0),(-1,0),colors.grey),
-        ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
-        ('ALIGN',(0,0),(-1,-1),'CENTER'),
-        ('GRID',(0,0),(-1,-1),0.5,colors.black)
-    ]))
-    elements.append(receipt_table)
-    elements.append(Spacer(1, 20))
-    
-    # Totals
-    subtotal = sum(detail.unit_price * detail.quantity_sold for detail in details)
-    discount = sale.discount_applied or 0
-    total = sale.total_amount
-    
-    totals_data = [
-        ['Subtotal', f'UGx. {subtotal:,.0f}'],
-        ['Discount', f'-UGx. {discount:,.0f}'],
-        ['Total', f'UGx. {total:,.0f}']
-    ]
-    
-    totals_table = Table(totals_data, colWidths=[2*inch, 2*inch])
-    totals_table.setStyle(TableStyle([
-        ('ALIGN',(0,0),(-1,-1),'RIGHT'),
-        ('FONTNAME', (0,0), (-1,-1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,-1), 12)
-    ]))
-    elements.append(totals_table)
-    
-    elements.append(Spacer(1, 30))
-    elements.append(Paragraph("Thank you for your business!", styles['Normal']))
-    
-    doc.build(elements)
-    pdf = buffer.getvalue()
-    buffer.close()
-    response.write(pdf)
+    """
+    Generate receipt for printing. ?format= picks a4 (default), thermal
+    (roll-width PDF), text or escpos; ?width= the roll width, 58 or 80 mm.
+    """
+    fmt = request.GET.get('format', 'a4')
+    width = request.GET.get('width')
+    if fmt not in receipts.FORMATS:
+        return JsonResponse({'error': f"format must be one of {', '.join(receipts.FORMATS)}"}, status=400)
+    if width is not None:
+        if not width.isdigit() or int(width) not in receipts.PAPER_COLUMNS:
+            return JsonResponse({'error': 'width must be 58 or 80'}, status=400)
+        width = int(width)
+
+    try:
+        content = receipts.render_receipt(receipt_no, fmt, width)
+    except Sale.DoesNotExist:
+        raise Http404("No Sale matches the given query.")
+
+    response = HttpResponse(content, content_type=receipts.CONTENT_TYPES[fmt])
+    if fmt != 'text':
+        response['Content-Disposition'] = f'attachment; filename="receipt_{receipt_no}.{receipts.EXTENSIONS[fmt]}"'
     return response
 
 
@@ -397,9 +467,81 @@ def create_product(request):
     return render(request, "inventory/product_form.html", {"form": form})
 
 
+PRODUCT_SORTS = {'name': 'product_name', 'stock': 'stock_quantity', 'price': 'retail_price'}
+STOCK_STATUS_FILTERS = {
+    'in-stock': Q(stock_quantity__gt=F('reorder_level')),
+    'low-stock': Q(stock_quantity__gt=0, stock_quantity__lte=F('reorder_level')),
+    'out-of-stock': Q(stock_quantity=0),
+}
+
+
+def filter_products(products, params):
+    """
+    Apply the catalogue filters shared by the product list and the inventory API:
+    q (name, brand, batch or category), category, supplier and
+    stock (in-stock/low-stock/out-of-stock).
+    """
+    if params.get('q'):
+        q = params['q']
+        products = products.filter(
+            Q(product_name__icontains=q) | Q(brand__icontains=q)
+            | Q(batch_number__icontains=q) | Q(category__category_name__icontains=q)
+        )
+    if params.get('category', '').isdigit():
+        products = products.filter(category_id=params['category'])
+    if params.get('supplier', '').isdigit():
+        products = products.filter(supplier_id=params['supplier'])
+    if params.get('stock') in STOCK_STATUS_FILTERS:
+        products = products.filter(STOCK_STATUS_FILTERS[params['stock']])
+    return products
+
+
+def stock_status_summary():
+    """Product counts per stock status across the whole catalogue, in one query."""
+    return Product.objects.aggregate(
+        total=Count('id'),
+        **{
+            key.replace('-', '_'): Count('id', filter=condition)
+            for key, condition in STOCK_STATUS_FILTERS.items()
+        },
+    )
+
+
 def product_list(request):
-    products = Product.objects.all().order_by("product_name")
-    return render(request, "inventory/product_list.html", {"products": products})
+    """
+    Product catalogue, one keyset page at a time.
+    Filters: see filter_products(). Sorts: name, stock, price.
+    """
+    products = filter_products(Product.objects.select_related('category', 'supplier'), request.GET)
+    summary = stock_status_summary()
+
+    def serialize(p):
+        return {
+            'id': p.id,
+            'product_name': p.product_name,
+            'brand': p.brand,
+            'unit': p.unit,
+            'category_id': p.category_id,
+            'category_name': p.category.category_name,
+            'supplier_id': p.supplier_id,
+            'supplier_name': p.supplier.supplier_name,
+            'stock_quantity': p.stock_quantity,
+            'reorder_level': p.reorder_level,
+            'unit_cost': float(p.unit_cost),
+            'retail_price': float(p.retail_price),
+            'expiry_date': p.expiry_date.isoformat() if p.expiry_date else None,
+            'batch_number': p.batch_number,
+        }
+
+    return render_keyset_list(
+        request, products, PRODUCT_SORTS, 'name', serialize,
+        "inventory/product_list.html", "products",
+        {
+            'summary': summary,
+            'categories': Category.objects.order_by('category_name'),
+            'suppliers': Supplier.objects.order_by('supplier_name'),
+        },
+    )
 
 
 def edit_product(request, pk):
@@ -492,8 +634,29 @@ def create_customer(request):
 
 
 def customer_list(request):
-    customers = Customer.objects.all().order_by("first_name")
-    return render(request, "inventory/customer_list.html", {"customers": customers})
+    """Customers by name, one keyset page at a time. Filter: q (name, phone or email)."""
+    # first_name is optional, so sort on a non-null key
+    customers = Customer.objects.annotate(sort_name=Coalesce('first_name', Value('')))
+    if request.GET.get('q'):
+        q = request.GET['q']
+        customers = customers.filter(
+            Q(first_name__icontains=q) | Q(last_name__icontains=q)
+            | Q(phone__icontains=q) | Q(email__icontains=q)
+        )
+
+    def serialize(c):
+        return {
+            'id': c.id,
+            'first_name': c.first_name,
+            'last_name': c.last_name,
+            'phone': c.phone,
+            'email': c.email,
+        }
+
+    return render_keyset_list(
+        request, customers, {'name': 'sort_name'}, 'name', serialize,
+        "inventory/customer_list.html", "customers",
+    )
 
 
 def edit_customer(request, pk):
@@ -583,8 +746,8 @@ def toggle_discount_status(request, pk):
     return JsonResponse({'success': False})
 
 
-def discount_details_api(request, pk):
-    discount = get_object_or_404(Discount, pk=pk)
+async def discount_details_api(request, pk):
+    discount = await aget_object_or_404(Discount, pk=pk)
     data = {
         'discount_name': discount.discount_name,
         'discount_type': discount.discount_type,
@@ -697,15 +860,36 @@ def export_discounts_pdf(request):
 # PURCHASE ORDER
 # ---------------------------------------------------------
 
+@transaction.atomic
 def create_purchase_order(request):
     suppliers = Supplier.objects.all()
     products = Product.objects.all()
 
     if request.method == "POST":
-        supplier_id = request.POST.get("supplier")
+        supplier_id = request.POST.get("supplier", "")
+        supplier = Supplier.objects.filter(pk=supplier_id).first() if supplier_id.isdigit() else None
         expected_date = request.POST.get("expected_delivery_date")
         invoice_no = request.POST.get("invoice_no")
 
+        details, errors = parse_purchase_order_lines(request.POST)
+        if supplier is None:
+            errors.insert(0, "Choose a supplier.")
+        expected_delivery_date = None
+        if expected_date:
+            try:
+                expected_delivery_date = parse_date(expected_date)
+            except ValueError:
+                pass
+            if expected_delivery_date is None:
+                errors.append("Expected delivery date must be a date in YYYY-MM-DD format.")
+        if errors:
+            for error in errors:
+                messages.error(request, error)
+            return render(request, "inventory/create_purchase_order.html", {
+                "suppliers": suppliers,
+                "products": products,
+            })
+
         # Resolve Staff instance (not auth User)
         staff = Staff.objects.filter(username=getattr(request.user, "username", "")).first()
         if not staff:
@@ -714,60 +898,30 @@ def create_purchase_order(request):
                 defaults=dict(first_name="System", last_name="User", role="Admin", password_hash="system_user"),
             )
 
-        # Create the main order
-        order = PurchaseOrder.objects.create(
-            supplier_id=supplier_id,
+        order = PurchaseOrder(
+            supplier=supplier,
             staff=staff,
             order_date=date.today(),
-            expected_delivery_date=expected_date or None,
+            expected_delivery_date=expected_delivery_date,
             status="Pending",
-            total_cost=0,
             invoice_no=invoice_no,
         )
+        try:
+            place_purchase_order(order, details)
+        except InvalidPurchaseOrder as e:
+            messages.error(request, str(e))
+            return render(request, "inventory/create_purchase_order.html", {
+                "suppliers": suppliers,
+                "products": products,
+            })
 
-        # Add product line items
-        product_ids = request.POST.getlist("product[]")
-        quantities = request.POST.getlist("quantity[]")
-        unit_costs = request.POST.getlist("unit_cost[]")
-
-        for i in range(len(product_ids)):
-            if product_ids[i] and quantities[i] and unit_costs[i]:
-                qty = int(quantities[i])
-                cost = float(unit_costs[i])
-                line_total = qty * cost
-                PurchaseOrderDetail.objects.create(
-                    order=order,
-                    product_id=product_ids[i],
-                    quantity_ordered=qty,
-                    unit_cost=cost,
-                    sub_total=line_total,
-                )
-
-        # Update order total
-        order.total_cost = sum(item.sub_total for item in order.items.all())
-        order.save(update_fields=["total_cost"])
-
-        #  Generate PDF
-        pdf_data = generate_purchase_order_pdf(order)
-
-        #  Build and send email
-        subject = f"Purchase Order #{order.id} from {request.user.username}"
-        body = (
-            f"Dear {order.supplier.supplier_name},\n\n"
-            f"Please find attached our new purchase order.\n\n"
-            f"Thank you,\n{request.user.username}\n{request.user.email}"
-        )
-
-        email = EmailMessage(
-            subject,
-            body,
-            settings.DEFAULT_FROM_EMAIL,
-            [order.supplier.email] if order.supplier.email else [],
-        )
-        email.attach(f"PurchaseOrder_{order.id}.pdf", pdf_data, "application/pdf")
-        email.send(fail_silently=False)
-
-        messages.success(request, "Purchase order created and sent to supplier.")
+        # The outbox worker renders the PDF and emails it, so a slow or
+        # failing mail server cannot hold up or lose this response
+        if order.supplier.email:
+            outbox.queue_purchase_order_email(order, request.user)
+            messages.success(request, "Purchase order created. The email to the supplier has been queued.")
+        else:
+            messages.warning(request, "Purchase order created. The supplier has no email address, so nothing was sent.")
         return redirect("purchase_order_list")
 
     return render(request, "inventory/create_purchase_order.html", {
@@ -776,9 +930,71 @@ def create_purchase_order(request):
     })
 
 
+def parse_purchase_order_lines(post):
+    """
+    Unsaved PurchaseOrderDetail lines from the product[]/quantity[]/unit_cost[]
+    form rows, and an error message per row that is not valid. Empty rows
+    are skipped.
+    """
+    details, errors = [], []
+    rows = zip(post.getlist("product[]"), post.getlist("quantity[]"), post.getlist("unit_cost[]"))
+    for number, (product_id, quantity, unit_cost) in enumerate(rows, start=1):
+        if not (product_id or quantity or unit_cost):
+            continue
+        try:
+            quantity = int(quantity)
+            unit_cost = Decimal(unit_cost)
+            if not product_id.isdigit() or quantity < 1 or not unit_cost.is_finite() or unit_cost < 0:
+                raise ValueError
+            unit_cost = unit_cost.quantize(Decimal("0.01"))
+        except (ValueError, ArithmeticError):
+            errors.append(f"Line {number}: choose a product, a quantity of at least 1 and a unit cost of 0 or more.")
+            continue
+        details.append(PurchaseOrderDetail(product_id=int(product_id), quantity_ordered=quantity, unit_cost=unit_cost))
+    return details, errors
+
+
 def purchase_order_list(request):
-    orders = PurchaseOrder.objects.all().order_by("-order_date")
-    return render(request, "inventory/purchase_order_list.html", {"orders": orders})
+    """
+    Purchase orders, newest first, one keyset page at a time.
+    Filters: q (supplier or invoice), status, supplier, from/to (order date).
+    Sorts: date, total.
+    """
+    orders = PurchaseOrder.objects.select_related('supplier', 'staff')
+    date_filters = get_date_filters(request)
+    if 'start_date' in date_filters:
+        orders = orders.filter(order_date__gte=date_filters['start_date'])
+    if 'end_date' in date_filters:
+        orders = orders.filter(order_date__lte=date_filters['end_date'])
+    if request.GET.get('status'):
+        orders = orders.filter(status=request.GET['status'])
+    if request.GET.get('supplier', '').isdigit():
+        orders = orders.filter(supplier_id=request.GET['supplier'])
+    if request.GET.get('q'):
+        q = request.GET['q']
+        orders = orders.filter(Q(supplier__supplier_name__icontains=q) | Q(invoice_no__icontains=q))
+
+    def serialize(o):
+        return {
+            'id': o.id,
+            'supplier_id': o.supplier_id,
+            'supplier_name': o.supplier.supplier_name,
+            'staff_name': str(o.staff),
+            'order_date': o.order_date.isoformat(),
+            'expected_delivery_date': o.expected_delivery_date.isoformat() if o.expected_delivery_date else None,
+            'status': o.status,
+            'total_cost': float(o.total_cost),
+            'invoice_no': o.invoice_no,
+        }
+
+    return render_keyset_list(
+        request, orders, {'date': 'order_date', 'total': 'total_cost'}, '-date', serialize,
+        "inventory/purchase_order_list.html", "orders",
+        {
+            'suppliers': Supplier.objects.order_by('supplier_name'),
+            'statuses': ['Pending', 'Delivered', 'Cancelled'],
+        },
+    )
 
 
 # ---------------------------------------------------------
@@ -797,24 +1013,32 @@ def create_purchase_order_detail(request):
 
 
 def purchase_order_detail_list(request):
-    details = PurchaseOrderDetail.objects.all()
+    details = PurchaseOrderDetail.objects.select_related('product')
     return render(request, "inventory/purchase_order_detail_list.html", {"details": details})
 
 
 # ---------------------------------------------------------
 # INVENTORY LOG (Material Arrival)
 # ---------------------------------------------------------
+@transaction.atomic
 def log_inventory(request):
     if request.method == "POST":
         form = InventoryLogForm(request.POST)
         if form.is_valid():
             inventory_log = form.save(commit=False)
+            if not inventory_log.reason:
+                inventory_log.reason = InventoryLog.DEFAULT_REASONS.get(inventory_log.log_type)
             
-            # Update product stock based on log type
-            product = inventory_log.product
+            # Update product stock based on log type, from the locked row
+            # rather than the form's copy, so concurrent sales are kept
+            product = Product.objects.select_for_update().get(pk=inventory_log.product_id)
+            inventory_log.product = product
             if inventory_log.log_type == 'Purchase':
-                # Increase stock for purchases
+                # Increase stock for purchases, as a lot of its own
+                lots.receive_lot(product, inventory_log.quantity,
+                                 form.cleaned_data['batch_number'], form.cleaned_data['expiry_date'])
                 product.stock_quantity += inventory_log.quantity
+                product.stock_reason = inventory_log.reason
                 product.save()
                 messages.success(request, f"Inventory updated. Stock increased by {inventory_log.quantity} for {product.product_name}.")
             elif inventory_log.log_type == 'Adjustment':
@@ -831,9 +1055,37 @@ def log_inventory(request):
 
 
 def inventory_log_list(request):
-    logs = InventoryLog.objects.all().order_by("-log_date")
-    logs = InventoryLog.objects.all().order_by("-log_date")
-    return render(request, "inventory/inventory_log_list.html", {"logs": logs})
+    """
+    Stock movements, newest first, one keyset page at a time.
+    Filters: log_type, reason, product, from/to. Sort: date.
+    """
+    logs = InventoryLog.objects.select_related('product', 'staff')
+    logs = filter_date_range(logs, 'log_date', get_date_filters(request))
+    if request.GET.get('log_type'):
+        logs = logs.filter(log_type=request.GET['log_type'])
+    if request.GET.get('reason'):
+        logs = logs.filter(reason=request.GET['reason'])
+    if request.GET.get('product', '').isdigit():
+        logs = logs.filter(product_id=request.GET['product'])
+
+    def serialize(log):
+        return {
+            'id': log.id,
+            'log_date': log.log_date.isoformat(),
+            'product_id': log.product_id,
+            'product_name': log.product.product_name,
+            'log_type': log.log_type,
+            'reason': log.reason,
+            'quantity': log.quantity,
+            'staff_name': str(log.staff),
+            'remarks': log.remarks,
+        }
+
+    return render_keyset_list(
+        request, logs, {'date': 'log_date'}, '-date', serialize,
+        "inventory/inventory_log_list.html", "logs",
+        {'log_types': InventoryLog.LOG_CHOICES, 'reasons': InventoryLog.REASON_CHOICES},
+    )
 
 
 def inventory_list(request):
@@ -842,46 +1094,137 @@ def inventory_list(request):
     return render(request, "inventory/inventory_list.html", {"products": products})
 
 
+# Public field name -> ORM path for inventory_products_api projections
+PRODUCT_API_FIELDS = {
+    'id': 'id',
+    'product_name': 'product_name',
+    'brand': 'brand',
+    'unit': 'unit',
+    'stock_quantity': 'stock_quantity',
+    'reserved_quantity': 'reserved_quantity',
+    'reorder_level': 'reorder_level',
+    'unit_cost': 'unit_cost',
+    'retail_price': 'retail_price',
+    'expiry_date': 'expiry_date',
+    'batch_number': 'batch_number',
+    'category_id': 'category_id',
+    'category_name': 'category__category_name',
+    'supplier_id': 'supplier_id',
+    'supplier_name': 'supplier__supplier_name',
+    'change_version': 'change_version',
+}
+
+
+def json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def etag_response(request, data):
+    """
+    JsonResponse carrying an ETag of its body, or 304 Not Modified when
+    the client already holds that exact body (If-None-Match).
+    """
+    response = JsonResponse(data)
+    etag = quote_etag(hashlib.md5(response.content).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 def inventory_products_api(request):
-    """API endpoint to get all products with related data"""
-    products = Product.objects.select_related('category', 'supplier').all()
-    categories = Category.objects.all()
-    suppliers = Supplier.objects.all()
-    
+    """
+    One keyset page of products for the inventory screen.
+
+    Filters as filter_products(); sort/page_size/cursor as keyset_paginate().
+    fields=a,b,c limits each product to those keys (see PRODUCT_API_FIELDS).
+    include=categories,suppliers,summary adds the lookup lists and the
+    stock status counts, which clients only need once.
+    Responses carry an ETag, and an unchanged page returns 304.
+    """
+    requested = [f for f in request.GET.get('fields', '').split(',') if f]
+    unknown = set(requested) - set(PRODUCT_API_FIELDS)
+    if unknown:
+        return JsonResponse({'error': f"Unknown fields: {', '.join(sorted(unknown))}"}, status=400)
+    fields = requested or list(PRODUCT_API_FIELDS)
+
+    sort_key = request.GET.get('sort', 'name').lstrip('-')
+    sort_path = PRODUCT_SORTS.get(sort_key, PRODUCT_SORTS['name'])
+    paths = {PRODUCT_API_FIELDS[f] for f in fields} | {sort_path, 'pk'}
+    products = filter_products(Product.objects.all(), request.GET).values(*paths)
+
+    try:
+        page = keyset_paginate(products, request, PRODUCT_SORTS, 'name')
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
     data = {
         'products': [
-            {
-                'id': p.id,
-                'product_name': p.product_name,
-                'brand': p.brand,
-                'unit': p.unit,
-                'stock_quantity': p.stock_quantity,
-                'reorder_level': p.reorder_level,
-                'unit_cost': float(p.unit_cost),
-                'retail_price': float(p.retail_price),
-                'expiry_date': p.expiry_date.strftime('%Y-%m-%d') if p.expiry_date else None,
-                'category_id': p.category.id,
-                'category_name': p.category.category_name,
-                'supplier_id': p.supplier.id,
-                'supplier_name': p.supplier.supplier_name,
-            }
-            for p in products
-        ],
-        'categories': [
-            {'id': c.id, 'name': c.category_name}
-            for c in categories
+            {f: json_value(row[PRODUCT_API_FIELDS[f]]) for f in fields}
+            for row in page['items']
         ],
-        'suppliers': [
-            {'id': s.id, 'name': s.supplier_name}
-            for s in suppliers
-        ]
+        **page_metadata(page),
     }
-    return JsonResponse(data)
+
+    include = set(request.GET.get('include', '').split(','))
+    if 'categories' in include:
+        data['categories'] = [
+            {'id': pk, 'name': name}
+            for pk, name in Category.objects.order_by('category_name').values_list('id', 'category_name')
+        ]
+    if 'suppliers' in include:
+        data['suppliers'] = [
+            {'id': pk, 'name': name}
+            for pk, name in Supplier.objects.order_by('supplier_name').values_list('id', 'supplier_name')
+        ]
+    if 'summary' in include:
+        data['summary'] = stock_status_summary()
+
+    return etag_response(request, data)
 
 
-def inventory_transactions_api(request):
+def inventory_product_changes_api(request):
+    """
+    Delta sync for POS terminals and the inventory page.
+
+    ?since=<version> returns the products whose price, stock or details
+    changed after that catalog version, plus the ids of deleted products.
+    Start from since=0 (or the highest change_version of a full pull) and
+    send back the returned 'version' and 'after' on the next poll.
+    fields= and limit= (default 500) work as in inventory_products_api.
+    """
+    try:
+        since = int(request.GET.get('since', 0))
+        after = int(request.GET['after']) if request.GET.get('after') else None
+        limit = int(request.GET.get('limit', catalog.DEFAULT_CHANGES_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'since, after and limit must be integers'}, status=400)
+    limit = max(1, min(limit, catalog.MAX_CHANGES_LIMIT))
+
+    requested = [f for f in request.GET.get('fields', '').split(',') if f]
+    unknown = set(requested) - set(PRODUCT_API_FIELDS)
+    if unknown:
+        return JsonResponse({'error': f"Unknown fields: {', '.join(sorted(unknown))}"}, status=400)
+    fields = requested or list(PRODUCT_API_FIELDS)
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+
+    changes = catalog.changes_since(since, {PRODUCT_API_FIELDS[f] for f in fields}, limit, after)
+    changes['products'] = [
+        {f: json_value(row[PRODUCT_API_FIELDS[f]]) for f in fields}
+        for row in changes['products']
+    ]
+    return JsonResponse(changes)
+
+
+async def inventory_transactions_api(request):
     """API endpoint to get recent inventory transactions"""
-    logs = InventoryLog.objects.select_related('product', 'staff').order_by('-log_date')[:50]
+    logs = [log async for log in InventoryLog.objects.select_related('product', 'staff').order_by('-log_date')[:50]]
     
     data = {
         'transactions': [
@@ -890,6 +1233,7 @@ def inventory_transactions_api(request):
                 'log_date': log.log_date.strftime('%Y-%m-%d %H:%M:%S'),
                 'product_name': log.product.product_name,
                 'log_type': log.log_type,
+                'reason': log.reason,
                 'quantity': log.quantity,
                 'staff_name': f"{log.staff.first_name} {log.staff.last_name}",
                 'remarks': log.remarks,
@@ -901,53 +1245,57 @@ def inventory_transactions_api(request):
 
 
 def adjust_stock(request):
-    """API endpoint to adjust product stock"""
+    """
+    API endpoint to adjust product stock. The product is locked and re-read
+    first, so a sale committing meanwhile is neither lost nor ledgered twice.
+    """
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
-    
+
     try:
-        import json
         data = json.loads(request.body)
-        
-        product_id = data.get('product_id')
-        adjustment_type = data.get('adjustment_type')
+        product_id = int(data.get('product_id'))
         quantity = int(data.get('quantity'))
-        remarks = data.get('remarks', '')
-        
-        product = get_object_or_404(Product, pk=product_id)
-        
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'product_id and quantity must be whole numbers'}, status=400)
+    adjustment_type = data.get('adjustment_type')
+    remarks = data.get('remarks', '')
+    reason = data.get('reason') or 'count_correction'
+    if reason not in dict(InventoryLog.REASON_CHOICES):
+        return JsonResponse({'success': False, 'error': 'Invalid adjustment reason'}, status=400)
+    if adjustment_type not in ('increase', 'decrease', 'set') or quantity < 0:
+        return JsonResponse({'success': False, 'error': 'Invalid adjustment type'}, status=400)
+
+    with transaction.atomic():
+        product = get_object_or_404(Product.objects.select_for_update(), pk=product_id)
+
         # Calculate new quantity based on adjustment type
         if adjustment_type == 'increase':
             new_quantity = product.stock_quantity + quantity
         elif adjustment_type == 'decrease':
             new_quantity = max(0, product.stock_quantity - quantity)
-        elif adjustment_type == 'set':
-            new_quantity = quantity
         else:
-            return JsonResponse({'success': False, 'error': 'Invalid adjustment type'})
-        
-        # Create inventory log entry
+            new_quantity = quantity
+
         InventoryLog.objects.create(
             product=product,
             staff=request.user.staff if hasattr(request.user, 'staff') else Staff.objects.first(),
             log_type='Adjustment',
+            reason=reason,
             quantity=abs(new_quantity - product.stock_quantity),
             remarks=f"Stock adjustment: {adjustment_type} - {remarks}"
         )
-        
-        # Update product stock
+
         product.stock_quantity = new_quantity
+        product.stock_reason = reason
         product.save()
-        
-        return JsonResponse({'success': True})
-        
-    except Exception as e:
-        return JsonResponse({'success': False, 'error': str(e)})
+
+    return JsonResponse({'success': True, 'stock_quantity': new_quantity})
 
 
-def product_details_api(request, pk):
+async def product_details_api(request, pk):
     """API endpoint to get detailed product information"""
-    product = get_object_or_404(Product, pk=pk)
+    product = await aget_object_or_404(Product.objects.select_related('category', 'supplier'), pk=pk)
     
     data = {
         'id': product.id,
@@ -978,31 +1326,31 @@ def export_inventory(request):
 
 
 def export_inventory_csv(request):
-    """Export inventory as CSV"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="inventory_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Product Name', 'Brand', 'Category', 'Supplier', 'Current Stock', 'Reorder Level', 'Unit Cost', 'Retail Price', 'Expiry Date', 'Status'])
-    
-    products = Product.objects.select_related('category', 'supplier').all()
-    for product in products:
-        status = 'Out of Stock' if product.stock_quantity == 0 else 'Low Stock' if product.stock_quantity <= product.reorder_level else 'In Stock'
-        
-        writer.writerow([
-            product.product_name,
-            product.brand or '',
-            product.category.category_name,
-            product.supplier.supplier_name,
-            product.stock_quantity,
-            product.reorder_level,
-            product.unit_cost,
-            product.retail_price,
-            product.expiry_date.strftime('%Y-%m-%d') if product.expiry_date else '',
-            status
-        ])
-    
-    return response
+    """Export inventory as CSV, streamed in chunks"""
+    products = Product.objects.order_by('id').values_list(
+        'product_name', 'brand', 'category__category_name', 'supplier__supplier_name', 'stock_quantity',
+        'reorder_level', 'unit_cost', 'retail_price', 'expiry_date',
+    )
+
+    def rows():
+        yield ['Product Name', 'Brand', 'Category', 'Supplier', 'Current Stock', 'Reorder Level', 'Unit Cost', 'Retail Price', 'Expiry Date', 'Status']
+        for (product_name, brand, category_name, supplier_name, stock_quantity,
+             reorder_level, unit_cost, retail_price, expiry_date) in products.iterator(chunk_size=CSV_CHUNK_SIZE):
+            status = 'Out of Stock' if stock_quantity == 0 else 'Low Stock' if stock_quantity <= reorder_level else 'In Stock'
+            yield [
+                product_name,
+                brand or '',
+                category_name,
+                supplier_name,
+                stock_quantity,
+                reorder_level,
+                unit_cost,
+                retail_price,
+                expiry_date.strftime('%Y-%m-%d') if expiry_date else '',
+                status
+            ]
+
+    return streaming_csv_response(f'inventory_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv', rows())
 
 
 def export_inventory_pdf(request):
@@ -1148,26 +1496,28 @@ def export_payroll(request):
 
 
 def export_payroll_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="payroll_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Staff Name', 'Position', 'Payment Date', 'Basic Salary', 'Allowances', 'Deductions', 'Net Salary', 'Payment Method'])
-    
-    payrolls = Payroll.objects.select_related('staff').order_by('-payment_date')
-    for payroll in payrolls:
-        writer.writerow([
-            f"{payroll.staff.first_name} {payroll.staff.last_name}",
-            payroll.staff.position,
-            payroll.payment_date.strftime('%Y-%m-%d'),
-            payroll.basic_salary,
-            payroll.allowances or 0,
-            payroll.deductions or 0,
-            payroll.net_salary,
-            payroll.payment_method
-        ])
-    
-    return response
+    """Export payroll as CSV, streamed in chunks"""
+    payrolls = Payroll.objects.order_by('-payment_date').values_list(
+        'staff__first_name', 'staff__last_name', 'staff__role', 'payment_date', 'basic_salary',
+        'allowances', 'deductions', 'net_salary', 'payment_method',
+    )
+
+    def rows():
+        yield ['Staff Name', 'Position', 'Payment Date', 'Basic Salary', 'Allowances', 'Deductions', 'Net Salary', 'Payment Method']
+        for (first_name, last_name, role, payment_date, basic_salary,
+             allowances, deductions, net_salary, payment_method) in payrolls.iterator(chunk_size=CSV_CHUNK_SIZE):
+            yield [
+                f"{first_name} {last_name}",
+                role,
+                payment_date.strftime('%Y-%m-%d'),
+                basic_salary,
+                allowances or 0,
+                deductions or 0,
+                net_salary,
+                payment_method
+            ]
+
+    return streaming_csv_response(f'payroll_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv', rows())
 
 
 def export_payroll_pdf(request):
@@ -1246,49 +1596,66 @@ def export_payroll_pdf(request):
 # ---------------------------------------------------------
 
 # Helper function to get date filters from request
-def get_date_filters(request):
+def get_date_filters(request, start_param='from', end_param='to'):
     """
-    Extract 'from' and 'to' date parameters from request.
-    Returns a dict with 'start' and 'end' datetime objects or None.
+    Extract date parameters ('from'/'to' by default) from request.
+    Returns a dict with the inclusive calendar days 'start_date'/'end_date'
+    and the matching half-open datetime bounds 'start' (first instant of the
+    start day) and 'end' (first instant after the end day), in Africa/Kampala.
+    Missing or invalid parameters are left out.
     """
-    from_date = request.GET.get('from')
-    to_date = request.GET.get('to')
-    
     filters = {}
     
-    if from_date:
-        try:
-            # Parse date and set to start of day
-            from datetime import datetime
-            start = datetime.strptime(from_date, '%Y-%m-%d')
-            filters['start'] = timezone.make_aware(start) if timezone.is_naive(start) else start
-        except ValueError:
-            pass
+    for key, param in (('start_date', start_param), ('end_date', end_param)):
+        value = request.GET.get(param)
+        if value:
+            try:
+                filters[key] = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                pass
     
-    if to_date:
-        try:
-            # Parse date and set to end of day
-            from datetime import datetime
-            end = datetime.strptime(to_date, '%Y-%m-%d')
-            end = end.replace(hour=23, minute=59, second=59)
-            filters['end'] = timezone.make_aware(end) if timezone.is_naive(end) else end
-        except ValueError:
-            pass
+    start, end = day_range(filters.get('start_date'), filters.get('end_date'))
+    if start:
+        filters['start'] = start
+    if end:
+        filters['end'] = end
     
     return filters
 
-def reports_view(request):
-    """View for analytics and reports dashboard."""
+
+def filter_date_range(queryset, field, date_filters):
+    """Restrict a datetime field to the [start, end) bounds from get_date_filters()."""
+    if 'start' in date_filters:
+        queryset = queryset.filter(**{f'{field}__gte': date_filters['start']})
+    if 'end' in date_filters:
+        queryset = queryset.filter(**{f'{field}__lt': date_filters['end']})
+    return queryset
+
+
+def describe_period(date_filters):
+    """Human readable 'Period: ...' line for report exports."""
+    return f"Period: {date_filters.get('start_date', 'All')} to {date_filters.get('end_date', 'Now')}"
+
+
+def reports_view(request):
+    """View for analytics and reports dashboard."""
     today = timezone.now().date()
     month_start = today.replace(day=1)
 
+    # Serve the sales figures from the daily rollup once it covers all history
+    use_rollup = rollups.is_covered()
+    rollup = rollups.rollup_rows()
+
     # Use SaleDetail for itemized sales
     sale_details = SaleDetail.objects.all()
 
     # Total Sales
-    total_sales = sale_details.aggregate(
-        total=Sum(F('quantity_sold') * F('unit_price'), output_field=FloatField())
-    )['total'] or 0
+    if use_rollup:
+        total_sales = float(rollup.aggregate(total=Sum('gross_revenue'))['total'] or 0)
+    else:
+        total_sales = sale_details.aggregate(
+            total=Sum(F('quantity_sold') * F('unit_price'), output_field=FloatField())
+        )['total'] or 0
 
     # Total Purchases (from PurchaseOrderDetail)
     purchases = PurchaseOrderDetail.objects.all()
@@ -1300,34 +1667,58 @@ def reports_view(request):
     profit = total_sales - total_purchases
 
     # Sales by Category
-    category_sales = (
-        sale_details.values('product__category__category_name')
-        .annotate(total=Sum(F('unit_price') * F('quantity_sold'), output_field=FloatField()))
-        .order_by('product__category__category_name')
-    )
+    if use_rollup:
+        category_sales = [
+            {'product__category__category_name': row['category__category_name'], 'total': float(row['total'] or 0)}
+            for row in rollup.values('category__category_name')
+            .annotate(total=Sum('gross_revenue'))
+            .order_by('category__category_name')
+        ]
+    else:
+        category_sales = (
+            sale_details.values('product__category__category_name')
+            .annotate(total=Sum(F('unit_price') * F('quantity_sold'), output_field=FloatField()))
+            .order_by('product__category__category_name')
+        )
 
     # Sales distribution (for optional histogram)
-    sales_distribution = (
-        Sale.objects.annotate(day=TruncDate('sale_datetime'))
-        .values('day')
-        .annotate(count=Sum('total_amount'))
-        .order_by('day')
-    )
+    if use_rollup:
+        sales_distribution = (
+            rollup.values(day=F('date'))
+            .annotate(count=Sum('revenue'))
+            .order_by('day')
+        )
+    else:
+        sales_distribution = (
+            Sale.objects.annotate(day=TruncDate('sale_datetime'))
+            .values('day')
+            .annotate(count=Sum('total_amount'))
+            .order_by('day')
+        )
 
     # Yearly sales data for the line graph
     current_year = now().year
     start_year = current_year - 4  # Show last 5 years by default
     
-    yearly_sales = (
-        Sale.objects.filter(
-            sale_datetime__year__gte=start_year,
-            sale_datetime__year__lte=current_year
+    if use_rollup:
+        yearly_sales = (
+            rollup.filter(date__year__gte=start_year, date__year__lte=current_year)
+            .annotate(year=ExtractYear('date'))
+            .values('year')
+            .annotate(total_sales=Sum('revenue'))
+            .order_by('year')
+        )
+    else:
+        yearly_sales = (
+            Sale.objects.filter(
+                sale_datetime__year__gte=start_year,
+                sale_datetime__year__lte=current_year
+            )
+            .annotate(year=ExtractYear('sale_datetime'))
+            .values('year')
+            .annotate(total_sales=Sum('total_amount'))
+            .order_by('year')
         )
-        .annotate(year=ExtractYear('sale_datetime'))
-        .values('year')
-        .annotate(total_sales=Sum('total_amount'))
-        .order_by('year')
-    )
     
     # Prepare yearly data for template
     yearly_data = []
@@ -1353,59 +1744,149 @@ def reports_view(request):
     return render(request, 'inventory/reports.html', context)
 
 
-def sales_by_category_api(request):
+async def sales_by_category_api(request):
     """Return total sales grouped by product category as percentages."""
     date_filters = get_date_filters(request)
 
     sale_details_qs = SaleDetail.objects.all()
-    if 'start' in date_filters:
-        sale_details_qs = sale_details_qs.filter(sale__sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        sale_details_qs = sale_details_qs.filter(sale__sale_datetime__lte=date_filters['end'])
+    sale_details_qs = filter_date_range(sale_details_qs, 'sale__sale_datetime', date_filters)
 
     # Group totals by category
-    data = (
-        sale_details_qs
-        .values('product__category__category_name')
+    data = [
+        row async for row in sale_details_qs
+        .values(category_name=F('product__category__category_name'))
         .annotate(total=Sum(F('unit_price') * F('quantity_sold'), output_field=FloatField()))
-        .order_by('product__category__category_name')
-    )
+        .order_by('category_name')
+    ]
+    return JsonResponse(category_shares(data))
+
+
+def category_shares(rows):
+    """Chart payload of each category's share of sales, from rows of {'category_name', 'total'}."""
+    grand_total = sum(float(row['total'] or 0) for row in rows) or 1  # avoid division by zero
+    return {
+        'labels': [row['category_name'] or 'Uncategorized' for row in rows],
+        'data': [round((float(row['total'] or 0) / grand_total) * 100, 2) for row in rows],
+    }
+
+
+HISTOGRAM_EDGES = [50000, 100000, 200000, 300000]
+HISTOGRAM_MAX_BUCKETS = 20
+HISTOGRAM_PARAMS_ERROR = f"edges must be ascending numbers and quantiles between 2 and {HISTOGRAM_MAX_BUCKETS}"
+
+
+def format_amount(value):
+    """Compact UGX label: 50000 -> '50K', 1500000 -> '1.5M'."""
+    value = float(value)
+    for divisor, suffix in ((1_000_000, 'M'), (1_000, 'K')):
+        if abs(value) >= divisor:
+            return f"{value / divisor:g}{suffix}"
+    return f"{value:g}"
+
+
+async def quantile_edges(queryset, field, buckets):
+    """
+    Bucket edges splitting `queryset` into `buckets` roughly equal-count groups.
+    Each edge is read with a single ORDER BY ... OFFSET lookup, so no rows
+    are pulled into Python.
+    """
+    ordered = queryset.exclude(**{f'{field}__isnull': True}).order_by(field).values_list(field, flat=True)
+    total = await ordered.acount()
+    edges = []
+    for i in range(1, buckets):
+        edge = await ordered[total * i // buckets:total * i // buckets + 1].afirst() if total else None
+        if edge is not None and (not edges or edge > edges[-1]):
+            edges.append(edge)
+    return edges
+
+
+def histogram_buckets(field, edges):
+    """
+    Labels and Count() aggregates for the buckets delimited by the ascending
+    `edges`, so the counts can be read with any other aggregate() call.
+    """
+    ranges = [(None, edges[0])] if edges else [(None, None)]
+    ranges += list(zip(edges, edges[1:]))
+    if edges:
+        ranges.append((edges[-1], None))
+
+    aggregates = {}
+    for i, (low, high) in enumerate(ranges):
+        condition = Q()
+        if low is not None:
+            condition &= Q(**{f'{field}__gte': low})
+        if high is not None:
+            condition &= Q(**{f'{field}__lt': high})
+        aggregates[f'bucket_{i}'] = Count('pk', filter=condition)
+
+    labels = []
+    for low, high in ranges:
+        if low is None and high is None:
+            labels.append('All')
+        elif low is None:
+            labels.append(f"Under {format_amount(high)}")
+        elif high is None:
+            labels.append(f"{format_amount(low)}+")
+        else:
+            labels.append(f"{format_amount(low)}–{format_amount(high)}")
+    return labels, aggregates
+
 
-    # Calculate the grand total
-    grand_total = sum(d['total'] or 0 for d in data) or 1  # avoid division by zero
+async def histogram_counts(queryset, field, edges):
+    """Count rows per bucket delimited by the ascending `edges` in one query."""
+    labels, aggregates = histogram_buckets(field, edges)
+    counts = await queryset.aaggregate(**aggregates)
+    return labels, [counts[name] for name in aggregates]
 
-    # Convert each total to percentage
-    labels = [d['product__category__category_name'] or 'Uncategorized' for d in data]
-    percentages = [round((float(d['total'] or 0) / grand_total) * 100, 2) for d in data]
 
-    return JsonResponse({'labels': labels, 'data': percentages})
+def histogram_params(request):
+    """
+    (edges, quantiles) from ?edges= or ?quantiles=; quantiles is None unless
+    asked for, edges default to HISTOGRAM_EDGES. Raises ValueError.
+    """
+    if request.GET.get('quantiles'):
+        buckets = int(request.GET['quantiles'])
+        if not 2 <= buckets <= HISTOGRAM_MAX_BUCKETS:
+            raise ValueError
+        return None, buckets
+    if request.GET.get('edges'):
+        try:
+            edges = [Decimal(e) for e in request.GET['edges'].split(',')]
+        except ArithmeticError:
+            raise ValueError
+        if (not all(e.is_finite() for e in edges) or len(edges) >= HISTOGRAM_MAX_BUCKETS
+                or edges != sorted(set(edges))):
+            raise ValueError
+        return edges, None
+    return HISTOGRAM_EDGES, None
 
 
-def sales_histogram_api(request):
-    """Return sales distribution with realistic ranges"""
+async def sales_histogram_api(request):
+    """
+    Return the distribution of sale totals.
+    Optional parameters:
+      edges=50000,100000,...   custom ascending bucket edges
+      quantiles=N              N equal-count buckets derived from the data
+    Without either, the standard UGX ranges are used.
+    """
     date_filters = get_date_filters(request)
     
     # Base queryset
     sales_qs = Sale.objects.all()
-    if 'start' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__lte=date_filters['end'])
-    
-    # More realistic ranges based on your data
-    buckets = {
-        "Under 50K": sales_qs.filter(total_amount__lt=50000).count(),
-        "50K–100K": sales_qs.filter(total_amount__gte=50000, total_amount__lt=100000).count(),
-        "100K–200K": sales_qs.filter(total_amount__gte=100000, total_amount__lt=200000).count(),
-        "200K–300K": sales_qs.filter(total_amount__gte=200000, total_amount__lt=300000).count(),
-        "300K+": sales_qs.filter(total_amount__gte=300000).count(),
-    }
-    labels = list(buckets.keys())
-    values = list(buckets.values())
-    return JsonResponse({'labels': labels, 'data': values})
+    sales_qs = filter_date_range(sales_qs, 'sale_datetime', date_filters)
+    
+    try:
+        edges, quantiles = histogram_params(request)
+    except ValueError:
+        return JsonResponse({'error': HISTOGRAM_PARAMS_ERROR}, status=400)
+    if quantiles:
+        edges = await quantile_edges(sales_qs, 'total_amount', quantiles)
+
+    labels, values = await histogram_counts(sales_qs, 'total_amount', edges)
+    return JsonResponse({'labels': labels, 'data': values, 'edges': [float(e) for e in edges]})
 
 # --- KPI API: returns totals for dashboard ---
-def kpi_data_api(request):
+async def kpi_data_api(request):
     """
     Returns JSON:
     {
@@ -1415,61 +1896,138 @@ def kpi_data_api(request):
       "top_category": "Category Name" or null,
       "revenue_growth_pct": float (optional, relative to previous period)
     }
+    Payloads are cached per date range until the next sale is recorded;
+    the X-Cache header says whether this one came from the cache.
     """
     date_filters = get_date_filters(request)
-    
+    payload, hit = await kpi_cache.get_kpis(
+        date_filters.get('start_date'), date_filters.get('end_date'),
+        lambda: compute_kpis(date_filters),
+    )
+    response = JsonResponse(payload)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+def kpi_cache_stats_api(request):
+    """Hit/miss counters for the KPI cache."""
+    return JsonResponse(kpi_cache.stats())
+
+
+# Seconds between comment lines that keep idle SSE connections open through proxies
+LIVE_EVENTS_KEEPALIVE = 20
+
+
+async def live_events_stream(request):
+    """
+    Server-sent events: new inventory logs, stock levels and today's sales
+    totals, pushed as they are committed. ?topics=stock,sales limits the
+    stream (default: all of events.TOPICS). Needs the ASGI entry point
+    (supermarket.asgi), where an idle connection costs no worker thread.
+    """
+    topics = set(request.GET.get('topics', '').split(',')) & set(events.TOPICS) or set(events.TOPICS)
+    broker = events.get_broker()
+
+    async def stream():
+        queue = broker.subscribe()
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event_id, topic, data = await asyncio.wait_for(queue.get(), LIVE_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if topic in topics:
+                    yield f"id: {event_id}\nevent: {topic}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+        finally:
+            broker.unsubscribe(queue)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def compute_kpis(date_filters):
+    """
+    Dashboard KPI payload for the given get_date_filters() result. The
+    totals, top category and growth figures do not depend on each other,
+    so their queries are awaited together.
+    """
     # Base queryset
     sales_qs = Sale.objects.all()
-    if 'start' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__lte=date_filters['end'])
-    
-    # total revenue & orders
-    total_revenue = sales_qs.aggregate(total=Sum('total_amount'))['total'] or 0
-    total_orders = sales_qs.count()
+    sales_qs = filter_date_range(sales_qs, 'sale_datetime', date_filters)
+    
+    start_day, end_day = date_filters.get('start_date'), date_filters.get('end_date')
+    if await rollups.ais_covered(start_day):
+        rollup = rollups.rollup_rows(start_day, end_day)
+        totals_query = rollup.aaggregate(revenue=Sum('revenue'), orders=Sum('order_count'))
+        top_cat_query = (
+            rollup.values(category_name=F('category__category_name'))
+            .annotate(total=Sum('gross_revenue'))
+            .order_by('-total')
+        ).afirst()
+    else:
+        # total revenue & orders
+        totals_query = sales_qs.aaggregate(revenue=Sum('total_amount'), orders=Count('id'))
 
-    # average order value (safe)
-    avg_order_value = float(total_revenue) / total_orders if total_orders else 0.0
-
-    # top category by sales (unit_price * qty) - filter by same date range
-    sale_details_qs = SaleDetail.objects.filter(sale__in=sales_qs)
-    
-    top_cat_q = (
-        sale_details_qs
-        .values('product__category__category_name')
-        .annotate(total=Sum(F('unit_price') * F('quantity_sold'), output_field=FloatField()))
-        .order_by('-total')
-    ).first()
-    top_category = top_cat_q['product__category__category_name'] if top_cat_q else ''
+        # top category by sales (unit_price * qty) - filter by same date range
+        top_cat_query = (
+            SaleDetail.objects.filter(sale__in=sales_qs)
+            .values(category_name=F('product__category__category_name'))
+            .annotate(total=Sum(F('unit_price') * F('quantity_sold'), output_field=FloatField()))
+            .order_by('-total')
+        ).afirst()
 
     # optional: simple growth % for last 30 days vs previous 30 days
     # Only calculate if no custom date range is provided
-    revenue_growth_pct = None
+    queries = [totals_query, top_cat_query]
     if not date_filters:  # Only calculate growth for default view
-        try:
-            now_time = timezone.now()
-            last_30_start = now_time - timedelta(days=30)
-            prev_30_start = now_time - timedelta(days=60)
-            current_sum = Sale.objects.filter(sale_datetime__gte=last_30_start).aggregate(total=Sum('total_amount'))['total'] or 0
-            previous_sum = Sale.objects.filter(sale_datetime__gte=prev_30_start, sale_datetime__lt=last_30_start).aggregate(total=Sum('total_amount'))['total'] or 0
-            if previous_sum and previous_sum != 0:
-                revenue_growth_pct = float((current_sum - previous_sum) / previous_sum * 100)
-        except Exception:
-            revenue_growth_pct = None
-
-    payload = {
+        now_time = timezone.now()
+        queries.append(Sale.objects.filter(sale_datetime__gte=now_time - timedelta(days=60))
+                       .aaggregate(**growth_sums(now_time)))
+
+    totals, top_cat_q, *growth = await asyncio.gather(*queries)
+    return kpi_payload(
+        totals['revenue'] or 0, totals['orders'] or 0,
+        top_cat_q['category_name'] if top_cat_q else '',
+        growth[0] if growth else None,
+    )
+
+
+def growth_sums(now_time):
+    """Sum() aggregates of revenue in the last 30 days ('current') and the 30 before ('previous')."""
+    last_30_start = now_time - timedelta(days=30)
+    prev_30_start = now_time - timedelta(days=60)
+    return {
+        'current': Sum('total_amount', filter=Q(sale_datetime__gte=last_30_start)),
+        'previous': Sum('total_amount', filter=Q(sale_datetime__gte=prev_30_start,
+                                                 sale_datetime__lt=last_30_start)),
+    }
+
+
+def kpi_payload(total_revenue, total_orders, top_category, growth=None):
+    """The kpi_data_api document; `growth` is the result of the growth_sums() aggregates."""
+    # average order value (safe)
+    avg_order_value = float(total_revenue) / total_orders if total_orders else 0.0
+
+    revenue_growth_pct = None
+    if growth and growth['previous']:
+        current_sum, previous_sum = growth['current'] or 0, growth['previous']
+        revenue_growth_pct = float((current_sum - previous_sum) / previous_sum * 100)
+
+    return {
         'total_revenue': float(total_revenue),
         'total_orders': int(total_orders),
         'avg_order_value': float(avg_order_value),
         'top_category': top_category or '',
         'revenue_growth_pct': revenue_growth_pct,
     }
-    return JsonResponse(payload)
 
 
 # --- Sales table API: returns recent sale lines for the detailed table ---
-def sales_table_data_api(request):
+async def sales_table_data_api(request):
     """
     Returns a JSON array of recent sale lines:
     [
@@ -1478,276 +2036,359 @@ def sales_table_data_api(request):
       ...
     ]
     """
-    date_filters = get_date_filters(request)
-    
+    rows = [sale_line_row(sd) async for sd in sales_table_rows(get_date_filters(request))]
+    return JsonResponse(rows, safe=False)
+
+
+def sales_table_rows(date_filters):
+    """The 200 most recent sale lines in the date range."""
     # Base queryset
     qs = SaleDetail.objects.select_related('sale', 'product', 'product__category', 'sale__customer')
     
-    if 'start' in date_filters:
-        qs = qs.filter(sale__sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        qs = qs.filter(sale__sale_datetime__lte=date_filters['end'])
+    qs = filter_date_range(qs, 'sale__sale_datetime', date_filters)
     
-    qs = qs.order_by('-sale__sale_datetime')[:200]
+    return qs.order_by('-sale__sale_datetime')[:200]
 
-    rows = []
-    for sd in qs:
-        sale = sd.sale
-        product = sd.product
-        # customer display: prefer name, fallback to phone/email
-        customer_name = ''
-        if getattr(sale, 'customer', None):
-            c = sale.customer
-            # assemble sensible name
-            if hasattr(c, 'first_name') and c.first_name:
-                customer_name = f"{(c.first_name or '')} {(c.last_name or '')}".strip()
-            else:
-                customer_name = getattr(c, 'phone', '') or getattr(c, 'email', '') or ''
-        rows.append({
-            'date': sale.sale_datetime.strftime('%Y-%m-%d'),
-            'product': product.product_name if product else '',
-            'category': getattr(product.category, 'category_name', '') if getattr(product, 'category', None) else '',
-            'quantity': int(sd.quantity_sold or 0),
-            'unit_price': float(sd.unit_price or 0),
-            'total': float(sd.sub_total or (sd.unit_price * sd.quantity_sold) or 0),
-            'customer': customer_name,
-        })
 
-    return JsonResponse(rows, safe=False)
+def sale_line_row(sd):
+    """One sales table row for a SaleDetail from sales_table_rows()."""
+    sale = sd.sale
+    product = sd.product
+    # customer display: prefer name, fallback to phone/email
+    customer_name = ''
+    if getattr(sale, 'customer', None):
+        c = sale.customer
+        # assemble sensible name
+        if hasattr(c, 'first_name') and c.first_name:
+            customer_name = f"{(c.first_name or '')} {(c.last_name or '')}".strip()
+        else:
+            customer_name = getattr(c, 'phone', '') or getattr(c, 'email', '') or ''
+    return {
+        'date': timezone.localtime(sale.sale_datetime).strftime('%Y-%m-%d'),
+        'product': product.product_name if product else '',
+        'category': getattr(product.category, 'category_name', '') if getattr(product, 'category', None) else '',
+        'quantity': int(sd.quantity_sold or 0),
+        'unit_price': float(sd.unit_price or 0),
+        'total': float(sd.sub_total or (sd.unit_price * sd.quantity_sold) or 0),
+        'customer': customer_name,
+    }
+
+PERIOD_FUNCTIONS = {'quarter': ExtractQuarter, 'month': ExtractMonth}
+CURRENCY_SYMBOL = 'UGx.'
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+               'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+async def period_sales_totals(start_year, end_year, period='year', category=None, payment_method=None):
+    """
+    Sales totals for [start_year, end_year] from a single grouped query.
+    `period` is 'year', 'quarter' or 'month'. Returns {year: total} or
+    {(year, quarter|month): total}; missing periods are absent.
+    """
+    if await rollups.ais_covered(date(start_year, 1, 1)):
+        qs = rollups.rollup_rows(date(start_year, 1, 1), date(end_year, 12, 31))
+        date_field, amount_field = 'date', 'revenue'
+        if category:
+            qs = qs.filter(category_id=category)
+        if payment_method:
+            qs = qs.filter(payment_method=payment_method)
+    elif category:
+        # Category totals have to come from the line items
+        qs = SaleDetail.objects.filter(
+            sale__sale_datetime__year__gte=start_year,
+            sale__sale_datetime__year__lte=end_year,
+            product__category_id=category,
+        )
+        date_field, amount_field = 'sale__sale_datetime', 'sub_total'
+        if payment_method:
+            qs = qs.filter(sale__payment_method=payment_method)
+    else:
+        qs = Sale.objects.filter(
+            sale_datetime__year__gte=start_year,
+            sale_datetime__year__lte=end_year,
+        )
+        date_field, amount_field = 'sale_datetime', 'total_amount'
+        if payment_method:
+            qs = qs.filter(payment_method=payment_method)
+
+    groups = {'year': ExtractYear(date_field)}
+    if period != 'year':
+        groups[period] = PERIOD_FUNCTIONS[period](date_field)
+
+    rows = qs.annotate(**groups).values(*groups).annotate(total=Sum(amount_field)).order_by()
+    if period != 'year':
+        return {(row['year'], row[period]): row['total'] or 0 async for row in rows}
+    return {row['year']: row['total'] or 0 async for row in rows}
+
+
+def yearly_sales_payload(start_year, end_year, totals):
+    """yearly_sales_api document from {year: total}; years without sales are zero."""
+    years = list(range(start_year, end_year + 1))
+    return {
+        'years': years,
+        'sales_totals': [float(totals.get(year, 0)) for year in years],
+        'currency_symbol': CURRENCY_SYMBOL,
+    }
+
+
+def quarterly_sales_payload(start_year, end_year, totals):
+    """quarterly_sales_api document from {(year, quarter): total}: one dataset per year."""
+    return {
+        'labels': ['Q1', 'Q2', 'Q3', 'Q4'],
+        'datasets': [
+            {
+                'label': f'{year}',
+                'data': [float(totals.get((year, quarter), 0)) for quarter in range(1, 5)]
+            }
+            for year in range(start_year, end_year + 1)
+        ],
+        'currency_symbol': CURRENCY_SYMBOL,
+    }
+
+
+def monthly_sales_payload(year, totals):
+    """monthly_sales_api document for `year` from {(year, month): total}."""
+    return {
+        'year': year,
+        'months': MONTH_NAMES,
+        'sales_totals': [float(totals.get((year, month), 0)) for month in range(1, 13)],
+        'currency_symbol': CURRENCY_SYMBOL,
+    }
+
 
-def yearly_sales_api(request):
-    """FINAL VERSION - Query Sale table for yearly sales"""
+REPORT_YEARS = range(1900, 2101)
+
+
+def parse_year(value, name='year'):
+    """A report year from a query parameter. Raises ValueError with a message for the client."""
     try:
-        # Get year range from request
-        start_year = request.GET.get('start_year', '2021')
-        end_year = request.GET.get('end_year', '2025')
-        
+        year = int(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"{name} must be a whole number")
+    if year not in REPORT_YEARS:
+        raise ValueError(f"{name} must be between {REPORT_YEARS.start} and {REPORT_YEARS.stop - 1}")
+    return year
+
+
+def get_year_range(request, default_start, default_end):
+    """Parse start_year/end_year query parameters, falling back to the defaults. Raises ValueError."""
+    start_year = parse_year(request.GET.get('start_year', default_start), 'start_year')
+    end_year = parse_year(request.GET.get('end_year', default_end), 'end_year')
+    if start_year > end_year:
+        raise ValueError("start_year must not be after end_year")
+    return start_year, end_year
+
+
+def sales_filter_params(request):
+    """
+    ?category=<id>&payment_method=<method> for the period sales APIs, as
+    (category_id or None, payment_method or None). Raises ValueError.
+    """
+    category = request.GET.get('category') or None
+    payment_method = request.GET.get('payment_method') or None
+    if category is not None:
         try:
-            start_year = int(start_year)
-            end_year = int(end_year)
-        except (ValueError, TypeError):
-            start_year = 2021
-            end_year = 2025
-
-        print(f"Querying years {start_year} to {end_year}")
-
-        # Method 1: Direct query using year filter
-        yearly_data = []
-        for year in range(start_year, end_year + 1):
-            # Get total sales for this year
-            year_sales = Sale.objects.filter(sale_datetime__year=year)
-            year_total = year_sales.aggregate(total=Sum('total_amount'))['total'] or 0
-            
-            print(f"Year {year}: {year_sales.count()} records, total: {year_total}")
-            
-            yearly_data.append({
-                'year': year,
-                'total_sales': float(year_total)
-            })
+            category = int(category)
+        except ValueError:
+            raise ValueError("category must be a category id")
+        if category < 1:
+            raise ValueError("category must be a category id")
+    if payment_method is not None and payment_method not in dict(Sale.PAYMENT_CHOICES):
+        raise ValueError(f"payment_method must be one of {', '.join(dict(Sale.PAYMENT_CHOICES))}")
+    return category, payment_method
 
-        # Prepare response
-        years = [item['year'] for item in yearly_data]
-        sales_totals = [item['total_sales'] for item in yearly_data]
 
-        print(f"Final response: {years} -> {sales_totals}")
+def period_sales_params(request, default_start, default_end):
+    """(start_year, end_year, category, payment_method) for the period sales APIs. Raises ValueError."""
+    return (*get_year_range(request, default_start, default_end), *sales_filter_params(request))
+
+
+async def yearly_sales_api(request):
+    """Yearly sales totals, optionally filtered by ?category=<id>&payment_method=<method>"""
+    try:
+        start_year, end_year, category, payment_method = period_sales_params(request, 2021, 2025)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    totals = await period_sales_totals(start_year, end_year, category=category, payment_method=payment_method)
+    return JsonResponse(yearly_sales_payload(start_year, end_year, totals))
+
+
+async def monthly_sales_api(request):
+    """Return monthly sales data for a specific year (?year=, default this year)"""
+    try:
+        year = parse_year(request.GET.get('year', timezone.localdate().year))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    totals = await period_sales_totals(year, year, period='month')
+    return JsonResponse(monthly_sales_payload(year, totals))
 
-        return JsonResponse({
-            'years': years,
-            'sales_totals': sales_totals,
-            'currency_symbol': 'UGx.'
-        })
-        
-    except Exception as e:
-        print(f"ERROR in yearly_sales_api: {e}")
-        # Return actual error instead of zeros
-        return JsonResponse({
-            'error': str(e),
-            'years': [2021, 2022, 2023, 2024, 2025],
-            'sales_totals': [100000, 200000, 300000, 400000, 500000],  # Test data to verify API works
-            'currency_symbol': 'UGx.'
-        })
-    
-    
-def monthly_sales_api(request):
-    """Return monthly sales data for a specific year"""
-    year = request.GET.get('year', now().year)
     
+async def quarterly_sales_api(request):
+    """Quarterly sales per year, optionally filtered by ?category=<id>&payment_method=<method>"""
     try:
-        year = int(year)
-    except (ValueError, TypeError):
-        year = now().year
-    
-    monthly_sales = (
-        Sale.objects.filter(sale_datetime__year=year)
-        .annotate(month=ExtractMonth('sale_datetime'))
-        .values('month')
-        .annotate(total_sales=Sum('total_amount'))
-        .order_by('month')
+        start_year, end_year, category, payment_method = period_sales_params(request, 2023, 2025)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    totals = await period_sales_totals(
+        start_year, end_year, period='quarter', category=category, payment_method=payment_method,
     )
-    
-    # Create complete dataset for all months
-    complete_data = []
-    month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                   'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    
-    for month in range(1, 13):
-        month_data = next((item for item in monthly_sales if item['month'] == month), None)
-        if month_data:
-            complete_data.append({
-                'month': month,
-                'month_name': month_names[month-1],
-                'total_sales': float(month_data['total_sales'] or 0)
-            })
-        else:
-            complete_data.append({
-                'month': month,
-                'month_name': month_names[month-1],
-                'total_sales': 0.0
-            })
-    
-    months = [item['month_name'] for item in complete_data]
-    sales_totals = [item['total_sales'] for item in complete_data]
-    
-    return JsonResponse({
-        'year': year,
-        'months': months,
-        'sales_totals': sales_totals,
-        'currency_symbol': 'UGx.'
-    })
-    
-def quarterly_sales_api(request):
-    """Simple quarterly sales using same approach as yearly sales"""
+    return JsonResponse(quarterly_sales_payload(start_year, end_year, totals))
+
+# --- Dashboard API: every reports page chart in one document ---
+DASHBOARD_YEARS = 5
+DASHBOARD_MAX_YEARS = 20
+
+
+async def dashboard_api(request):
+    """
+    The reports page in one request: the kpi_data_api, sales_by_category_api,
+    sales_histogram_api and sales_table_data_api payloads for ?from=/?to=,
+    yearly and quarterly sales for the last ?years= (default 5) years and
+    monthly sales for ?year= (default this year). ?edges= and ?quantiles=
+    work as on sales_histogram_api.
+
+    The document is cached as a unit until the next sale (X-Cache says
+    whether this one was) and carries an ETag.
+    """
+    date_filters = get_date_filters(request)
+    this_year = timezone.localdate().year
     try:
-        # Get year range from request
-        start_year = request.GET.get('start_year', '2023')
-        end_year = request.GET.get('end_year', '2025')
-        
-        try:
-            start_year = int(start_year)
-            end_year = int(end_year)
-        except (ValueError, TypeError):
-            start_year = 2023
-            end_year = 2025
-
-        print(f"QUARTERLY DEBUG: Querying years {start_year} to {end_year}")
-
-        # Simple approach - use the same logic as yearly sales but for quarters
-        quarterly_data = []
-        for year in range(start_year, end_year + 1):
-            print(f"QUARTERLY DEBUG: Processing year {year}")
-            
-            for quarter in range(1, 5):  # Quarters 1-4
-                # Simple quarter filtering using the same approach as yearly
-                quarter_sales = Sale.objects.filter(
-                    sale_datetime__year=year
-                ).extra({
-                    'quarter': "EXTRACT(QUARTER FROM sale_datetime)"
-                }).filter(quarter=quarter)
-                
-                quarter_total = quarter_sales.aggregate(total=Sum('total_amount'))['total'] or 0
-                
-                print(f"QUARTERLY DEBUG: Year {year} Q{quarter}: {quarter_sales.count()} records, total: {quarter_total}")
-                
-                if quarter_sales.exists():
-                    sample = quarter_sales.first()
-                    print(f"QUARTERLY DEBUG: Sample - {sample.sale_datetime} - {sample.total_amount}")
-                
-                quarterly_data.append({
-                    'year': year,
-                    'quarter': quarter,
-                    'quarter_label': f"Q{quarter}",
-                    'total_sales': float(quarter_total)
-                })
+        years = int(request.GET.get('years', DASHBOARD_YEARS))
+        if not 1 <= years <= DASHBOARD_MAX_YEARS:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': f"years must be between 1 and {DASHBOARD_MAX_YEARS}"}, status=400)
+    try:
+        year = parse_year(request.GET.get('year', this_year))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    try:
+        edges, quantiles = histogram_params(request)
+    except ValueError:
+        return JsonResponse({'error': HISTOGRAM_PARAMS_ERROR}, status=400)
+
+    start_year = this_year - years + 1
+    payload, hit = await kpi_cache.get_cached(
+        ('dashboard', date_filters.get('start_date') or 'all', date_filters.get('end_date') or 'now',
+         start_year, this_year, year, quantiles or ','.join(map(str, edges))),
+        lambda: compute_dashboard(date_filters, edges, quantiles, start_year, this_year, year),
+    )
+    response = etag_response(request, payload)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
 
-        # Group by year
-        years = []
-        quarters_data = {}
-        
-        for item in quarterly_data:
-            year = item['year']
-            quarter = item['quarter_label']
-            sales = item['total_sales']
-            
-            if year not in years:
-                years.append(year)
-                quarters_data[year] = {'Q1': 0, 'Q2': 0, 'Q3': 0, 'Q4': 0}
-            
-            quarters_data[year][quarter] = sales
 
-        # Prepare response
-        quarter_labels = ['Q1', 'Q2', 'Q3', 'Q4']
-        datasets = []
-        
-        for year in sorted(years):
-            datasets.append({
-                'label': f'{year}',
-                'data': [
-                    quarters_data[year]['Q1'],
-                    quarters_data[year]['Q2'], 
-                    quarters_data[year]['Q3'],
-                    quarters_data[year]['Q4']
-                ]
-            })
+async def compute_dashboard(date_filters, edges, quantiles, start_year, end_year, year):
+    """
+    dashboard_api document. One aggregate over the filtered sales gives the
+    KPI totals, growth and histogram buckets; one grouped query gives both
+    the top category and the category shares; one month-grouped query gives
+    the yearly, quarterly and monthly series. Independent queries are
+    awaited together.
+    """
+    sales_qs = filter_date_range(Sale.objects.all(), 'sale_datetime', date_filters)
+    if quantiles:
+        edges = await quantile_edges(sales_qs, 'total_amount', quantiles)
+    bucket_labels, buckets = histogram_buckets('total_amount', edges)
+
+    sales_aggregates = {'revenue': Sum('total_amount'), 'orders': Count('id'), **buckets}
+    if not date_filters:
+        sales_aggregates.update(growth_sums(timezone.now()))
+
+    start_day, end_day = date_filters.get('start_date'), date_filters.get('end_date')
+    if await rollups.ais_covered(start_day):
+        categories_qs = (
+            rollups.rollup_rows(start_day, end_day)
+            .values(category_name=F('category__category_name'))
+            .annotate(total=Sum('gross_revenue'))
+        )
+    else:
+        categories_qs = (
+            filter_date_range(SaleDetail.objects.all(), 'sale__sale_datetime', date_filters)
+            .values(category_name=F('product__category__category_name'))
+            .annotate(total=Sum(F('unit_price') * F('quantity_sold'), output_field=FloatField()))
+        )
 
-        print(f"QUARTERLY DEBUG: Final response - {datasets}")
+    async def fetch_all(qs):
+        return [row async for row in qs]
+
+    totals, category_rows, monthly, table_rows = await asyncio.gather(
+        sales_qs.aaggregate(**sales_aggregates),
+        fetch_all(categories_qs.order_by('category_name')),
+        period_sales_totals(min(start_year, year), max(end_year, year), period='month'),
+        fetch_all(sales_table_rows(date_filters)),
+    )
+
+    top = max(category_rows, key=lambda row: row['total'] or 0, default=None)
+    yearly, quarterly = defaultdict(Decimal), defaultdict(Decimal)
+    for (period_year, month), total in monthly.items():
+        yearly[period_year] += total
+        quarterly[(period_year, (month - 1) // 3 + 1)] += total
+
+    return {
+        'kpis': kpi_payload(totals['revenue'] or 0, totals['orders'], top['category_name'] if top else '',
+                            totals if not date_filters else None),
+        'sales_by_category': category_shares(category_rows),
+        'histogram': {
+            'labels': bucket_labels,
+            'data': [totals[name] for name in buckets],
+            'edges': [float(e) for e in edges],
+        },
+        'yearly_sales': yearly_sales_payload(start_year, end_year, yearly),
+        'quarterly_sales': quarterly_sales_payload(start_year, end_year, quarterly),
+        'monthly_sales': monthly_sales_payload(year, monthly),
+        'sales_table': [sale_line_row(sd) for sd in table_rows],
+    }
 
-        return JsonResponse({
-            'labels': quarter_labels,
-            'datasets': datasets,
-            'currency_symbol': 'UGx.'
-        })
-        
-    except Exception as e:
-        print(f"QUARTERLY ERROR: {e}")
-        import traceback
-        print(f"QUARTERLY TRACEBACK: {traceback.format_exc()}")
-        
-        # Fallback to test data
-        return JsonResponse({
-            'labels': ['Q1', 'Q2', 'Q3', 'Q4'],
-            'datasets': [
-                {'label': '2023', 'data': [1000000, 1500000, 1200000, 1800000]},
-                {'label': '2024', 'data': [2000000, 2200000, 1900000, 2500000]},
-                {'label': '2025', 'data': [1800000, 2000000, 2200000, 2400000]}
-            ],
-            'currency_symbol': 'UGx.'
-        })
 
 # ---------------------------------------------------------
 # FINACIAL REPORT
 # ---------------------------------------------------------
 
 def financial_report_api(request):
-    start = request.GET.get('start')
-    end = request.GET.get('end')
     group_by = request.GET.get('group_by', 'day')  # We keep the parameter but will group daily only for now
 
-    # Parse dates
-    start = datetime.strptime(start, "%Y-%m-%d").date()
-    end = datetime.strptime(end, "%Y-%m-%d").date()
+    # Parse dates into half-open [start, end) bounds
+    date_filters = get_date_filters(request, 'start', 'end')
+    if 'start' not in date_filters or 'end' not in date_filters:
+        return JsonResponse({'error': 'start and end dates (YYYY-MM-DD) are required'}, status=400)
+    start, end = date_filters['start_date'], date_filters['end_date']
+
+    TAX_RATE = 0.18
+    use_rollup = rollups.is_covered(start)
+    if use_rollup:
+        # Daily sales figures straight from the pre-aggregated rollup
+        daily = rollups.rollup_rows(start, end).values(period=F('date')).order_by('period')
 
     # -------------------- GROSS SALES --------------------
-    gross_sales = (
-        Sale.objects.filter(sale_datetime__date__range=[start, end])
-        .annotate(period=Cast('sale_datetime', DateField()))
-        .values('period')
-        .annotate(value=Sum('total_amount'))
-        .order_by('period')
-    )
+    if use_rollup:
+        gross_sales = daily.annotate(value=Sum('revenue'))
+    else:
+        gross_sales = (
+            filter_date_range(Sale.objects.all(), 'sale_datetime', date_filters)
+            .annotate(period=TruncDate('sale_datetime'))
+            .values('period')
+            .annotate(value=Sum('total_amount'))
+            .order_by('period')
+        )
 
     # -------------------- COGS --------------------
-    cogs = (
-        SaleDetail.objects.filter(sale__sale_datetime__date__range=[start, end])
-        .annotate(period=Cast('sale__sale_datetime', DateField()))
-        .values('period')
-        .annotate(
-            value=Sum(
-                F('quantity_sold') * F('product__unit_cost'),
-                output_field=DecimalField(max_digits=18, decimal_places=2)
+    if use_rollup:
+        cogs = daily.annotate(value=Sum('cogs'))
+    else:
+        cogs = (
+            filter_date_range(SaleDetail.objects.all(), 'sale__sale_datetime', date_filters)
+            .annotate(period=TruncDate('sale__sale_datetime'))
+            .values('period')
+            .annotate(
+                value=Sum(
+                    F('quantity_sold') * F('product__unit_cost'),
+                    output_field=DecimalField(max_digits=18, decimal_places=2)
+                )
             )
+            .order_by('period')
         )
-        .order_by('period')
-    )
 
     # -------------------- PAYROLL --------------------
     payroll_expenses = (
@@ -1760,11 +2401,9 @@ def financial_report_api(request):
 
     # -------------------- EXPIRY LOSSES --------------------
     expiry_losses = (
-        InventoryLog.objects.filter(
-            log_date__date__range=[start, end],
-            remarks__icontains='expiry_writeoff'
-        )
-        .annotate(period=Cast('log_date', DateField()))
+        filter_date_range(InventoryLog.objects.all(), 'log_date', date_filters)
+        .filter(reason='expiry')
+        .annotate(period=TruncDate('log_date'))
         .values('period')
         .annotate(
             value=Sum(
@@ -1776,19 +2415,26 @@ def financial_report_api(request):
     )
 
     # -------------------- TAXES --------------------
-    TAX_RATE = 0.18
-    taxes = (
-        Sale.objects.filter(sale_datetime__date__range=[start, end])
-        .annotate(period=Cast('sale_datetime', DateField()))
-        .values('period')
-        .annotate(
+    if use_rollup:
+        taxes = daily.annotate(
             value=Sum(
-                F('total_amount') * TAX_RATE,
+                F('revenue') * TAX_RATE,
                 output_field=DecimalField(max_digits=18, decimal_places=2)
             )
         )
-        .order_by('period')
-    )
+    else:
+        taxes = (
+            filter_date_range(Sale.objects.all(), 'sale_datetime', date_filters)
+            .annotate(period=TruncDate('sale_datetime'))
+            .values('period')
+            .annotate(
+                value=Sum(
+                    F('total_amount') * TAX_RATE,
+                    output_field=DecimalField(max_digits=18, decimal_places=2)
+                )
+            )
+            .order_by('period')
+        )
 
     # Return JSON
     return JsonResponse({
@@ -1808,7 +2454,7 @@ def taxes_report_api(request):
     Convention: Sale.total_amount is tax-inclusive.
 
     Inference per sale when no rate provided:
-      tax = total_amount - sum(details.sub_total) - (discount_applied or 0)
+      tax = total_amount - (sum(details.sub_total) - (discount_applied or 0))
 
     If rate provided (decimal, e.g., 0.18):
       tax = rate * max(sum_subtotals - discount_applied, 0)
@@ -1817,34 +2463,12 @@ def taxes_report_api(request):
     If group_by=payment_method, returns grouped aggregates as well.
     """
     try:
-        start = request.GET.get('start')
-        end = request.GET.get('end')
         rate_param = request.GET.get('rate')
         group_by = request.GET.get('group_by')
 
         qs = Sale.objects.select_related('customer', 'staff').prefetch_related('details')
-        if start:
-            # Parse start date and filter correctly
-            try:
-                from datetime import datetime
-                if isinstance(start, str):
-                    start_date = datetime.strptime(start, '%Y-%m-%d').date()
-                else:
-                    start_date = start
-                qs = qs.filter(sale_datetime__date__gte=start_date)
-            except (ValueError, TypeError) as e:
-                pass  # Ignore invalid date formats
-        if end:
-            # Parse end date and filter correctly
-            try:
-                from datetime import datetime
-                if isinstance(end, str):
-                    end_date = datetime.strptime(end, '%Y-%m-%d').date()
-                else:
-                    end_date = end
-                qs = qs.filter(sale_datetime__date__lte=end_date)
-            except (ValueError, TypeError) as e:
-                pass  # Ignore invalid date formats
+        # Invalid date formats are ignored
+        qs = filter_date_range(qs, 'sale_datetime', get_date_filters(request, 'start', 'end'))
 
         # Annotate each sale with sum of subtotals
         qs = qs.annotate(
@@ -1872,9 +2496,9 @@ def taxes_report_api(request):
                 output_field=DecimalField(max_digits=18, decimal_places=2)
             )
         else:
-            # Tax inference: tax = total_amount - sum_subtotals - discount_applied
+            # Tax inference: tax = total_amount - (sum_subtotals - discount_applied)
             tax_expr = ExpressionWrapper(
-                F('total_amount') - F('sum_subtotals') - F('discount_amt'),
+                F('total_amount') - F('sum_subtotals') + F('discount_amt'),
                 output_field=DecimalField(max_digits=18, decimal_places=2)
             )
 
@@ -1941,6 +2565,31 @@ def taxes_report_api(request):
 
 # Add these export functions to your views.py
 
+def sales_detail_rows(date_filters):
+    """Yield CSV rows for the sales details table, reading SaleDetail in chunks."""
+    qs = SaleDetail.objects.all()
+    qs = filter_date_range(qs, 'sale__sale_datetime', date_filters)
+
+    qs = qs.order_by('-sale__sale_datetime').values_list(
+        'sale__sale_datetime', 'product__product_name', 'product__category__category_name',
+        'quantity_sold', 'unit_price', 'sale__customer_id', 'sale__customer__first_name',
+        'sale__customer__last_name', 'sale__customer__phone', 'sale__customer__email',
+    )
+    for (sale_datetime, product_name, category_name, quantity_sold, unit_price, customer_id,
+         first_name, last_name, phone, email) in qs.iterator(chunk_size=CSV_CHUNK_SIZE):
+        customer_name = ''
+        if customer_id:
+            customer_name = f"{first_name or ''} {last_name or ''}".strip() or phone or email or ''
+        yield [
+            timezone.localtime(sale_datetime).strftime('%Y-%m-%d'),
+            product_name or '',
+            category_name or '',
+            quantity_sold or 0,
+            unit_price or 0,
+            (unit_price * quantity_sold) or 0,
+            customer_name
+        ]
+
 def export_report(request):
     """Export full report (KPIs + Sales details) in selected format"""
     export_format = request.GET.get('format', 'pdf')
@@ -1984,16 +2633,13 @@ def export_report_pdf(request):
     
     # Date range
     if date_filters:
-        date_info = f"Period: {date_filters.get('start', 'All')} to {date_filters.get('end', 'Now')}"
+        date_info = describe_period(date_filters)
         elements.append(Paragraph(date_info, styles['Normal']))
         elements.append(Spacer(1, 12))
     
     # KPIs
     sales_qs = Sale.objects.all()
-    if 'start' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__lte=date_filters['end'])
+    sales_qs = filter_date_range(sales_qs, 'sale_datetime', date_filters)
     total_revenue = sales_qs.aggregate(total=Sum('total_amount'))['total'] or 0
     total_orders = sales_qs.count()
     avg_order_value = total_revenue / total_orders if total_orders else 0
@@ -2014,15 +2660,12 @@ def export_report_pdf(request):
     elements.append(Paragraph("Sales Details", styles['Heading2']))
     elements.append(Spacer(1, 12))
     sale_details_qs = SaleDetail.objects.select_related('sale','product','product__category')
-    if 'start' in date_filters:
-        sale_details_qs = sale_details_qs.filter(sale__sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        sale_details_qs = sale_details_qs.filter(sale__sale_datetime__lte=date_filters['end'])
+    sale_details_qs = filter_date_range(sale_details_qs, 'sale__sale_datetime', date_filters)
     
     table_data = [['Date','Product','Category','Qty','Price','Total']]
     for sd in sale_details_qs.order_by('-sale__sale_datetime')[:50]:
         table_data.append([
-            sd.sale.sale_datetime.strftime('%Y-%m-%d'),
+            timezone.localtime(sd.sale.sale_datetime).strftime('%Y-%m-%d'),
             sd.product.product_name if sd.product else '',
             getattr(sd.product.category, 'category_name', '') if getattr(sd.product, 'category', None) else '',
             str(sd.quantity_sold or 0),
@@ -2043,63 +2686,38 @@ def export_report_pdf(request):
     return response
 
 def export_report_csv(request):
-    """Export full report as CSV"""
+    """Export full report as CSV, streaming the sales details"""
     date_filters = get_date_filters(request)
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="sales_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Report header
-    writer.writerow(['SALES REPORT'])
-    if date_filters:
-        date_info = f"Period: {date_filters.get('start', 'All')} to {date_filters.get('end', 'Now')}"
-        writer.writerow([date_info])
-    writer.writerow([])
-    
-    # KPIs section
-    writer.writerow(['KPI SUMMARY'])
-    sales_qs = Sale.objects.all()
-    if 'start' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__lte=date_filters['end'])
-    
-    total_revenue = sales_qs.aggregate(total=Sum('total_amount'))['total'] or 0
-    total_orders = sales_qs.count()
-    avg_order_value = total_revenue / total_orders if total_orders else 0
-    
-    writer.writerow(['Metric', 'Value'])
-    writer.writerow(['Total Revenue', f'UGx. {total_revenue:,.0f}'])
-    writer.writerow(['Total Orders', total_orders])
-    writer.writerow(['Average Order Value', f'UGx. {avg_order_value:,.0f}'])
-    writer.writerow([])
-    
-    # Sales details section
-    writer.writerow(['SALES DETAILS'])
-    writer.writerow(['Date','Product','Category','Qty','Price','Total','Customer'])
-    
-    qs = SaleDetail.objects.select_related('sale','product','product__category','sale__customer')
-    if 'start' in date_filters:
-        qs = qs.filter(sale__sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        qs = qs.filter(sale__sale_datetime__lte=date_filters['end'])
-    
-    for sd in qs.order_by('-sale__sale_datetime'):
-        customer_name = ''
-        if sd.sale.customer:
-            c = sd.sale.customer
-            customer_name = f"{getattr(c,'first_name','')} {getattr(c,'last_name','')}".strip() or getattr(c,'phone','') or getattr(c,'email','')
-        writer.writerow([
-            sd.sale.sale_datetime.strftime('%Y-%m-%d'),
-            sd.product.product_name if sd.product else '',
-            getattr(sd.product.category,'category_name','') if getattr(sd.product,'category',None) else '',
-            sd.quantity_sold or 0,
-            sd.unit_price or 0,
-            (sd.unit_price * sd.quantity_sold) or 0,
-            customer_name
-        ])
-    return response
+
+    def rows():
+        # Report header
+        yield ['SALES REPORT']
+        if date_filters:
+            yield [describe_period(date_filters)]
+        yield []
+
+        # KPIs section
+        yield ['KPI SUMMARY']
+        sales_qs = Sale.objects.all()
+        sales_qs = filter_date_range(sales_qs, 'sale_datetime', date_filters)
+
+        kpis = sales_qs.aggregate(total=Sum('total_amount'), orders=Count('id'))
+        total_revenue = kpis['total'] or 0
+        total_orders = kpis['orders']
+        avg_order_value = total_revenue / total_orders if total_orders else 0
+
+        yield ['Metric', 'Value']
+        yield ['Total Revenue', f'UGx. {total_revenue:,.0f}']
+        yield ['Total Orders', total_orders]
+        yield ['Average Order Value', f'UGx. {avg_order_value:,.0f}']
+        yield []
+
+        # Sales details section
+        yield ['SALES DETAILS']
+        yield ['Date','Product','Category','Qty','Price','Total','Customer']
+        yield from sales_detail_rows(date_filters)
+
+    return streaming_csv_response(f'sales_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv', rows())
 
 def export_report_excel(request):
     """Export full report as Excel"""
@@ -2126,7 +2744,7 @@ def export_report_excel(request):
     # Date range
     row = 2
     if date_filters:
-        date_range = f"Period: {date_filters.get('start', 'All')} to {date_filters.get('end', 'Now')}"
+        date_range = describe_period(date_filters)
         ws[f'A{row}'] = date_range
         ws.merge_cells(f'A{row}:G{row}')
         row += 1
@@ -2135,10 +2753,7 @@ def export_report_excel(request):
     
     # KPI Summary
     sales_qs = Sale.objects.all()
-    if 'start' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        sales_qs = sales_qs.filter(sale_datetime__lte=date_filters['end'])
+    sales_qs = filter_date_range(sales_qs, 'sale_datetime', date_filters)
     
     total_revenue = sales_qs.aggregate(total=Sum('total_amount'))['total'] or 0
     total_orders = sales_qs.count()
@@ -2190,10 +2805,7 @@ def export_report_excel(request):
     
     # Get sales data
     qs = SaleDetail.objects.select_related('sale','product','product__category','sale__customer')
-    if 'start' in date_filters:
-        qs = qs.filter(sale__sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        qs = qs.filter(sale__sale_datetime__lte=date_filters['end'])
+    qs = filter_date_range(qs, 'sale__sale_datetime', date_filters)
     
     for sd in qs.order_by('-sale__sale_datetime'):
         customer_name = ''
@@ -2201,7 +2813,7 @@ def export_report_excel(request):
             c = sd.sale.customer
             customer_name = f"{getattr(c,'first_name','')} {getattr(c,'last_name','')}".strip() or getattr(c,'phone','') or getattr(c,'email','')
         
-        ws[f'A{row}'] = sd.sale.sale_datetime.strftime('%Y-%m-%d')
+        ws[f'A{row}'] = timezone.localtime(sd.sale.sale_datetime).strftime('%Y-%m-%d')
         ws[f'B{row}'] = sd.product.product_name if sd.product else ''
         ws[f'C{row}'] = getattr(sd.product.category,'category_name','') if getattr(sd.product,'category',None) else ''
         ws[f'D{row}'] = sd.quantity_sold or 0
@@ -2243,7 +2855,7 @@ def export_table_pdf(request):
     
     # Date range
     if date_filters:
-        date_info = f"Period: {date_filters.get('start', 'All')} to {date_filters.get('end', 'Now')}"
+        date_info = describe_period(date_filters)
         elements.append(Paragraph(date_info, styles['Normal']))
         elements.append(Spacer(1, 12))
     
@@ -2251,10 +2863,7 @@ def export_table_pdf(request):
     table_data = [['Date','Product','Category','Qty','Price','Total','Customer']]
     
     qs = SaleDetail.objects.select_related('sale','product','product__category','sale__customer')
-    if 'start' in date_filters:
-        qs = qs.filter(sale__sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        qs = qs.filter(sale__sale_datetime__lte=date_filters['end'])
+    qs = filter_date_range(qs, 'sale__sale_datetime', date_filters)
     
     for sd in qs.order_by('-sale__sale_datetime')[:100]:  # Limit for PDF
         customer_name = ''
@@ -2263,7 +2872,7 @@ def export_table_pdf(request):
             customer_name = f"{getattr(c,'first_name','')} {getattr(c,'last_name','')}".strip() or getattr(c,'phone','') or getattr(c,'email','')
         
         table_data.append([
-            sd.sale.sale_datetime.strftime('%Y-%m-%d'),
+            timezone.localtime(sd.sale.sale_datetime).strftime('%Y-%m-%d'),
             sd.product.product_name if sd.product else '',
             getattr(sd.product.category, 'category_name', '') if getattr(sd.product, 'category', None) else '',
             str(sd.quantity_sold or 0),
@@ -2286,35 +2895,14 @@ def export_table_pdf(request):
     return response
 
 def export_table_csv(request):
-    """Export detailed sales table as CSV"""
+    """Export detailed sales table as CSV, streamed in chunks"""
     date_filters = get_date_filters(request)
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="sales_table_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Date','Product','Category','Qty','Price','Total','Customer'])
-    
-    qs = SaleDetail.objects.select_related('sale','product','product__category','sale__customer')
-    if 'start' in date_filters:
-        qs = qs.filter(sale__sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        qs = qs.filter(sale__sale_datetime__lte=date_filters['end'])
-    
-    for sd in qs.order_by('-sale__sale_datetime'):
-        customer_name = ''
-        if sd.sale.customer:
-            c = sd.sale.customer
-            customer_name = f"{getattr(c,'first_name','')} {getattr(c,'last_name','')}".strip() or getattr(c,'phone','') or getattr(c,'email','')
-        writer.writerow([
-            sd.sale.sale_datetime.strftime('%Y-%m-%d'),
-            sd.product.product_name if sd.product else '',
-            getattr(sd.product.category,'category_name','') if getattr(sd.product,'category',None) else '',
-            sd.quantity_sold or 0,
-            sd.unit_price or 0,
-            (sd.unit_price * sd.quantity_sold) or 0,
-            customer_name
-        ])
-    return response
+
+    def rows():
+        yield ['Date','Product','Category','Qty','Price','Total','Customer']
+        yield from sales_detail_rows(date_filters)
+
+    return streaming_csv_response(f'sales_table_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv', rows())
 
 def export_table_excel(request):
     """Export sales table as Excel"""
@@ -2341,7 +2929,7 @@ def export_table_excel(request):
     # Date range
     row = 2
     if date_filters:
-        date_range = f"Period: {date_filters.get('start', 'All')} to {date_filters.get('end', 'Now')}"
+        date_range = describe_period(date_filters)
         ws[f'A{row}'] = date_range
         ws.merge_cells(f'A{row}:G{row}')
         row += 1
@@ -2361,10 +2949,7 @@ def export_table_excel(request):
     
     # Get sales data
     qs = SaleDetail.objects.select_related('sale','product','product__category','sale__customer')
-    if 'start' in date_filters:
-        qs = qs.filter(sale__sale_datetime__gte=date_filters['start'])
-    if 'end' in date_filters:
-        qs = qs.filter(sale__sale_datetime__lte=date_filters['end'])
+    qs = filter_date_range(qs, 'sale__sale_datetime', date_filters)
     
     for sd in qs.order_by('-sale__sale_datetime'):
         customer_name = ''
@@ -2372,7 +2957,7 @@ def export_table_excel(request):
             c = sd.sale.customer
             customer_name = f"{getattr(c,'first_name','')} {getattr(c,'last_name','')}".strip() or getattr(c,'phone','') or getattr(c,'email','')
         
-        ws[f'A{row}'] = sd.sale.sale_datetime.strftime('%Y-%m-%d')
+        ws[f'A{row}'] = timezone.localtime(sd.sale.sale_datetime).strftime('%Y-%m-%d')
         ws[f'B{row}'] = sd.product.product_name if sd.product else ''
         ws[f'C{row}'] = getattr(sd.product.category,'category_name','') if getattr(sd.product,'category',None) else ''
         ws[f'D{row}'] = sd.quantity_sold or 0
@@ -2401,23 +2986,16 @@ def export_table_excel(request):
 # Expiry Management Views
 def expiry_preview(request):
     """Preview expiring products and allow manual write-off"""
-    from datetime import date
-    
-    today = date.today()
-    
     # Get expired products with stock
-    expired_products = Product.objects.filter(
-        expiry_date__lt=today,
-        stock_quantity__gt=0
-    ).select_related('category', 'supplier')
+    expired = expired_products().select_related('category', 'supplier')
     
-    # Calculate total potential loss
-    total_loss = sum(product.stock_quantity * product.unit_cost for product in expired_products)
+    # Count and total potential loss in one query
+    summary = expired_stock_summary()
     
     context = {
-        'expired_products': expired_products,
-        'total_loss': total_loss,
-        'product_count': expired_products.count()
+        'expired_products': expired,
+        'total_loss': summary['total_loss'],
+        'product_count': summary['product_count']
     }
     
     return render(request, 'inventory/expiry_confirm.html', context)
@@ -2428,63 +3006,17 @@ def execute_expiry_writeoff(request):
     if request.method != 'POST':
         return redirect('expiry_preview')
     
-    from django.db import transaction
-    from datetime import date
-    
-    today = date.today()
-    
-    # Get expired products with stock
-    expired_products = Product.objects.filter(
-        expiry_date__lt=today,
-        stock_quantity__gt=0
-    )
-    
-    if not expired_products.exists():
+    if not expired_products().exists():
         messages.info(request, 'No expired products found to write off')
         return redirect('expiry_preview')
     
     # Get staff member (you might want to get from session or request)
-    try:
-        staff = Staff.objects.get(username='system')
-    except Staff.DoesNotExist:
-        staff = Staff.objects.create(
-            first_name='System',
-            last_name='User',
-            role='Admin',
-            username='system',
-            password_hash='system_user'
-        )
-    
-    # Process write-offs in a transaction
-    with transaction.atomic():
-        total_loss = 0
-        processed_count = 0
-        
-        for product in expired_products:
-            # Create inventory log entry
-            InventoryLog.objects.create(
-                staff=staff,
-                product=product,
-                log_type='Adjustment',
-                quantity=-product.stock_quantity,
-                remarks='expiry_writeoff',
-                log_date=timezone.now()
-            )
-            
-            # Calculate loss
-            loss_amount = product.stock_quantity * product.unit_cost
-            total_loss += loss_amount
-            
-            # Set stock quantity to 0
-            product.stock_quantity = 0
-            product.save()
-            
-            processed_count += 1
+    result = write_off_expired(get_system_staff())
     
     messages.success(
         request,
-        f'Successfully wrote off {processed_count} expired products. '
-        f'Total loss: ${total_loss:.2f}'
+        f"Successfully wrote off {result['count']} expired products. "
+        f"Total loss: ${result['total_loss']:.2f}"
     )
     
     return redirect('expiry_preview')
@@ -2495,29 +3027,11 @@ def expiry_reports_api(request):
     from datetime import datetime, date
     from django.db.models import Sum, F
     
-    # Get date range parameters
-    start_date = request.GET.get('start')
-    end_date = request.GET.get('end')
-    
     # Build query for expiry write-off logs
-    logs = InventoryLog.objects.filter(
-        remarks__icontains='expiry_writeoff'
-    ).select_related('product', 'staff')
+    logs = InventoryLog.objects.filter(reason='expiry').select_related('product', 'staff')
     
-    # Apply date filters
-    if start_date:
-        try:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-            logs = logs.filter(log_date__date__gte=start_dt)
-        except ValueError:
-            pass
-    
-    if end_date:
-        try:
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-            logs = logs.filter(log_date__date__lte=end_dt)
-        except ValueError:
-            pass
+    # Apply date filters (invalid dates are ignored)
+    logs = filter_date_range(logs, 'log_date', get_date_filters(request, 'start', 'end'))
     
     # Calculate total loss
     total_loss = sum(
@@ -2543,94 +3057,35 @@ def expiry_reports_api(request):
         'total_loss': float(total_loss),
         'count': logs.count()
     }
-    
+    return JsonResponse(data)
+
 # ---------------------------------------------------------
 # DISCOUNT AUTO-APPLICATION LOGIC
 # ---------------------------------------------------------
 
-def get_applicable_discounts(sale_total=None, sale_date=None):
-    """
-    Get all applicable discounts for a sale.
-    This function can be called when creating sales to automatically apply discounts.
-    """
-    if sale_date is None:
-        sale_date = now().date()
-    
-    # Get active discounts that are valid for the given date
-    applicable_discounts = Discount.objects.filter(
-        is_active=True,
-        start_date__lte=sale_date,
-        end_date__gte=sale_date
-    ).order_by('-value')  # Apply highest value discounts first
-    
-    # If sale_total is provided, filter by minimum amount requirements
-    if sale_total is not None:
-        # For now, we'll apply all applicable discounts
-        # In a more complex system, you might have minimum purchase requirements
-        pass
-    
-    return applicable_discounts
-
-
-def calculate_discount_amount(discount, sale_total):
-    """
-    Calculate the discount amount based on discount type and sale total.
-    """
-    if discount.discount_type == 'Percentage':
-        return Decimal(str(sale_total)) * (discount.value / 100)
-    elif discount.discount_type == 'Fixed':
-        return min(discount.value, Decimal(str(sale_total)))  # Can't discount more than sale total
-    elif discount.discount_type == 'BOGO':
-        # For BOGO, this is a simplified implementation
-        # In a real system, you'd need to track individual items
-        return Decimal(str(sale_total)) * (discount.value / (discount.value + 1))
-    else:
-        return Decimal('0')
-
-
-def apply_automatic_discounts(sale_instance):
+def apply_automatic_discounts(sale_instance, details):
     """
-    Apply automatic discounts to a sale instance.
-    This should be called after creating a sale but before saving.
+    Price an unsaved sale with the promotions running on its date, before
+    checkout_sale() saves it, so line discounts, sub_totals and the
+    discounted total all go in with the sale itself. Rules come from the
+    in-memory discount index; no queries.
     """
-    sale_total = float(sale_instance.total_amount)
-    sale_date = sale_instance.sale_datetime.date()
-    
-    applicable_discounts = get_applicable_discounts(sale_total, sale_date)
-    
-    total_discount_amount = Decimal('0')
-    applied_discounts = []
-    
-    for discount in applicable_discounts:
-        discount_amount = calculate_discount_amount(discount, sale_total)
-        
-        # Apply discount if it's meaningful (more than 0)
-        if discount_amount > 0:
-            total_discount_amount += discount_amount
-            applied_discounts.append({
-                'discount': discount,
-                'amount': discount_amount
-            })
-            
-            # Prevent over-discounting
-            if total_discount_amount >= Decimal(str(sale_total)):
-                total_discount_amount = Decimal(str(sale_total))
-                break
-    
-    # Update sale total with discount applied
-    if total_discount_amount > 0:
-        new_total = Decimal(str(sale_total)) - total_discount_amount
-        sale_instance.total_amount = new_total
-        sale_instance.save()
-        
-        # Store applied discounts (you might want to create a SaleDiscount model for this)
+    on_date = timezone.localtime(sale_instance.sale_datetime).date()
+    pricing = discounts.price_basket(details, on_date)
+
+    sale_instance.total_amount = pricing['total']
+    # Sale-level discount only; line promotions are in each discount_value
+    if pricing['basket'] > 0:
+        sale_instance.discount_applied = pricing['basket']
+    if sale_instance.discount_id is None and pricing['basket_discount']:
+        sale_instance.discount = pricing['basket_discount']
+    if pricing['applied']:
         return {
-            'original_total': sale_total,
-            'discount_amount': float(total_discount_amount),
-            'new_total': float(new_total),
-            'applied_discounts': applied_discounts
+            'original_total': pricing['gross'],
+            'discount_amount': pricing['lines'] + pricing['basket'],
+            'new_total': pricing['total'],
+            'applied_discounts': pricing['applied']
         }
-    
     return None
 
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -88,6 +89,45 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Per-process memory by default. Point this at Redis
+# ('django.core.cache.backends.redis.RedisCache') to share cached KPIs
+# and their invalidation across workers.
+
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'supermarket',
+  }
+}
+
+# Seconds a cached dashboard KPI payload may be served before recomputing
+KPI_CACHE_TIMEOUT = 60
+
+# Pub/sub behind the /api/live/ server-sent events stream (served through
+# supermarket.asgi). The in-process broker only reaches clients connected
+# to the same worker process.
+LIVE_EVENTS_BACKEND = 'inventory.events.InProcessBroker'
+
+# Receipts: default thermal roll width in mm (58 or 80), how many rendered
+# receipts each process keeps for free reprints, and for how many seconds.
+# An edited sale is re-rendered at once by the process that saved it;
+# other workers keep their copy until it expires.
+RECEIPT_PAPER_WIDTH = 80
+RECEIPT_CACHE_SIZE = 512
+RECEIPT_CACHE_TTL = 300
+
+# Seconds a process prices from its in-memory discount index before
+# reloading it. Discount edits reach the editing process (and any process
+# sharing CACHES) at once; other workers see them within this time.
+DISCOUNT_INDEX_MAX_AGE = 60
+
+# Seconds stock held for a basket being scanned stays held without being
+# renewed (expired holds are swept by the release_expired_holds command)
+STOCK_HOLD_TTL = 300
+
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,10 +170,23 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Set EMAIL_BACKEND=django.core.mail.backends.filebased.EmailBackend (writes
+# to EMAIL_FILE_PATH) or ...console.EmailBackend to try mail locally
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = 'melissavioletvs@gmail.com'
 EMAIL_HOST_PASSWORD = 'bwkw hdhq bqej pgzb'
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+# Supplier emails go through the outbox table. Run
+# `manage.py send_outbox --loop` as a worker for sending and retries; with
+# OUTBOX_SEND_IN_PROCESS the web process also sends new emails right away
+# on a background thread.
+OUTBOX_SEND_IN_PROCESS = True
+OUTBOX_MAX_ATTEMPTS = 5
+# Seconds before the first retry; doubles per attempt up to the maximum
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_MAX_RETRY_DELAY = 3600